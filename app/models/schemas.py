@@ -15,6 +15,7 @@ class Sample(BaseModel):
     rooms: Optional[float] = Field(None, ge=0)
     bedrooms: Optional[float] = Field(None, ge=0)
     bathrooms: Optional[float] = Field(None, ge=0)
+    l2: Optional[str] = Field(None, description="Provincia o región (ej: Capital Federal); la usa el modelo nacional")
     l3: Optional[str] = Field(None, description="Barrio o zona (ej: Almagro)")
     lon: Optional[float] = Field(None, description="Longitud geográfica")
     lat: Optional[float] = Field(None, description="Latitud geográfica")
@@ -75,7 +76,60 @@ class Sample(BaseModel):
     }
 
 # response
+# banda de predicción (?interval=true): cuantiles de las predicciones de los árboles del RandomForest
+class PredictionInterval(BaseModel):
+    lower: float
+    upper: float
+    lower_quantile: float
+    upper_quantile: float
+
 class PredictionOut(BaseModel):
     predicted_price: float
     currency: str
     latency_ms: float
+    interval: Optional[PredictionInterval] = None
+
+# response de predicción por lotes: un resultado por fila, en el mismo orden del request
+class BatchItemOut(BaseModel):
+    index: int
+    predicted_price: Optional[float] = None
+    currency: str
+    error: Optional[str] = None
+    interval: Optional[PredictionInterval] = None
+
+class BatchPredictionOut(BaseModel):
+    results: list[BatchItemOut]
+    n_ok: int
+    n_errors: int
+    latency_ms: float
+
+# response de comparables: avisos del dataset de entrenamiento, del más al menos parecido
+class ComparableOut(BaseModel):
+    id: Optional[int] = None
+    price: float
+    currency: str
+    price_per_m2: float
+    operation_type: str
+    property_type: str
+    l3: Optional[str] = None
+    lat: float
+    lon: float
+    surface_total: float
+    surface_covered: Optional[float] = None
+    rooms: Optional[float] = None
+    bedrooms: Optional[float] = None
+    bathrooms: Optional[float] = None
+    distance_km: float = Field(..., description="Distancia a la propiedad consultada")
+    score: float = Field(..., description="Distancia combinada (ubicación, superficie, ambientes); menor = más parecido")
+
+class ComparablesReference(BaseModel):
+    lat: float
+    lon: float
+    located_by: str = Field(..., description="coordinates (lat/lon del Sample) o l3 (centro del barrio)")
+    rooms: float
+
+class ComparablesOut(BaseModel):
+    comparables: list[ComparableOut]
+    k: int
+    reference: ComparablesReference
+    latency_ms: float
@@ -0,0 +1,286 @@
+import hashlib
+import json
+import os
+import zipfile
+from contextlib import ExitStack
+from datetime import datetime, timezone
+import requests
+from requests.auth import HTTPBasicAuth
+from app.utils.config import KAGGLE_API_BASE_URL, DOWNLOAD_CHUNK_BYTES, DOWNLOAD_MAX_RETRIES
+from app.utils.log_config import logger
+
+'''
+GESTOR DE DESCARGAS DEL DATASET DE KAGGLE
+- guarda en un archivo de estado la versión del dataset y el sha256 del CSV descargado
+- si la versión de Kaggle no cambió, no descarga nada
+- el zip se baja a un .part y se reanuda con HTTP Range si la descarga se corta
+- el CSV se descomprime por bloques directo en RAW_DIR (.tmp), se verifica y recién ahí se renombra
+- si el contenido (sha256) es el mismo que ya teníamos, no hace falta actualizar la DB
+El cliente es inyectable y KAGGLE_API_BASE_URL permite apuntar a un servidor local para probar sin red.
+'''
+
+class DownloadError(Exception):
+    """La descarga o la verificación del dataset falló."""
+
+
+def kaggle_credentials() -> tuple[str, str] | None:
+    """Credenciales de Kaggle desde variables de entorno o ~/.kaggle/kaggle.json."""
+    username = os.getenv("KAGGLE_USERNAME")
+    key = os.getenv("KAGGLE_KEY")
+
+    kaggle_json_path = os.path.expanduser("~/.kaggle/kaggle.json")
+    if not (username and key) and os.path.exists(kaggle_json_path):
+        try:
+            with open(kaggle_json_path, "r") as f:
+                creds = json.load(f)
+                username = creds.get("username")
+                key = creds.get("key")
+        except Exception as e:
+            logger.warning(f"No se pudo leer {kaggle_json_path}: {e}")
+
+    if not (username and key):
+        return None
+    return username, key
+
+
+class KaggleClient:
+    """Cliente HTTP mínimo de la API de Kaggle (metadatos y descarga por versión)."""
+
+    def __init__(self, username: str, key: str, base_url: str = KAGGLE_API_BASE_URL, timeout: float = 60):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.auth = HTTPBasicAuth(username, key)
+
+    @classmethod
+    def from_env(cls):
+        """Arma el cliente con las credenciales disponibles (None si no hay)."""
+        creds = kaggle_credentials()
+        if creds is None:
+            logger.warning("No hay credenciales de Kaggle disponibles. Se omitirá la descarga.")
+            return None
+        return cls(*creds)
+
+    def dataset_metadata(self, dataset_slug: str) -> dict:
+        """
+        Versión y fecha de actualización del dataset.
+        Devuelve {"version": str, "last_updated": datetime | None}.
+        """
+        response = self.session.get(f"{self.base_url}/datasets/view/{dataset_slug}", timeout=self.timeout)
+        response.raise_for_status()
+        metadata = response.json()
+        last_updated = _parse_kaggle_date(metadata.get("lastUpdated"))
+        version = metadata.get("currentVersionNumber") or metadata.get("versionNumber")
+        if version is None:
+            # sin número de versión se usa la fecha como identificador
+            version = metadata.get("lastUpdated")
+        if version is None:
+            raise DownloadError("La API de Kaggle no informó versión ni fecha del dataset.")
+        return {"version": str(version), "last_updated": last_updated}
+
+    def open_download(self, dataset_slug: str, version: str, offset: int = 0):
+        """Abre la descarga del zip de una versión; con offset > 0 pide solo el resto (Range)."""
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        params = {"datasetVersionNumber": version} if version.isdigit() else None
+        response = self.session.get(
+            f"{self.base_url}/datasets/download/{dataset_slug}",
+            params=params, headers=headers, stream=True, timeout=self.timeout,
+        )
+        response.raise_for_status()
+        return response
+
+
+def _parse_kaggle_date(value: str | None) -> datetime | None:
+    if not value:
+        return None
+    for fmt in ("%Y-%m-%dT%H:%M:%S.%fZ", "%Y-%m-%dT%H:%M:%SZ"):
+        try:
+            return datetime.strptime(value, fmt).replace(tzinfo=timezone.utc)
+        except ValueError:
+            continue
+    logger.warning(f"No se pudo interpretar la fecha 'lastUpdated': {value}")
+    return None
+
+
+class DatasetDownloader:
+    """
+    Sincroniza un archivo de un dataset de Kaggle con RAW_DIR.
+    client: KaggleClient (o cualquier objeto con dataset_metadata / open_download).
+    validate(path): verificación extra del CSV antes del renombre; lanza excepción si no sirve.
+    """
+
+    def __init__(self, client, raw_dir: str, state_path: str | None = None, validate=None):
+        self.client = client
+        self.raw_dir = raw_dir
+        self.state_path = state_path or os.path.join(raw_dir, "kaggle_state.json")
+        self.validate = validate
+
+    def load_state(self) -> dict:
+        if not os.path.exists(self.state_path):
+            return {}
+        try:
+            with open(self.state_path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Estado de descarga ilegible ({e}). Se ignora.")
+            return {}
+
+    def _save_state(self, state: dict):
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def sync(self, dataset_slug: str, file_name: str, target_name) -> dict:
+        """
+        Trae la versión actual de file_name si hace falta.
+        target_name(metadata) -> nombre final del CSV en raw_dir.
+        Devuelve {"path", "changed", "version", "sha256", "last_updated"};
+        changed=False si no se descargó nada o el contenido era el mismo.
+        """
+        metadata = self.client.dataset_metadata(dataset_slug)
+        version = metadata["version"]
+        state = self.load_state()
+        current = state.get("path")
+        have_current = bool(current) and os.path.exists(current) and os.path.getsize(current) == state.get("size")
+
+        if have_current and state.get("dataset") == dataset_slug and state.get("version") == version:
+            logger.info(f"Dataset {dataset_slug} sin cambios (versión {version}). No se descarga.")
+            return self._result(state, changed=False)
+
+        logger.info(f"Descargando {dataset_slug} versión {version} (local: {state.get('version')})...")
+        safe_version = "".join(c if c.isalnum() else "_" for c in version)
+        zip_path = os.path.join(self.raw_dir, f"{dataset_slug.replace('/', '_')}-v{safe_version}.zip.part")
+        self._download(dataset_slug, version, zip_path)
+
+        tmp_path = os.path.join(self.raw_dir, f".{file_name}.tmp")
+        sha256, size = self._extract(zip_path, file_name, tmp_path)
+        try:
+            if self.validate is not None:
+                self.validate(tmp_path)
+        except Exception as e:
+            os.remove(tmp_path)
+            os.remove(zip_path)
+            raise DownloadError(f"El CSV descargado no pasó la verificación: {e}") from e
+
+        new_state = {
+            "dataset": dataset_slug,
+            "version": version,
+            "last_updated": metadata["last_updated"].isoformat() if metadata["last_updated"] else None,
+            "sha256": sha256,
+            "size": size,
+            "downloaded_at": datetime.now(timezone.utc).isoformat(),
+        }
+        if have_current and state.get("sha256") == sha256:
+            # versión nueva en Kaggle pero mismo contenido: se conserva el archivo actual
+            logger.info(f"La versión {version} tiene el mismo contenido (sha256). No se actualiza el CSV.")
+            os.remove(tmp_path)
+            changed = False
+            new_state["path"] = current
+        else:
+            final_path = os.path.join(self.raw_dir, target_name(metadata))
+            os.replace(tmp_path, final_path)
+            logger.info(f"Descarga verificada y guardada en {final_path} (sha256 {sha256[:12]}...).")
+            if have_current and current != final_path:
+                try:
+                    os.remove(current)
+                    logger.info(f"Archivo local antiguo ({current}) eliminado.")
+                except OSError as e:
+                    logger.warning(f"No se pudo eliminar el archivo antiguo {current}: {e}")
+            changed = True
+            new_state["path"] = final_path
+        os.remove(zip_path)
+        self._save_state(new_state)
+        return self._result(new_state, changed=changed)
+
+    @staticmethod
+    def _result(state: dict, changed: bool) -> dict:
+        return {
+            "path": state.get("path"),
+            "changed": changed,
+            "version": state.get("version"),
+            "sha256": state.get("sha256"),
+            "last_updated": state.get("last_updated"),
+        }
+
+    def _download(self, dataset_slug: str, version: str, zip_path: str):
+        """Baja el zip a zip_path reanudando desde lo que ya haya en disco."""
+        for attempt in range(1, DOWNLOAD_MAX_RETRIES + 1):
+            offset = os.path.getsize(zip_path) if os.path.exists(zip_path) else 0
+            try:
+                with self.client.open_download(dataset_slug, version, offset) as response:
+                    if offset and response.status_code != 206:
+                        # el servidor no soporta Range: se empieza de cero
+                        logger.warning("El servidor no aceptó la descarga parcial. Se descarga completo.")
+                        offset = 0
+                    expected = _expected_size(response, offset)
+                    if offset:
+                        logger.info(f"Reanudando descarga desde {offset / 1024**2:.1f} MB.")
+                    with open(zip_path, "ab" if offset else "wb") as f:
+                        for block in response.iter_content(chunk_size=DOWNLOAD_CHUNK_BYTES):
+                            f.write(block)
+                size = os.path.getsize(zip_path)
+                if expected is not None and size != expected:
+                    raise DownloadError(f"Descarga incompleta: {size} de {expected} bytes.")
+                return
+            except requests.HTTPError as e:
+                if e.response is not None and e.response.status_code == 416 and offset:
+                    # Range fuera del archivo: lo que hay en disco ya está completo (o no sirve)
+                    if zipfile.is_zipfile(zip_path):
+                        return
+                    os.remove(zip_path)
+                elif e.response is not None and e.response.status_code < 500:
+                    raise DownloadError(f"Falló la descarga de Kaggle: {e}") from e
+                logger.warning(f"Descarga interrumpida (intento {attempt}/{DOWNLOAD_MAX_RETRIES}): {e}")
+            except (requests.RequestException, DownloadError) as e:
+                logger.warning(f"Descarga interrumpida (intento {attempt}/{DOWNLOAD_MAX_RETRIES}): {e}")
+        raise DownloadError(
+            f"No se pudo completar la descarga tras {DOWNLOAD_MAX_RETRIES} intentos. "
+            f"El archivo parcial queda en {zip_path} para reanudar."
+        )
+
+    def _extract(self, zip_path: str, file_name: str, out_path: str) -> tuple[str, int]:
+        """
+        Descomprime file_name por bloques en out_path calculando el sha256 al vuelo.
+        Si lo descargado no es un zip, se toma como el CSV directamente.
+        """
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with ExitStack() as stack:
+                if zipfile.is_zipfile(zip_path):
+                    archive = stack.enter_context(zipfile.ZipFile(zip_path))
+                    names = archive.namelist()
+                    member = file_name if file_name in names else next(
+                        (n for n in names if os.path.basename(n) == file_name), None
+                    )
+                    if member is None:
+                        raise DownloadError(f"{file_name} no está en el zip ({', '.join(names)}).")
+                    # ZipFile verifica el CRC al terminar de leer el miembro
+                    src = stack.enter_context(archive.open(member))
+                else:
+                    src = stack.enter_context(open(zip_path, "rb"))
+                dst = stack.enter_context(open(out_path, "wb"))
+                for block in iter(lambda: src.read(DOWNLOAD_CHUNK_BYTES), b""):
+                    dst.write(block)
+                    digest.update(block)
+                    size += len(block)
+        except (zipfile.BadZipFile, OSError) as e:
+            if os.path.exists(out_path):
+                os.remove(out_path)
+            os.remove(zip_path)
+            raise DownloadError(f"El archivo descargado está dañado: {e}") from e
+        return digest.hexdigest(), size
+
+
+def _expected_size(response, offset: int) -> int | None:
+    """Tamaño total esperado del archivo según Content-Range / Content-Length."""
+    content_range = response.headers.get("Content-Range")
+    if content_range and "/" in content_range:
+        total = content_range.rsplit("/", 1)[1]
+        if total.isdigit():
+            return int(total)
+    length = response.headers.get("Content-Length")
+    if length and length.isdigit():
+        return offset + int(length)
+    return None
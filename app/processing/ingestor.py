@@ -1,17 +1,23 @@
-import duckdb
 import os
 import pandas as pd
 from dotenv import load_dotenv
 from datetime import datetime, timezone
 import glob
 import re
+import resource
+import shutil
+import time
+from app.utils.config import (
+    INGEST_MODE, INGEST_MEMORY_LIMIT, INGEST_THREADS, DB_PATH,
+    LAKE_DIR, LAKE_PARTITION_BY, LAKE_ROW_GROUP_SIZE,
+)
+from app.processing.downloader import DatasetDownloader, KaggleClient
+from app.utils.jobs import JobContext, JobCancelled
+from app.utils.db import connection, publish_snapshot, snapshot_lake_files, lake_source
 from app.utils.log_config import logger
 
 # --- CONFIGURACIÓN DE RUTAS Y DATOS ---
-DB_PATH = "app/data/DB/entrenamiento.duckdb"
 RAW_DIR = "app/data/artifacts/RAW"
-PARQUET_DIR = "app/data/artifacts/parquet"
-PARQUET_PATH = os.path.join(PARQUET_DIR, "entrenamiento.parquet")
 
 LEGACY_CSV_PATH = os.path.join(RAW_DIR, "entrenamiento.csv")
 KAGGLE_FILE_BASE = "entrenamiento"
@@ -19,6 +25,37 @@ VERSIONED_CSV_PATTERN = os.path.join(RAW_DIR, f"{KAGGLE_FILE_BASE}-*.csv")
 DATE_FORMAT = "%Y-%m-%d"
 KAGGLE_DATASET = "alejandroczernikier/properati-argentina-dataset"
 KAGGLE_FILE_NAME = "entrenamiento.csv"
+# tablas de control que se copian al snapshot junto con la lista de archivos del lago
+SNAPSHOT_TABLES = ["ingest_versions"]
+
+# Esquema explícito del CSV de Properati (read_csv no infiere tipos)
+PROPERATI_SCHEMA = {
+    "id": "BIGINT",
+    "ad_type": "VARCHAR",
+    "start_date": "DATE",
+    "end_date": "DATE",
+    "created_on": "DATE",
+    "lat": "DOUBLE",
+    "lon": "DOUBLE",
+    "l1": "VARCHAR",
+    "l2": "VARCHAR",
+    "l3": "VARCHAR",
+    "l4": "VARCHAR",
+    "l5": "VARCHAR",
+    "l6": "VARCHAR",
+    "rooms": "DOUBLE",
+    "bedrooms": "DOUBLE",
+    "bathrooms": "DOUBLE",
+    "surface_total": "DOUBLE",
+    "surface_covered": "DOUBLE",
+    "currency": "VARCHAR",
+    "price_period": "VARCHAR",
+    "title": "VARCHAR",
+    "description": "VARCHAR",
+    "property_type": "VARCHAR",
+    "operation_type": "VARCHAR",
+    "price": "DOUBLE",
+}
 
 # Cargar variables de entorno desde .env
 load_dotenv()
@@ -29,7 +66,7 @@ def ensure_directories():
     """Crea los directorios necesarios si no existen."""
     logger.info("Asegurando directorios de datos...")
     os.makedirs(RAW_DIR, exist_ok=True)
-    os.makedirs(PARQUET_DIR, exist_ok=True)
+    os.makedirs(LAKE_DIR, exist_ok=True)
     db_dir = os.path.dirname(DB_PATH)
     os.makedirs(db_dir, exist_ok=True)
 
@@ -56,179 +93,445 @@ def find_latest_local_versioned_file(pattern: str, date_format: str):
     return latest_file, latest_date
 
 
-def run_duckdb_pipeline(csv_path_to_load: str):
-    """Carga el CSV en DuckDB (datos_raw) y genera un Parquet."""
-    if not os.path.exists(csv_path_to_load):
-        logger.error(f"ERROR: No existe {csv_path_to_load}.")
-        raise FileNotFoundError(
-            f"Archivo CSV no encontrado en la ruta: {csv_path_to_load}"
+def _table_exists(con, name: str) -> bool:
+    return con.execute(
+        "SELECT count(*) FROM information_schema.tables WHERE table_name = ?", [name]
+    ).fetchone()[0] > 0
+
+
+def _ensure_ingest_tables(con):
+    """Tablas de control de la ingesta incremental."""
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS ingest_versions (
+            ingest_id INTEGER, source_file VARCHAR, mode VARCHAR, applied_at TIMESTAMP,
+            rows_total BIGINT, inserted BIGINT, updated BIGINT, deleted BIGINT,
+            unchanged BIGINT, duration_s DOUBLE
         )
+        """
+    )
+    for column in ("rows_per_s", "mb_per_s", "peak_rss_mb"):
+        con.execute(f"ALTER TABLE ingest_versions ADD COLUMN IF NOT EXISTS {column} DOUBLE")
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS datos_tombstones (
+            id BIGINT, row_hash UBIGINT, ingest_id INTEGER, removed_at TIMESTAMP
+        )
+        """
+    )
 
-    logger.info(f"Conectando a DuckDB en {DB_PATH}...")
+
+def _configure_streaming(con):
+    """Memoria e hilos acotados; sin orden de inserción, DuckDB no tiene que bufferear para respetarlo."""
+    con.execute(f"SET memory_limit = '{INGEST_MEMORY_LIMIT}'")
+    con.execute(f"SET threads = {INGEST_THREADS}")
+    con.execute("SET preserve_insertion_order = false")
+
+
+def _csv_source(csv_path: str) -> str:
+    """read_csv con dialecto y esquema fijos: se lee en streaming y sin sniffing de tipos."""
+    columns = ", ".join(f"'{name}': '{col_type}'" for name, col_type in PROPERATI_SCHEMA.items())
+    return (
+        f"read_csv('{csv_path}', header = true, auto_detect = false, delim = ',', "
+        f"quote = '\"', escape = '\"', dateformat = '%Y-%m-%d', columns = {{{columns}}})"
+    )
+
+
+def _stage_csv(con, csv_path: str):
+    """
+    Lee el CSV a una tabla temporal con el hash del contenido de cada fila
+    (hash() de DuckDB sobre la fila completa: 64 bits, mucho más barato que md5 sobre el texto).
+    """
+    con.execute(
+        f"""
+        CREATE OR REPLACE TEMP TABLE datos_staging AS
+        SELECT *, hash(r) AS row_hash
+        FROM {_csv_source(csv_path)} r
+        """
+    )
+
+
+def _has_previous_version(con) -> bool:
+    if _table_exists(con, "datos_raw") and _table_exists(con, "datos_raw_hash"):
+        return True
+    logger.info("No hay versión previa de datos_raw. Se hace una carga completa.")
+    return False
+
+
+def _can_apply_incremental(con) -> bool:
+    """
+    La carga incremental necesita el mismo esquema y el mismo tipo de hash que la versión
+    anterior, y ids únicos no nulos en el CSV nuevo.
+    """
+    hash_type = con.execute(
+        "SELECT column_type FROM (DESCRIBE datos_raw_hash) WHERE column_name = 'row_hash'"
+    ).fetchone()
+    if hash_type is None or hash_type[0] != "UBIGINT":
+        logger.warning("Los hashes guardados son de otro formato. Se hace una carga completa.")
+        return False
+    old_schema = con.execute("DESCRIBE datos_raw").fetchall()
+    new_schema = con.execute("DESCRIBE SELECT * EXCLUDE (row_hash) FROM datos_staging").fetchall()
+    if [c[:2] for c in old_schema] != [c[:2] for c in new_schema]:
+        logger.warning("El esquema del CSV cambió respecto de datos_raw. Se hace una carga completa.")
+        return False
+    total, distinct_ids = con.execute(
+        "SELECT count(*), count(DISTINCT id) FROM datos_staging"
+    ).fetchone()
+    if total != distinct_ids:
+        logger.warning("El CSV tiene ids nulos o repetidos. Se hace una carga completa.")
+        return False
+    return True
+
+
+def _full_load(con, source: str, ingest_id: int) -> tuple[dict, list[str]]:
+    """
+    Carga completa: source (el CSV en streaming o el staging) -> lago Parquet -> datos_raw.
+    El CSV se recorre una sola vez; la tabla y los hashes se arman leyendo el lago.
+    Devuelve (resumen, archivos del lago de la versión).
+    """
+    files = write_lake(con, source)
+    con.execute(
+        f"CREATE OR REPLACE TABLE datos_raw AS SELECT {', '.join(PROPERATI_SCHEMA)} FROM {lake_source(files)}"
+    )
+    con.execute(
+        f"""
+        CREATE OR REPLACE TABLE datos_raw_hash AS
+        SELECT id, hash(r) AS row_hash, {ingest_id} AS ingest_id FROM datos_raw r
+        """
+    )
+    con.execute("DELETE FROM datos_tombstones WHERE id IN (SELECT id FROM datos_raw)")
+    rows = con.execute("SELECT count(*) FROM datos_raw").fetchone()[0]
+    return {"rows_total": rows, "inserted": rows, "updated": 0, "deleted": 0, "unchanged": 0}, files
+
+
+def _incremental_load(con, ingest_id: int) -> dict:
+    """
+    Aplica solo el delta contra la versión anterior: filas nuevas o con hash distinto
+    se borran e insertan (upsert) y los ids que ya no vienen pasan a datos_tombstones.
+    """
+    con.execute(
+        """
+        CREATE OR REPLACE TEMP TABLE datos_delta AS
+        SELECT s.id, h.id IS NULL AS is_new
+        FROM datos_staging s LEFT JOIN datos_raw_hash h USING (id)
+        WHERE h.id IS NULL OR h.row_hash <> s.row_hash
+        """
+    )
+    con.execute(
+        """
+        CREATE OR REPLACE TEMP TABLE datos_removed AS
+        SELECT h.id, h.row_hash FROM datos_raw_hash h ANTI JOIN datos_staging s USING (id)
+        """
+    )
+    rows_total, = con.execute("SELECT count(*) FROM datos_staging").fetchone()
+    inserted, updated = con.execute(
+        "SELECT count(*) FILTER (is_new), count(*) FILTER (NOT is_new) FROM datos_delta"
+    ).fetchone()
+    deleted, = con.execute("SELECT count(*) FROM datos_removed").fetchone()
+    stats = {
+        "rows_total": rows_total, "inserted": inserted, "updated": updated,
+        "deleted": deleted, "unchanged": rows_total - inserted - updated,
+    }
+    if not (inserted or updated or deleted):
+        return stats
+
+    # particiones del lago tocadas por el delta (valores viejos y nuevos)
+    keys = ", ".join(LAKE_PARTITION_BY)
+    con.execute(
+        f"""
+        CREATE OR REPLACE TEMP TABLE lake_affected AS
+        SELECT DISTINCT {keys} FROM datos_raw
+        WHERE id IN (SELECT id FROM datos_delta UNION ALL SELECT id FROM datos_removed)
+        UNION
+        SELECT DISTINCT {keys} FROM datos_staging SEMI JOIN datos_delta USING (id)
+        """
+    )
+
+    con.begin()
     try:
-        con = duckdb.connect(DB_PATH)
+        for table in ("datos_raw", "datos_raw_hash"):
+            con.execute(
+                f"""
+                DELETE FROM {table} WHERE id IN (
+                    SELECT id FROM datos_delta UNION ALL SELECT id FROM datos_removed
+                )
+                """
+            )
+        con.execute(
+            """
+            INSERT INTO datos_raw BY NAME
+            SELECT * EXCLUDE (row_hash) FROM datos_staging SEMI JOIN datos_delta USING (id)
+            """
+        )
         con.execute(
             f"""
-            CREATE OR REPLACE TABLE datos_raw AS 
-            SELECT * FROM read_csv_auto('{csv_path_to_load}')
+            INSERT INTO datos_raw_hash
+            SELECT id, row_hash, {ingest_id} FROM datos_staging SEMI JOIN datos_delta USING (id)
             """
         )
-        logger.info("Tabla 'datos_raw' actualizada.")
-
+        # ids que vuelven a aparecer dejan de estar dados de baja
+        con.execute("DELETE FROM datos_tombstones WHERE id IN (SELECT id FROM datos_delta)")
         con.execute(
             f"""
-            COPY (
-                SELECT * FROM datos_raw
-            ) TO '{PARQUET_PATH}' (FORMAT PARQUET, OVERWRITE_OR_IGNORE TRUE)
+            INSERT INTO datos_tombstones
+            SELECT id, row_hash, {ingest_id}, current_timestamp FROM datos_removed
             """
         )
-        logger.info(f"Parquet generado en {PARQUET_PATH}.")
-    except Exception as e:
-        logger.error(f"Error durante el pipeline de DuckDB: {e}")
+        con.commit()
+    except Exception:
+        con.rollback()
         raise
-    finally:
-        if "con" in locals():
-            con.close()
+    return stats
 
 
-#  LÓGICA DE KAGGLE  
-def _kaggle_api_logic(local_filepath: str | None, local_date: datetime | None) -> tuple[str | None, bool]:
+def _lake_copy(con, source: str, where: str, out_dir: str, sort: bool = False):
     """
-    Contiene TODA la lógica que requiere la API de Kaggle y la función requests.
-    Solo se llama si el archivo legacy no existe.
-    Devuelve: (file_to_process, needs_db_update)
+    Exporta las filas de source al dataset particionado, en archivos con nombre único
+    (los de una versión nueva nunca pisan a los que puede estar leyendo un entrenamiento).
+    sort=True ordena por id dentro de cada archivo (solo para reescrituras chicas: ordenar
+    el CSV completo obliga a materializarlo en memoria).
     """
-    import requests
-    from requests.auth import HTTPBasicAuth
-    import json
-    from kaggle.api.kaggle_api_extended import KaggleApi
+    con.execute(
+        f"""
+        COPY (
+            SELECT * FROM {source} {where} {"ORDER BY id" if sort else ""}
+        ) TO '{out_dir}' (
+            FORMAT PARQUET, PARTITION_BY ({", ".join(LAKE_PARTITION_BY)}),
+            ROW_GROUP_SIZE {LAKE_ROW_GROUP_SIZE}, FILENAME_PATTERN 'data_{{uuid}}', OVERWRITE_OR_IGNORE TRUE
+        )
+        """
+    )
 
-    def get_kaggle_dataset_update_time(dataset_slug: str) -> datetime | None:
-        """Obtiene la fecha de última actualización (UTC) del dataset en Kaggle."""
-        logger.info("Verificando disponibilidad de credenciales Kaggle...")
 
-        try:
-            username = os.getenv("KAGGLE_USERNAME")
-            key = os.getenv("KAGGLE_KEY")
-
-            kaggle_json_path = os.path.expanduser("~/.kaggle/kaggle.json")
-            if not (username and key) and os.path.exists(kaggle_json_path):
-                try:
-                    with open(kaggle_json_path, "r") as f:
-                        creds = json.load(f)
-                        username = creds.get("username")
-                        key = creds.get("key")
-                except Exception as e:
-                    logger.warning(f"No se pudo leer {kaggle_json_path}: {e}")
-
-            if not (username and key):
-                logger.warning(
-                    "No hay credenciales de Kaggle disponibles. Se omitirá la descarga."
-                )
-                return None
-
-            logger.info("Consultando la API de Kaggle para verificar actualizaciones...")
-            url = f"https://www.kaggle.com/api/v1/datasets/view/{dataset_slug}"
-            response = requests.get(url, auth=HTTPBasicAuth(username, key))
-            response.raise_for_status()
-            metadata = response.json()
-            kaggle_date_str = metadata.get("lastUpdated")
-
-            if kaggle_date_str:
-                for fmt in ("%Y-%m-%dT%H:%M:%S.%fZ", "%Y-%m-%dT%H:%M:%SZ"):
-                    try:
-                        return datetime.strptime(kaggle_date_str, fmt).replace(
-                            tzinfo=timezone.utc
-                        )
-                    except ValueError:
-                        continue
-                logger.warning(
-                    f"No se pudo interpretar la fecha 'lastUpdated': {kaggle_date_str}"
-                )
-            return None
-        except Exception as e:
-            logger.warning(f"No se pudo contactar con la API de Kaggle: {e}")
-            return None
+def _lake_files():
+    return sorted(
+        os.path.normpath(path)
+        for path in glob.glob(os.path.join(LAKE_DIR, "**", "*.parquet"), recursive=True)
+    )
 
-    def download_from_kaggle_and_rename(kaggle_time: datetime, date_format: str) -> str | None:
-        """Descarga el dataset y lo renombra con la fecha."""
-        from kaggle.api.kaggle_api_extended import KaggleApi
 
-        date_str = kaggle_time.strftime(date_format) if kaggle_time else datetime.now().strftime(date_format)
-        new_filename = f"{KAGGLE_FILE_BASE}-{date_str}.csv"
-        new_filepath = os.path.join(RAW_DIR, new_filename)
-        original_download_path = os.path.join(RAW_DIR, KAGGLE_FILE_NAME)
+def _remove_empty_dirs(root: str):
+    for dirpath, _, _ in sorted(os.walk(root), key=lambda w: -len(w[0])):
+        if dirpath != root and not os.listdir(dirpath):
+            os.rmdir(dirpath)
 
-        logger.info(f"Descargando {KAGGLE_FILE_NAME} de Kaggle...")
-        logger.info(f"Dataset URL: https://www.kaggle.com/datasets/{KAGGLE_DATASET}")
 
-        try:
-            api = KaggleApi()
-            api.authenticate()  # inicializa credenciales
-            api.dataset_download_files(KAGGLE_DATASET, path=RAW_DIR, unzip=True, force=True)
+def _move_into_lake(tmp_dir: str) -> list[str]:
+    """Mueve los archivos exportados en tmp_dir a su partición del lago. Devuelve sus rutas."""
+    moved = []
+    for path in glob.glob(os.path.join(tmp_dir, "**", "*.parquet"), recursive=True):
+        dest = os.path.normpath(os.path.join(LAKE_DIR, os.path.relpath(path, tmp_dir)))
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        os.replace(path, dest)
+        moved.append(dest)
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    return sorted(moved)
+
+
+def write_lake(con, source: str = "datos_raw") -> list[str]:
+    """
+    Exporta source completo como archivos nuevos del lago. Los de la versión anterior no se tocan
+    (quedan retirados hasta la próxima ingesta, ver _collect_lake_garbage). Devuelve los archivos nuevos.
+    """
+    tmp_dir = f"{LAKE_DIR}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    _lake_copy(con, source, "", tmp_dir)
+    files = _move_into_lake(tmp_dir)
+    logger.info(f"Lago Parquet generado en {LAKE_DIR} ({len(files)} archivos).")
+    return files
+
+
+def write_lake_partitions(con, current: list[str]) -> list[str]:
+    """
+    Reescribe solo las particiones de lake_affected sobre la versión current (lista de archivos):
+    exporta esas particiones como archivos nuevos y devuelve la lista de la versión siguiente
+    (current sin los archivos de esas particiones, más los nuevos).
+    """
+    if not current:
+        return write_lake(con)
+    keys = ", ".join(LAKE_PARTITION_BY)
+    match = f"WHERE ({keys}) IN (SELECT ({keys}) FROM lake_affected)"
+    replaced = {
+        os.path.normpath(row[0]) for row in con.execute(
+            f"SELECT DISTINCT filename FROM {lake_source(current, filename=True)} {match}"
+        ).fetchall()
+    }
+    tmp_dir = f"{LAKE_DIR}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    _lake_copy(con, "datos_raw", match, tmp_dir, sort=True)
+    new_files = _move_into_lake(tmp_dir)
+    n_partitions = con.execute("SELECT count(*) FROM lake_affected").fetchone()[0]
+    logger.info(f"Lago Parquet: {n_partitions} particiones reescritas ({len(new_files)} archivos).")
+    return sorted([path for path in current if path not in replaced] + new_files)
+
+
+def _published_lake_files(con) -> list[str]:
+    """Archivos de la versión publicada; sin snapshot, los del lago escrito antes de los snapshots."""
+    files = snapshot_lake_files(con)
+    if files is None:
+        return _lake_files()
+    return [os.path.normpath(path) for path in files]
+
+
+def _collect_lake_garbage(keep: set[str]):
+    """
+    Borra los archivos del lago que no son de la versión recién publicada ni de la anterior:
+    un entrenamiento que leyó el snapshot anterior puede seguir leyendo esos archivos.
+    """
+    removed = [path for path in _lake_files() if path not in keep]
+    for path in removed:
+        os.remove(path)
+    _remove_empty_dirs(LAKE_DIR)
+    if removed:
+        logger.info(f"Lago Parquet: {len(removed)} archivos retirados borrados.")
+
+
+def run_duckdb_pipeline(csv_path_to_load: str, mode: str = INGEST_MODE) -> dict:
+    """
+    Carga el CSV en DuckDB (datos_raw) y actualiza el lago Parquet particionado.
+    mode="incremental" aplica solo las filas nuevas / modificadas / eliminadas;
+    mode="full" rearma la tabla y el lago completos. Devuelve el resumen de la versión aplicada.
+    """
+    if not os.path.exists(csv_path_to_load):
+        logger.error(f"ERROR: No existe {csv_path_to_load}.")
+        raise FileNotFoundError(
+            f"Archivo CSV no encontrado en la ruta: {csv_path_to_load}"
+        )
+
+    logger.info(f"Conectando a DuckDB en {DB_PATH}...")
+    start = time.perf_counter()
+    try:
+        with connection(DB_PATH) as con:
+            return _apply_version(con, csv_path_to_load, mode, start)
+    except Exception as e:
+        logger.error(f"Error durante el pipeline de DuckDB: {e}")
+        raise
+
 
-            if not os.path.exists(original_download_path):
-                logger.error(f"ERROR: No se encontró {original_download_path} después de descargar.")
-                return None
+def _apply_version(con, csv_path_to_load: str, mode: str, start: float) -> dict:
+    """Aplica el CSV sobre datos_raw / el lago, registra la versión y publica el snapshot."""
+    _configure_streaming(con)
+    _ensure_ingest_tables(con)
+    ingest_id = con.execute("SELECT coalesce(max(ingest_id), 0) + 1 FROM ingest_versions").fetchone()[0]
+    previous = _published_lake_files(con)
+
+    applied_mode = "full"
+    if mode == "incremental" and _has_previous_version(con):
+        _stage_csv(con, csv_path_to_load)
+        if _can_apply_incremental(con):
+            applied_mode = "incremental"
+            stats = _incremental_load(con, ingest_id)
+            files = previous
+            if stats["inserted"] or stats["updated"] or stats["deleted"]:
+                files = write_lake_partitions(con, previous)
+        else:
+            stats, files = _full_load(con, "(SELECT * EXCLUDE (row_hash) FROM datos_staging)", ingest_id)
+        con.execute("DROP TABLE IF EXISTS datos_staging")
+    else:
+        stats, files = _full_load(con, _csv_source(csv_path_to_load), ingest_id)
+    logger.info(
+        f"Tabla 'datos_raw' actualizada ({applied_mode}): {stats['inserted']} nuevas, "
+        f"{stats['updated']} modificadas, {stats['deleted']} eliminadas, {stats['unchanged']} sin cambios."
+    )
+
+    duration_s = time.perf_counter() - start
+    size_mb = os.path.getsize(csv_path_to_load) / 1024**2
+    # pico de RSS del proceso (ru_maxrss viene en KB en Linux)
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    rows_per_s = stats["rows_total"] / duration_s
+    mb_per_s = size_mb / duration_s
+    logger.info(
+        f"Ingesta {applied_mode}: {stats['rows_total']} filas / {size_mb:.1f} MB en {duration_s:.2f} s "
+        f"({rows_per_s:,.0f} filas/s, {mb_per_s:.1f} MB/s), pico RSS {peak_rss_mb:.0f} MB."
+    )
+    con.execute(
+        """
+        INSERT INTO ingest_versions (
+            ingest_id, source_file, mode, applied_at, rows_total, inserted, updated,
+            deleted, unchanged, duration_s, rows_per_s, mb_per_s, peak_rss_mb
+        ) VALUES (?, ?, ?, current_timestamp, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        [ingest_id, os.path.basename(csv_path_to_load), applied_mode, stats["rows_total"],
+         stats["inserted"], stats["updated"], stats["deleted"], stats["unchanged"], duration_s,
+         rows_per_s, mb_per_s, peak_rss_mb],
+    )
+    publish_snapshot(con, files, SNAPSHOT_TABLES)
+    _collect_lake_garbage(set(files) | set(previous))
+    return {
+        "ingest_id": ingest_id, "mode": applied_mode, **stats,
+        "duration_s": round(duration_s, 3), "rows_per_s": round(rows_per_s),
+        "peak_rss_mb": round(peak_rss_mb, 1),
+    }
 
-            if os.path.exists(new_filepath):
-                os.remove(new_filepath)
 
-            os.rename(original_download_path, new_filepath)
-            logger.info(f"Descarga completa y renombrada a {new_filepath}")
-            return new_filepath
+#  LÓGICA DE KAGGLE  
+def _validate_csv(path: str):
+    """El encabezado del CSV descargado tiene que coincidir con PROPERATI_SCHEMA."""
+    with open(path, "r", encoding="utf-8") as f:
+        header = f.readline().strip().split(",")
+    if header != list(PROPERATI_SCHEMA):
+        raise ValueError(f"Columnas inesperadas en el CSV: {header}")
 
-        except Exception as e:
-            logger.error(f"ERROR: Falló la descarga de Kaggle: {e}")
-            return None
 
-    # --- Lógica de Decisión ---
-    file_to_process = local_filepath
-    needs_db_update = False
-    kaggle_time = get_kaggle_dataset_update_time(KAGGLE_DATASET)
+def _versioned_name(metadata: dict) -> str:
+    """Nombre local del CSV: entrenamiento-<fecha de actualización en Kaggle>.csv"""
+    last_updated = metadata["last_updated"] or datetime.now(timezone.utc)
+    return f"{KAGGLE_FILE_BASE}-{last_updated.strftime(DATE_FORMAT)}.csv"
 
-    if not kaggle_time:
-        logger.warning("No se pudo obtener información de Kaggle (sin conexión o sin credenciales).")
+
+def _kaggle_api_logic(local_filepath: str | None, local_date: datetime | None, client=None) -> tuple[str | None, bool]:
+    """
+    Sincroniza el CSV con Kaggle a través del gestor de descargas (app/processing/downloader.py):
+    solo descarga si cambió la versión y solo pide actualizar la DB si cambió el contenido.
+    Solo se llama si el archivo legacy no existe. client permite inyectar otro cliente de la API.
+    Devuelve: (file_to_process, needs_db_update)
+    """
+    client = client or KaggleClient.from_env()
+    if client is None:
+        logger.warning("No se pudo obtener información de Kaggle (sin credenciales).")
         if not local_filepath:
             logger.error("No hay archivo CSV local disponible y no se puede descargar de Kaggle.")
             return None, False
-        else:
-            logger.info(f"Usando archivo local existente: {local_filepath}")
-            return local_filepath, False
-
-    elif not local_filepath:
-        logger.info("No se encontró archivo local versionado. Descargando de Kaggle.")
-        new_path = download_from_kaggle_and_rename(kaggle_time, DATE_FORMAT)
-        if new_path:
-            file_to_process = new_path
-            needs_db_update = True
-
-    elif kaggle_time.date() > local_date.date():
-        logger.info(
-            f"Nueva versión encontrada en Kaggle (Kaggle: {kaggle_time.date()}, Local: {local_date.date()}). Descargando..."
-        )
-        new_path = download_from_kaggle_and_rename(kaggle_time, DATE_FORMAT)
-        if new_path:
-            file_to_process = new_path
-            needs_db_update = True
-            try:
-                os.remove(local_filepath)
-                logger.info(f"Archivo local antiguo ({local_filepath}) eliminado.")
-            except OSError as e:
-                logger.warning(f"No se pudo eliminar el archivo antiguo {local_filepath}: {e}")
-    else:
-        logger.info(
-            f"El archivo local ({local_filepath}) está actualizado (Fecha: {local_date.date()})."
-        )
-        needs_db_update = False
+        logger.info(f"Usando archivo local existente: {local_filepath}")
+        return local_filepath, False
 
-    return file_to_process, needs_db_update
+    logger.info(f"Dataset URL: https://www.kaggle.com/datasets/{KAGGLE_DATASET}")
+    downloader = DatasetDownloader(client, RAW_DIR, validate=_validate_csv)
+    try:
+        result = downloader.sync(KAGGLE_DATASET, KAGGLE_FILE_NAME, _versioned_name)
+    except Exception as e:
+        logger.warning(f"No se pudo sincronizar con Kaggle: {e}")
+        if not local_filepath:
+            logger.error("No hay archivo CSV local disponible y no se puede descargar de Kaggle.")
+            return None, False
+        logger.info(f"Usando archivo local existente: {local_filepath}")
+        return local_filepath, False
+
+    if not result["changed"]:
+        logger.info(f"El archivo local ({result['path']}) está actualizado (versión {result['version']}).")
+        return result["path"], False
+
+    # archivo versionado de antes del gestor de descargas (sin estado guardado)
+    if (
+        local_filepath and os.path.exists(local_filepath)
+        and os.path.abspath(local_filepath) != os.path.abspath(result["path"])
+    ):
+        try:
+            os.remove(local_filepath)
+            logger.info(f"Archivo local antiguo ({local_filepath}) eliminado.")
+        except OSError as e:
+            logger.warning(f"No se pudo eliminar el archivo antiguo {local_filepath}: {e}")
+    return result["path"], True
 
 
 #  INGESTA 
-async def run_ingestion_pipeline():
-    """Punto de entrada principal para ejecutar todo el pipeline de ingesta."""
+def run_ingestion_pipeline(job: JobContext | None = None):
+    """
+    Punto de entrada principal para ejecutar todo el pipeline de ingesta.
+    job: contexto del job (etapas y cancelación); None al correr como script.
+    """
     logger.info("--- Iniciando Pipeline de Ingesta ---")
+    job = job or JobContext.local("ingest")
 
     file_to_process = None
     needs_db_update = False
@@ -236,31 +539,33 @@ async def run_ingestion_pipeline():
     try:
         ensure_directories()
 
-        #  Chequear si existe el archivo legacy (sin fecha)
-        if os.path.exists(LEGACY_CSV_PATH):
-            logger.info(f"Se encontró el archivo legacy '{LEGACY_CSV_PATH}'. Usando este archivo.")
-            file_to_process = LEGACY_CSV_PATH
-            needs_db_update = True
-        else:
-            #  Si no hay legacy, entra en la lógica de versión/descarga
-            local_filepath, local_date = find_latest_local_versioned_file(
-                VERSIONED_CSV_PATTERN, DATE_FORMAT
-            )
+        with job.stage("download"):
+            #  Chequear si existe el archivo legacy (sin fecha)
+            if os.path.exists(LEGACY_CSV_PATH):
+                logger.info(f"Se encontró el archivo legacy '{LEGACY_CSV_PATH}'. Usando este archivo.")
+                file_to_process = LEGACY_CSV_PATH
+                needs_db_update = True
+            else:
+                #  Si no hay legacy, entra en la lógica de versión/descarga
+                local_filepath, local_date = find_latest_local_versioned_file(
+                    VERSIONED_CSV_PATTERN, DATE_FORMAT
+                )
 
-            file_to_process, needs_db_update = _kaggle_api_logic(
-                local_filepath, local_date
-            )
+                file_to_process, needs_db_update = _kaggle_api_logic(
+                    local_filepath, local_date
+                )
 
-            if not file_to_process:
-                msg = "Proceso abortado. No hay archivo CSV disponible para procesar."
-                logger.error(msg)
-                return {"status": "error", "message": msg}
+        if not file_to_process:
+            msg = "Proceso abortado. No hay archivo CSV disponible para procesar."
+            logger.error(msg)
+            return {"status": "error", "message": msg}
 
         #  Ejecución Final 
         if file_to_process and needs_db_update:
-            logger.info("Actualizando DuckDB y Parquet...")
-            run_duckdb_pipeline(file_to_process)
-            message = "Ingesta completada. DuckDB y Parquet actualizados."
+            logger.info("Actualizando DuckDB y lago Parquet...")
+            with job.stage("duckdb_load"):
+                ingest = run_duckdb_pipeline(file_to_process)
+            message = "Ingesta completada. DuckDB y lago Parquet actualizados."
         elif file_to_process:
             logger.info(f"El archivo {file_to_process} está actualizado. No se requiere actualización de DB.")
             message = "Proceso finalizado. Los datos ya estaban actualizados."
@@ -269,8 +574,14 @@ async def run_ingestion_pipeline():
             return {"status": "error", "message": message}
 
         logger.info("--- Pipeline de Ingesta Finalizado ---")
-        return {"status": "ok", "message": message, "processed_file": file_to_process}
-
+        result = {"status": "ok", "message": message, "processed_file": file_to_process}
+        if needs_db_update:
+            result["ingest"] = ingest
+        return result
+
+    except JobCancelled as e:
+        logger.warning(f"Ingesta cancelada: {e}")
+        return {"status": "cancelled", "message": str(e)}
     except Exception as e:
         error_msg = f"Error fatal en el pipeline de ingesta: {e}"
         logger.error(error_msg, exc_info=True)
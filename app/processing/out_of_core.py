@@ -0,0 +1,364 @@
+import json
+import math
+import os
+import shutil
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.pipeline import Pipeline
+from sklearn.compose import TransformedTargetRegressor
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.impute import SimpleImputer
+from sklearn.preprocessing import OrdinalEncoder, StandardScaler
+from dvclive import Live
+from app.utils.config import (
+    OOC_L2, OOC_OPERATIONS, OOC_CHUNK_ROWS, OOC_BATCH_ROWS, OOC_N_ESTIMATORS, OOC_MAX_LEAF_NODES,
+    OOC_MEMORY_LIMIT, OOC_THREADS,
+)
+from app.utils.log_config import logger
+from app.utils.jobs import JobContext, JobCancelled
+from app.utils.db import connection
+from app.processing.preprocessing import frozen_preprocessor
+from app.processing.trainer import (
+    DB_PATH, MODEL_DIR, MODEL_BEST_PATH, MODEL_BEST_FLAT_DIR, MANIFEST_PATH, METRICS_DIR,
+    NUMERIC_FEATURES, CATEGORICAL_FEATURES,
+    training_source, training_filter, profile, build_clean_table, clean_table_key, current_clean_key,
+    save_metrics_to_duckdb, export_flat_model, promote_model,
+)
+
+'''
+ENTRENAMIENTO OUT-OF-CORE (TRAIN_MODE = out_of_core): modelo nacional (todas las l2 y operaciones)
+sin materializar el dataset en pandas. Perfil y limpieza siguen en DuckDB (con memoria acotada,
+lo que no entra va a disco); a Python solo vuelven lotes acotados:
+- split train/test por hash del id (20% test), sin traer las filas
+- medianas y categorías por SQL; el StandardScaler se ajusta con partial_fit sobre lotes en streaming
+- categorías como códigos ordinales (una columna por feature, sin one-hot: los bloques no crecen
+  con la cantidad de barrios); categorías nuevas -> -1
+- RandomForest por bagging: un bosque chico por bloque de OOC_CHUNK_ROWS filas (partición por hash)
+  y los árboles se juntan en un único TransformedTargetRegressor (log1p), como el modelo en memoria
+- la evaluación acumula errores por lote (RMSE, MAE, R2 exactos sin tener el test entero)
+El resultado es el mismo Pipeline servible (ColumnTransformer + estimador): FastEncoder y formato plano.
+'''
+
+MODEL_OOC_PATH = os.path.join(MODEL_DIR, "random_forest_ooc.joblib")
+MODEL_OOC_NAME = "RandomForestOOC"
+# en el modelo nacional la región es una feature más
+OOC_NUMERIC_FEATURES = list(NUMERIC_FEATURES)
+OOC_CATEGORICAL_FEATURES = ["l2"] + list(CATEGORICAL_FEATURES)
+TARGET = "price"
+TEST_FRACTION = 5  # 1 de cada 5 filas al test
+SEED = 42
+# filas para test / train (hash determinístico del id: no depende del orden de datos_clean)
+TEST_WHERE = f"{TARGET} IS NOT NULL AND hash(id, 'test') % {TEST_FRACTION} = 0"
+TRAIN_WHERE = f"{TARGET} IS NOT NULL AND hash(id, 'test') % {TEST_FRACTION} <> 0"
+
+
+def _configure_duckdb(con):
+    """Memoria e hilos acotados: sort, agregaciones y la tabla limpia van a disco si no entran."""
+    con.execute(f"SET memory_limit = '{OOC_MEMORY_LIMIT}'")
+    con.execute(f"SET threads = {OOC_THREADS}")
+    con.execute("SET preserve_insertion_order = false")
+
+
+def stream_batches(con, query: str, batch_rows: int = OOC_BATCH_ROWS):
+    """
+    Recorre el resultado de query en DataFrames de ~batch_rows filas (múltiplo de 2048, el vector de DuckDB).
+    El resultado no se materializa entero; no ejecutar otras consultas en con mientras se recorre.
+    """
+    result = con.execute(query)
+    vectors = max(1, batch_rows // 2048)
+    while True:
+        batch = result.fetch_df_chunk(vectors)
+        if batch.empty:
+            return
+        yield batch
+
+
+def _group_sql(group_by) -> tuple[str, str]:
+    """(columnas del grupo para el SELECT, cláusula GROUP BY); sin group_by todo es un solo grupo ()."""
+    if not group_by:
+        return "", ""
+    cols = ", ".join(group_by)
+    return f"{cols}, ", f" GROUP BY {cols}"
+
+
+def fit_streaming_preprocessing_by(con, numeric, categorical, group_by=(), where=TRAIN_WHERE) -> dict:
+    """
+    Ajusta los bloques (numérico, categórico) del preprocesamiento de cada grupo de group_by
+    (ej: los segmentos) sin traer el train a memoria: {valores del grupo: (num, cat)}.
+    Una sola pasada para todos los grupos: las medianas y las categorías salen de un GROUP BY
+    y los StandardScaler se ajustan con partial_fit sobre un único recorrido en streaming.
+    num = SimpleImputer(mediana por SQL) + StandardScaler (partial_fit por lotes).
+    cat = imputación constante + OrdinalEncoder con las categorías del train (DISTINCT por SQL).
+    """
+    group_by = list(group_by)
+    key_cols, group = _group_sql(group_by)
+    k = len(group_by)
+    imputers = {}
+    rows = con.execute(
+        f"SELECT {key_cols}{', '.join(f'median({c})' for c in numeric)} FROM datos_clean WHERE {where}{group}"
+    ).fetchall()
+    for row in rows:
+        # columna sin valores: se imputa con 0 (el imputer descartaría la columna)
+        medians = pd.DataFrame([[0.0 if m is None else float(m) for m in row[k:]]], columns=numeric)
+        imputers[tuple(row[:k])] = SimpleImputer(strategy="median").fit(medians)
+
+    categories = {key: [] for key in imputers}
+    for col in categorical:
+        values = {key: [] for key in imputers}
+        for row in con.execute(
+            f"SELECT DISTINCT {key_cols}coalesce(CAST({col} AS VARCHAR), 'missing') FROM datos_clean "
+            f"WHERE {where} ORDER BY ALL"
+        ).fetchall():
+            values[tuple(row[:k])].append(row[k])
+        for key, found in values.items():
+            categories[key].append(np.array(found, dtype=object))
+
+    scalers = {key: StandardScaler() for key in imputers}
+    for batch in stream_batches(con, f"SELECT {key_cols}{', '.join(numeric)} FROM datos_clean WHERE {where}"):
+        parts = batch.groupby(group_by, sort=False) if group_by else [((), batch)]
+        for key, part in parts:
+            scalers[key].partial_fit(imputers[key].transform(part[numeric]))
+
+    blocks = {}
+    for key, cats in categories.items():
+        encoder = OrdinalEncoder(categories=cats, handle_unknown="use_encoded_value", unknown_value=-1)
+        cat_block = Pipeline([
+            ("imputer", SimpleImputer(strategy="constant", fill_value="missing")), ("ordinal", encoder),
+        ])
+        # las categorías ya están fijadas: el fit sobre una fila solo registra columnas y dtypes
+        cat_block.fit(pd.DataFrame([[c[0] for c in cats]], columns=categorical, dtype=object))
+        blocks[key] = Pipeline([("imputer", imputers[key]), ("scaler", scalers[key])]), cat_block
+    n_seen = sum(int(scaler.n_samples_seen_.max()) for scaler in scalers.values())
+    if group_by:
+        logger.info(f"Preprocesamiento ajustado en streaming: {n_seen} filas, {len(blocks)} grupos de {' x '.join(group_by)}")
+    else:
+        logger.info(
+            f"Preprocesamiento ajustado en streaming: {n_seen} filas, "
+            f"categorías por feature {dict(zip(categorical, (len(c) for c in categories[()])))}"
+        )
+    return blocks
+
+
+def fit_streaming_preprocessing(con, numeric, categorical, where=TRAIN_WHERE):
+    """Bloques (numérico, categórico) ajustados en streaming sobre todas las filas de where."""
+    return fit_streaming_preprocessing_by(con, numeric, categorical, where=where)[()]
+
+
+def build_preprocessors_by(con, numeric, categorical, group_by=(), where=TRAIN_WHERE) -> dict:
+    """
+    ColumnTransformer servible de cada grupo de group_by con los bloques ajustados en streaming.
+    Devuelve {valores del grupo: (preproc, filas de train)}.
+    """
+    key_cols, group = _group_sql(group_by)
+    k = len(group_by)
+    blocks = fit_streaming_preprocessing_by(con, numeric, categorical, group_by, where)
+    counts = {
+        tuple(row[:k]): row[k]
+        for row in con.execute(f"SELECT {key_cols}count(*) FROM datos_clean WHERE {where}{group}").fetchall()
+    }
+    partition = f"PARTITION BY {', '.join(group_by)}" if group_by else ""
+    samples = con.execute(f"""
+        SELECT {key_cols}{', '.join(numeric + categorical)} FROM datos_clean WHERE {where}
+        QUALIFY row_number() OVER ({partition}) <= 2
+    """).df()
+    groups = samples.groupby(list(group_by), sort=False) if group_by else [((), samples)]
+    preprocs = {}
+    for key, X_sample in groups:
+        num_block, cat_block = blocks[key]
+        preproc = frozen_preprocessor(num_block, cat_block, numeric, categorical, X_sample[numeric + categorical])
+        preprocs[key] = preproc, counts[key]
+    return preprocs
+
+
+def build_preprocessor(con, numeric, categorical, where=TRAIN_WHERE):
+    """ColumnTransformer servible con los bloques ajustados en streaming. Devuelve (preproc, filas de train)."""
+    return build_preprocessors_by(con, numeric, categorical, where=where)[()]
+
+
+def _trees_per_chunk(n_chunks: int, n_estimators: int) -> list[int]:
+    """Reparte los árboles entre los bloques (al menos uno por bloque)."""
+    total = max(n_estimators, n_chunks)
+    return [total // n_chunks + (i < total % n_chunks) for i in range(n_chunks)]
+
+
+def fit_bagged_forest(con, preproc, features, n_train: int, params: dict, job: JobContext, where=TRAIN_WHERE):
+    """
+    Entrena un RandomForest (log1p del target) por bloque y junta todos los árboles en el primero.
+    En memoria solo hay un bloque de filas a la vez, más los árboles ya entrenados.
+    where: filas de train de datos_clean (por defecto todo el train).
+    """
+    n_chunks = max(1, math.ceil(n_train / params["ooc_chunk_rows"]))
+    trees = _trees_per_chunk(n_chunks, params["rf_n_estimators"])
+    logger.info(f"Bagging out-of-core: {n_train} filas en {n_chunks} bloques, {sum(trees)} árboles")
+    merged = None
+    for i, n_trees in enumerate(trees):
+        job.check_cancelled()
+        chunk_where = f"{where} AND hash(id, 'chunk') % {n_chunks} = {i}"
+        df = con.execute(f"SELECT {', '.join(features + [TARGET])} FROM datos_clean WHERE {chunk_where}").df()
+        # float32: los árboles entrenan en float32 de todos modos
+        Xt = preproc.transform(df[features]).astype(np.float32)
+        y = df[TARGET].to_numpy(dtype=np.float64)
+        del df
+        model = TransformedTargetRegressor(
+            regressor=RandomForestRegressor(
+                n_estimators=n_trees,
+                min_samples_split=params["rf_min_samples_split"],
+                max_leaf_nodes=params["ooc_max_leaf_nodes"],
+                n_jobs=-1,
+                random_state=SEED + i,
+            ),
+            func=np.log1p, inverse_func=np.expm1,
+        ).fit(Xt, y)
+        del Xt, y
+        if merged is None:
+            merged = model
+        else:
+            merged.regressor_.estimators_ += model.regressor_.estimators_
+            merged.regressor_.n_estimators = len(merged.regressor_.estimators_)
+        logger.info(f"Bloque {i + 1}/{n_chunks}: {n_trees} árboles ({len(merged.regressor_.estimators_)} en total)")
+    return merged, n_chunks
+
+
+def evaluate_streaming(model, con, features, where=TEST_WHERE, name=MODEL_OOC_NAME):
+    """RMSE, MAE y R2 del test acumulando sumas por lote (no se trae el test entero)."""
+    n, sse, sae, sum_y, sum_y2 = 0, 0.0, 0.0, 0.0, 0.0
+    for batch in stream_batches(con, f"SELECT {', '.join(features + [TARGET])} FROM datos_clean WHERE {where}"):
+        y = batch[TARGET].to_numpy(dtype=np.float64)
+        err = y - model.predict(batch[features])
+        n += len(y)
+        sse += float(err @ err)
+        sae += float(np.abs(err).sum())
+        sum_y += float(y.sum())
+        sum_y2 += float(y @ y)
+    sst = sum_y2 - sum_y ** 2 / n
+    metrics = {"rmse": (sse / n) ** 0.5, "mae": sae / n, "r2": 1 - sse / sst if sst > 0 else 0.0}
+    logger.info(f"--- {name} --- RMSE: {metrics['rmse']:.2f}, MAE: {metrics['mae']:.2f}, R2: {metrics['r2']:.4f} ({n} filas)")
+    return metrics
+
+
+def prepare_clean_table(con, where: str, job: JobContext) -> int:
+    """
+    Perfil + datos_clean del filtro (con l2 e id, que usan el modelo nacional y el split por hash).
+    Si la datos_clean de la base ya salió de los mismos archivos del lago, el mismo filtro y el mismo día
+    (ej: out-of-core y segmentos después de una misma ingesta) se reutiliza sin volver a leer el lago.
+    """
+    _configure_duckdb(con)
+    source = training_source(con)
+    logger.info(f"Filtro de entrenamiento: {where}")
+    keep = ("l2", "id")
+    with job.stage("profile"):
+        reuse = current_clean_key(con) == clean_table_key(source, where, keep)
+        if not reuse:
+            profile(con, source, where=where)
+    with job.stage("clean"):
+        if reuse:
+            n_rows = con.execute("SELECT count(*) FROM datos_clean").fetchone()[0]
+            logger.info(f"Tabla 'datos_clean' vigente (mismo lago y filtro): {n_rows} filas. No se vuelve a limpiar.")
+            return n_rows
+        n_rows = build_clean_table(con, source, where=where, keep=keep)
+    logger.info(f"Tabla 'datos_clean' guardada: {n_rows} filas.")
+    return n_rows
+
+
+def run_out_of_core_training(job: JobContext | None = None):
+    """
+    Entrenamiento out-of-core del modelo nacional (OOC_L2 / OOC_OPERATIONS).
+    Corre en el pool de procesos como el entrenamiento en memoria y promueve el modelo resultante.
+    """
+    logger.info("--- Iniciando Entrenamiento Out-of-Core ---")
+    job = job or JobContext.local("train_ooc")
+    where = training_filter(OOC_L2, OOC_OPERATIONS)
+    features = OOC_NUMERIC_FEATURES + OOC_CATEGORICAL_FEATURES
+    params = {
+        "train_mode": "out_of_core",
+        "ooc_filter": where,
+        "ooc_chunk_rows": OOC_CHUNK_ROWS,
+        "ooc_batch_rows": OOC_BATCH_ROWS,
+        "ooc_max_leaf_nodes": OOC_MAX_LEAF_NODES,
+        "split_test_size": 1 / TEST_FRACTION,
+        "rf_n_estimators": OOC_N_ESTIMATORS,
+        "rf_min_samples_split": 4,
+        "rf_scaler": "StandardScaler",
+        "numeric_features": OOC_NUMERIC_FEATURES,
+        "categorical_features": OOC_CATEGORICAL_FEATURES,
+    }
+
+    try:
+        logger.info(f"Conectando a DuckDB en {DB_PATH}...")
+        with connection(DB_PATH) as con:
+            n_rows = prepare_clean_table(con, where, job)
+            if n_rows == 0:
+                logger.error(f"No se encontraron datos para {where}. Exit entrenamiento.")
+                return {"status": "error", "message": "No hay datos para entrenar."}
+
+            with job.stage("preprocess"):
+                preproc, n_train = build_preprocessor(con, OOC_NUMERIC_FEATURES, OOC_CATEGORICAL_FEATURES)
+
+            with job.stage("fit_rf"):
+                estimator, n_chunks = fit_bagged_forest(con, preproc, features, n_train, params, job)
+            model = Pipeline([("preproc", preproc), ("est", estimator)])
+            params.update({
+                "ooc_chunks": n_chunks,
+                "ooc_train_rows": int(n_train),
+                "rf_n_estimators": len(estimator.regressor_.estimators_),
+            })
+            params["rf_params"] = {
+                "n_estimators": params["rf_n_estimators"], "min_samples_split": params["rf_min_samples_split"],
+                "max_leaf_nodes": OOC_MAX_LEAF_NODES, "chunks": n_chunks, "filter": where,
+            }
+
+            with job.stage("evaluate"):
+                metrics = evaluate_streaming(model, con, features)
+                X_check = con.execute(f"SELECT {', '.join(features)} FROM datos_clean WHERE {TEST_WHERE} LIMIT 1000").df()
+
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        with Live(METRICS_DIR, save_dvc_exp=False, resume=True) as live:
+            params["promoted_model"] = MODEL_OOC_NAME
+            live.log_params(params)
+            live.log_metric("ooc_rmse", metrics["rmse"])
+            live.log_metric("ooc_mae", metrics["mae"])
+            live.log_metric("ooc_r2", metrics["r2"])
+
+            with job.stage("save"):
+                os.makedirs(MODEL_DIR, exist_ok=True)
+                logger.info(f"Guardando {MODEL_OOC_NAME} en: {MODEL_OOC_PATH}")
+                joblib.dump(model, MODEL_OOC_PATH)
+                promotion_id = promote_model(MODEL_OOC_PATH)
+                flat_dir = None
+                try:
+                    export_flat_model(model, X_check)
+                    flat_dir = MODEL_BEST_FLAT_DIR
+                except Exception as e:
+                    logger.error(f"No se pudo exportar el formato plano: {e}")
+                    shutil.rmtree(MODEL_BEST_FLAT_DIR, ignore_errors=True)
+
+                manifest = {
+                    "models": [{"name": MODEL_OOC_NAME, "path": MODEL_OOC_PATH, "metrics": metrics}],
+                    "promoted": {
+                        "name": MODEL_OOC_NAME, "path": MODEL_BEST_PATH, "flat_path": flat_dir, "promotion_id": promotion_id,
+                        "mode": "out_of_core", "filter": where, "metrics": metrics,
+                    },
+                }
+                with open(MANIFEST_PATH, "w") as f:
+                    json.dump(manifest, f, indent=2)
+
+                save_metrics_to_duckdb(params, metrics, None, name_a=MODEL_OOC_NAME)
+
+        logger.info("--- Entrenamiento Out-of-Core Finalizado ---")
+        return {
+            "status": "ok", "message": "Entrenamiento out-of-core completo.", "metrics_rf": metrics,
+            "promoted_model": MODEL_OOC_NAME, "mode": "out_of_core", "chunks": n_chunks,
+        }
+
+    except JobCancelled as e:
+        logger.warning(f"Entrenamiento cancelado: {e}")
+        return {"status": "cancelled", "message": str(e)}
+    except Exception as e:
+        logger.error(f"ERROR en el entrenamiento out-of-core: {e}", exc_info=True)
+        return {"status": "error", "message": str(e)}
+
+
+if __name__ == "__main__":
+    # python -m app.processing.out_of_core
+    run_out_of_core_training()
@@ -0,0 +1,270 @@
+import hashlib
+import json
+import os
+import shutil
+import joblib
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.base import clone
+from sklearn.pipeline import Pipeline
+from sklearn.compose import ColumnTransformer
+from sklearn.frozen import FrozenEstimator
+from sklearn.impute import SimpleImputer
+from sklearn.preprocessing import OneHotEncoder, OrdinalEncoder, FunctionTransformer
+from app.utils.config import (
+    PREPROC_CACHE_DIR, PREPROC_CACHE_ENABLED, PREPROC_CACHE_KEEP, FEATURE_LAYOUT, SPARSE_MAX_DENSITY,
+)
+from app.utils.log_config import logger
+
+'''
+PREPROCESAMIENTO COMPARTIDO ENTRE MODELOS
+- imputación (mediana / constante) + OneHotEncoder se ajustan UNA vez sobre el train y
+  se transforman train y test una sola vez; todos los modelos usan esas matrices
+- cada modelo solo ajusta su scaler sobre las columnas numéricas ya imputadas
+- el resultado queda en disco (PREPROC_CACHE_DIR) con clave = huella de los datos + lista de features +
+  configuración de los bloques (kind, layout, PREPROC_VERSION, parámetros de los encoders):
+  si solo cambian los hiperparámetros, el reentrenamiento no vuelve a preprocesar
+- el modelo que se guarda sigue siendo Pipeline(ColumnTransformer, estimador): los bloques
+  ya ajustados entran congelados (FrozenEstimator), así que predice igual que lo entrenado
+- kind="ordinal" (HistGradientBoosting): numéricas sin imputar (NaN nativo) y categorías como
+  códigos enteros para el soporte categórico nativo, sin one-hot ni scaler
+- layout="compact" (FEATURE_LAYOUT): one-hot guardado en CSR float32, códigos ordinales int16 y
+  matriz del modelo en float32 (los árboles de sklearn entrenan en float32 de todos modos: mismo
+  modelo sin la copia float64). CSR solo para los modelos que lo aprovechan y si la densidad es
+  <= SPARSE_MAX_DENSITY; el RandomForest con CSR usa otro splitter, mucho más lento.
+  El Pipeline servible sigue devolviendo una matriz densa (sparse_threshold=0)
+'''
+
+PREPROC_KINDS = ("onehot", "ordinal")
+FEATURE_LAYOUTS = ("dense", "compact")
+
+# cambiar si cambia la definición del preprocesamiento compartido (invalida la caché)
+# 1: imputación + one-hot compartidos, 2: kind="ordinal", 3: layout compact (CSR / float32 / int16)
+PREPROC_VERSION = 3
+
+
+class SharedFeatures:
+    """
+    Preprocesamiento compartido ya ajustado y las partes transformadas de train / test.
+    parts[split] = (numéricas densas float64, categóricas one-hot o códigos).
+    """
+
+    def __init__(self, blocks, parts, numeric, categorical, key, cached, kind="onehot", layout="dense"):
+        # bloques ajustados {"num": ..., "cat": ...}
+        self.blocks = blocks
+        self.parts = parts
+        self.numeric = numeric
+        self.categorical = categorical
+        self.key = key
+        self.cached = cached
+        self.kind = kind
+        self.layout = layout
+
+    @property
+    def categorical_mask(self) -> np.ndarray:
+        """Columnas categóricas de la matriz (categorical_features de HistGradientBoosting)."""
+        num, cat = self.parts["train"]
+        return np.r_[np.zeros(num.shape[1], dtype=bool), np.ones(cat.shape[1], dtype=bool)]
+
+    @property
+    def density(self) -> float:
+        """Fracción de valores no nulos de la matriz [numéricas | one-hot] (numéricas cuentan completas)."""
+        num, cat = self.parts["train"]
+        nnz = num.size + (cat.nnz if sparse.issparse(cat) else np.count_nonzero(cat))
+        return nnz / max(num.shape[0] * (num.shape[1] + cat.shape[1]), 1)
+
+    def matrix(self, split: str, scaler=None, accept_sparse: bool = False):
+        """
+        Matriz de entrada del modelo: [numéricas (escaladas si hay scaler) | categóricas].
+        compact: float32 (mismo redondeo que harían los árboles al entrenar); CSR si el modelo
+        lo acepta y la densidad es <= SPARSE_MAX_DENSITY.
+        kind="ordinal": siempre float64 (HistGradientBoosting convierte a float64 al entrenar);
+        los códigos int16 de compact solo achican las partes en memoria y la caché, no el pico del fit.
+        """
+        num, cat = self.parts[split]
+        if scaler is not None:
+            num = scaler.transform(num)
+        if self.layout != "compact" or self.kind != "onehot":
+            return np.hstack([np.asarray(num, dtype=np.float64), np.asarray(cat, dtype=np.float64)])
+        if accept_sparse and self.density <= SPARSE_MAX_DENSITY:
+            return sparse.hstack([sparse.csr_matrix(num, dtype=np.float32), cat], format="csr", dtype=np.float32)
+        X = np.empty((num.shape[0], num.shape[1] + cat.shape[1]), dtype=np.float32)
+        X[:, :num.shape[1]] = num
+        X[:, num.shape[1]:] = cat.toarray() if sparse.issparse(cat) else cat
+        return X
+
+    def nbytes(self, split: str = "train") -> int:
+        """Memoria de las partes de un split (para los logs)."""
+        return sum(
+            p.data.nbytes + p.indices.nbytes + p.indptr.nbytes if sparse.issparse(p) else p.nbytes
+            for p in self.parts[split]
+        )
+
+
+def build_shared_blocks(kind="onehot", layout="dense"):
+    """Bloques (numérico, categórico) sin ajustar del preprocesamiento compartido."""
+    compact = layout == "compact"
+    cat_imputer = SimpleImputer(strategy="constant", fill_value="missing")
+    if kind == "ordinal":
+        # categorías desconocidas -> -1 (HistGradientBoosting lo toma como faltante);
+        # como máximo 255 categorías por feature (límite de bins), el resto se agrupa
+        encoder = OrdinalEncoder(
+            handle_unknown="use_encoded_value", unknown_value=-1, max_categories=255,
+            dtype=np.int16 if compact else np.float64,
+        )
+        return FunctionTransformer(feature_names_out="one-to-one"), Pipeline([("imputer", cat_imputer), ("ordinal", encoder)])
+    ohe = OneHotEncoder(
+        handle_unknown="ignore", sparse_output=compact, dtype=np.float32 if compact else np.float64,
+    )
+    return SimpleImputer(strategy="median"), Pipeline([("imputer", cat_imputer), ("ohe", ohe)])
+
+
+def data_fingerprint(X_train: pd.DataFrame, X_test: pd.DataFrame, numeric, categorical, kind="onehot",
+                     layout="dense") -> str:
+    """
+    Huella del split (contenido de las filas, en orden) + features + tipo, layout y versión del
+    preprocesamiento + parámetros de los bloques sin ajustar: una entrada de la caché armada con otra
+    configuración de los encoders (dtype, sparse_output, max_categories...) nunca se reutiliza.
+    """
+    blocks = [block.get_params(deep=True) for block in build_shared_blocks(kind, layout)]
+    digest = hashlib.sha256()
+    digest.update(json.dumps({
+        "v": PREPROC_VERSION, "kind": kind, "layout": layout, "num": numeric, "cat": categorical,
+        "blocks": blocks,
+    }, default=repr, sort_keys=True).encode())
+    for X in (X_train, X_test):
+        digest.update(pd.util.hash_pandas_object(X[numeric + categorical], index=False).values.tobytes())
+    return digest.hexdigest()[:24]
+
+
+def _load_cached(path):
+    try:
+        blocks = joblib.load(os.path.join(path, "blocks.joblib"))
+        parts = {}
+        for split in ("train", "test"):
+            # mmap: la matriz no se copia a memoria hasta que se usa
+            num = np.load(os.path.join(path, f"{split}_num.npy"), mmap_mode="r")
+            cat_path = os.path.join(path, f"{split}_cat")
+            if os.path.exists(f"{cat_path}.npz"):
+                cat = sparse.load_npz(f"{cat_path}.npz").tocsr()
+            else:
+                cat = np.load(f"{cat_path}.npy", mmap_mode="r")
+            parts[split] = (num, cat)
+        return blocks, parts
+    except (OSError, ValueError, EOFError) as e:
+        logger.warning(f"Caché de preprocesamiento ilegible ({e}). Se vuelve a calcular.")
+        return None
+
+
+def _save_cached(path, blocks, parts):
+    tmp_path = f"{path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    joblib.dump(blocks, os.path.join(tmp_path, "blocks.joblib"))
+    for split, (num, cat) in parts.items():
+        np.save(os.path.join(tmp_path, f"{split}_num.npy"), num)
+        if sparse.issparse(cat):
+            sparse.save_npz(os.path.join(tmp_path, f"{split}_cat.npz"), cat, compressed=False)
+        else:
+            np.save(os.path.join(tmp_path, f"{split}_cat.npy"), cat)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+
+
+def _prune_cache(prefix, keep_key):
+    """Deja solo las PREPROC_CACHE_KEEP entradas más recientes de cada tipo (y siempre la actual)."""
+    entries = [
+        os.path.join(PREPROC_CACHE_DIR, name) for name in os.listdir(PREPROC_CACHE_DIR)
+        if name.startswith(prefix) and not name.endswith(".tmp")
+    ]
+    entries.sort(key=os.path.getmtime, reverse=True)
+    for path in entries[max(PREPROC_CACHE_KEEP, 1):]:
+        if os.path.basename(path) != keep_key:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def shared_features(X_train, X_test, numeric, categorical, kind="onehot", layout=None) -> SharedFeatures:
+    """Devuelve el preprocesamiento compartido desde la caché o lo ajusta y lo guarda."""
+    layout = layout or FEATURE_LAYOUT
+    if kind not in PREPROC_KINDS:
+        raise ValueError(f"Preprocesamiento desconocido: {kind}. Opciones: {', '.join(PREPROC_KINDS)}")
+    if layout not in FEATURE_LAYOUTS:
+        raise ValueError(f"FEATURE_LAYOUT desconocido: {layout}. Opciones: {', '.join(FEATURE_LAYOUTS)}")
+    prefix = f"{kind}-{layout}-"
+    key = prefix + data_fingerprint(X_train, X_test, numeric, categorical, kind, layout)
+    path = os.path.join(PREPROC_CACHE_DIR, key)
+    if PREPROC_CACHE_ENABLED and os.path.isdir(path):
+        loaded = _load_cached(path)
+        if loaded is not None:
+            logger.info(f"Preprocesamiento compartido desde caché ({key}). No se vuelve a ajustar.")
+            # marca de uso para la poda
+            os.utime(path)
+            return SharedFeatures(*loaded, numeric, categorical, key, cached=True, kind=kind, layout=layout)
+
+    logger.info(f"Ajustando el preprocesamiento compartido ({kind}, {layout})...")
+    num_block, cat_block = build_shared_blocks(kind, layout)
+    parts = {
+        "train": (
+            np.asarray(num_block.fit_transform(X_train[numeric]), dtype=np.float64),
+            cat_block.fit_transform(X_train[categorical]),
+        ),
+    }
+    parts["test"] = (
+        np.asarray(num_block.transform(X_test[numeric]), dtype=np.float64),
+        cat_block.transform(X_test[categorical]),
+    )
+    blocks = {"num": num_block, "cat": cat_block}
+    shared = SharedFeatures(blocks, parts, numeric, categorical, key, cached=False, kind=kind, layout=layout)
+    logger.info(f"Features de train en memoria: {shared.nbytes('train') / 1024**2:.1f} MB ({layout}).")
+    if PREPROC_CACHE_ENABLED:
+        try:
+            os.makedirs(PREPROC_CACHE_DIR, exist_ok=True)
+            _save_cached(path, blocks, parts)
+            _prune_cache(prefix, key)
+            logger.info(f"Preprocesamiento guardado en caché: {path}")
+        except OSError as e:
+            logger.warning(f"No se pudo guardar la caché de preprocesamiento: {e}")
+    return shared
+
+
+def scale_features(shared: SharedFeatures, scaler, accept_sparse: bool = False):
+    """
+    Ajusta el scaler de un modelo sobre las columnas numéricas de la matriz compartida.
+    Devuelve (scaler ajustado, Xt_train, Xt_test); el one-hot no se toca.
+    accept_sparse: el modelo entrena bien con CSR (ver SharedFeatures.matrix).
+    """
+    scaler = clone(scaler).fit(shared.parts["train"][0])
+    return scaler, shared.matrix("train", scaler, accept_sparse), shared.matrix("test", scaler, accept_sparse)
+
+
+def compose_pipeline(shared: SharedFeatures, estimator, X_sample, scaler=None, scaler_name="scaler",
+                     step_names=("preproc", "est"), extra=()):
+    """
+    Arma el Pipeline servible (ColumnTransformer + estimador ya entrenado) con las piezas ajustadas.
+    num = bloque numérico compartido (+ scaler del modelo si tiene); cat = bloque categórico compartido.
+    extra: bloques ajustados (nombre, transformer, columnas) que van después, en el orden de append_columns.
+    El fit sobre X_sample solo registra columnas y anchos de salida: los bloques están congelados.
+    """
+    num_block = shared.blocks["num"]
+    if scaler is not None:
+        num_block = Pipeline([("imputer", num_block), (scaler_name, scaler)])
+    preproc = frozen_preprocessor(num_block, shared.blocks["cat"], shared.numeric, shared.categorical, X_sample, extra)
+    return Pipeline([(step_names[0], preproc), (step_names[1], estimator)])
+
+
+def frozen_preprocessor(num_block, cat_block, numeric, categorical, X_sample, extra=()) -> ColumnTransformer:
+    """ColumnTransformer con los bloques ya ajustados congelados (el fit sobre X_sample no los toca)."""
+    # salida siempre densa: la API, el FastEncoder y el formato plano trabajan con filas densas
+    preproc = ColumnTransformer([
+        ("num", FrozenEstimator(num_block), numeric),
+        ("cat", FrozenEstimator(cat_block), categorical),
+    ] + [(name, FrozenEstimator(block), columns) for name, block, columns in extra], sparse_threshold=0)
+    return preproc.fit(X_sample)
+
+
+def append_columns(X, extra: np.ndarray):
+    """Agrega columnas densas (ej: features espaciales) a la matriz de un modelo, respetando su formato."""
+    if sparse.issparse(X):
+        return sparse.hstack([X, sparse.csr_matrix(extra, dtype=X.dtype)], format="csr")
+    return np.hstack([X, np.asarray(extra, dtype=X.dtype)])
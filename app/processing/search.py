@@ -0,0 +1,127 @@
+import json
+import numpy as np
+from sklearn.base import clone
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401 (habilita Halving*SearchCV)
+from sklearn.model_selection import (
+    GridSearchCV, RandomizedSearchCV, HalvingRandomSearchCV, ShuffleSplit,
+)
+from app.utils.config import SEARCH_N_ITER, SEARCH_N_JOBS, SEARCH_VALIDATION_SIZE
+from app.utils.log_config import logger
+
+'''
+BÚSQUEDA DE HIPERPARÁMETROS (TRAIN_SEARCH = grid | random | halving)
+- el preprocesamiento se ajusta una sola vez y todos los candidatos entrenan sobre la misma matriz
+  (joblib la comparte con los procesos por memmap, sin copiarla por candidato)
+- los candidatos corren en paralelo en procesos (loky, SEARCH_N_JOBS); cada uno con n_jobs=1
+- validación: un único holdout (ShuffleSplit) del train; el test queda para el modelo final
+- halving: successive halving sobre la cantidad de filas (los peores candidatos se descartan con pocas filas)
+'''
+
+SEARCH_MODES = ("grid", "random", "halving")
+
+# espacios de búsqueda por modelo (nombres de parámetro del estimador que se busca)
+SEARCH_SPACES = {
+    "RandomForest": {
+        "regressor__n_estimators": [100, 200],
+        "regressor__min_samples_split": [2, 4, 8],
+        "regressor__min_samples_leaf": [1, 2],
+        "regressor__max_features": [1.0, 0.5],
+    },
+    "GradientBoosting": {
+        "n_estimators": [200, 400],
+        "learning_rate": [0.05, 0.1],
+        "max_depth": [3, 5],
+        "subsample": [0.8, 1.0],
+    },
+    "HistGradientBoosting": {
+        "learning_rate": [0.05, 0.1],
+        "max_leaf_nodes": [15, 31, 63],
+        "min_samples_leaf": [20, 50],
+        "l2_regularization": [0.0, 1.0],
+    },
+}
+
+# parámetros que paralelizan dentro del estimador: en la búsqueda se paraleliza entre candidatos
+_INNER_N_JOBS = {"RandomForest": "regressor__n_jobs"}
+
+SCORING = {"rmse": "neg_root_mean_squared_error", "mae": "neg_mean_absolute_error", "r2": "r2"}
+
+
+def _make_search(mode: str, estimator, space: dict, cv, random_state: int):
+    if mode == "grid":
+        return GridSearchCV(
+            estimator, space, scoring=SCORING, refit=False, cv=cv, n_jobs=SEARCH_N_JOBS,
+        )
+    if mode == "random":
+        return RandomizedSearchCV(
+            estimator, space, n_iter=SEARCH_N_ITER, scoring=SCORING, refit=False, cv=cv,
+            n_jobs=SEARCH_N_JOBS, random_state=random_state,
+        )
+    if mode == "halving":
+        # Halving solo admite una métrica: se optimiza RMSE
+        # min_resources="exhaust": la última ronda usa todo el train (por defecto arranca con 2 filas)
+        return HalvingRandomSearchCV(
+            estimator, space, n_candidates=SEARCH_N_ITER, factor=2, resource="n_samples",
+            min_resources="exhaust",
+            scoring=SCORING["rmse"], refit=False, cv=cv, n_jobs=SEARCH_N_JOBS,
+            random_state=random_state,
+        )
+    raise ValueError(f"Modo de búsqueda desconocido: {mode}. Opciones: {', '.join(SEARCH_MODES)}")
+
+
+def _trials(search, name: str) -> list[dict]:
+    """Una fila por candidato (y por ronda en halving) con las métricas de validación."""
+    results = search.cv_results_
+    multimetric = isinstance(search.scoring, dict)
+    trials = []
+    for i, params in enumerate(results["params"]):
+        if multimetric:
+            metrics = {
+                "rmse": -float(results["mean_test_rmse"][i]),
+                "mae": -float(results["mean_test_mae"][i]),
+                "r2": float(results["mean_test_r2"][i]),
+            }
+        else:
+            metrics = {"rmse": -float(results["mean_test_score"][i]), "mae": None, "r2": None}
+        extra = {"fit_time_s": round(float(results["mean_fit_time"][i]), 3)}
+        if "iter" in results:
+            extra.update(iter=int(results["iter"][i]), n_resources=int(results["n_resources"][i]))
+        trials.append({"model": name, "params": params, "metrics": metrics, "extra": extra})
+    return trials
+
+
+def search_model(name: str, estimator, Xt, y, mode: str, random_state: int = 42):
+    """
+    Busca hiperparámetros de un estimador sobre la matriz ya preprocesada Xt.
+    Devuelve (mejores parámetros, RMSE de validación del mejor, lista de trials).
+    """
+    space = SEARCH_SPACES[name]
+    estimator = clone(estimator)
+    if name in _INNER_N_JOBS:
+        estimator.set_params(**{_INNER_N_JOBS[name]: 1})
+    cv = ShuffleSplit(n_splits=1, test_size=SEARCH_VALIDATION_SIZE, random_state=random_state)
+    search = _make_search(mode, estimator, space, cv, random_state)
+    logger.info(f"Búsqueda {mode} de {name}: {len(space)} parámetros, n_jobs={SEARCH_N_JOBS}...")
+    search.fit(Xt, y)
+
+    trials = _trials(search, name)
+    # en halving solo cuentan los candidatos de la última ronda (entrenados con más filas)
+    last_iter = max(t["extra"].get("iter", 0) for t in trials)
+    finalists = [t for t in trials if t["extra"].get("iter", 0) == last_iter]
+    best = min(finalists, key=lambda t: t["metrics"]["rmse"])
+    logger.info(
+        f"{name}: {len(trials)} trials, mejor RMSE validación {best['metrics']['rmse']:.2f} "
+        f"con {json.dumps(best['params'])}"
+    )
+    return best["params"], best["metrics"]["rmse"], trials
+
+
+def refit_best(name: str, estimator, params: dict, Xt, y, **fit_params):
+    """Reentrena el mejor candidato con todo el train (con el paralelismo interno original)."""
+    model = clone(estimator).set_params(**params)
+    model.fit(Xt, y, **fit_params)
+    return model
+
+
+def to_jsonable(params: dict) -> dict:
+    return {k: (v.item() if isinstance(v, np.generic) else v) for k, v in params.items()}
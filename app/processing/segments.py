@@ -0,0 +1,182 @@
+import json
+import os
+import re
+import shutil
+from datetime import datetime, timezone
+import joblib
+from sklearn.pipeline import Pipeline
+from app.utils.config import (
+    OOC_L2, OOC_OPERATIONS, OOC_CHUNK_ROWS, OOC_MAX_LEAF_NODES,
+    SEGMENT_BY, SEGMENT_MIN_ROWS, SEGMENT_N_ESTIMATORS, SEGMENTS_DIR, SEGMENTS_INDEX_PATH,
+)
+from app.utils.log_config import logger
+from app.utils.jobs import JobContext, JobCancelled
+from app.utils.db import connection
+from app.processing.trainer import (
+    DB_PATH, training_filter, save_metrics_to_duckdb, export_flat_model, current_promotion_id, _sql_str,
+)
+from app.processing.out_of_core import (
+    OOC_NUMERIC_FEATURES, OOC_CATEGORICAL_FEATURES, TRAIN_WHERE, TEST_WHERE,
+    prepare_clean_table, build_preprocessors_by, fit_bagged_forest, evaluate_streaming,
+)
+
+'''
+MODELOS POR SEGMENTO (TRAIN_MODE = segments)
+- segmentos = combinaciones de SEGMENT_BY presentes en el dataset nacional (datos_clean del out-of-core,
+  que se reutiliza si ya está armada para la misma versión del lago)
+- cada segmento con >= SEGMENT_MIN_ROWS filas de train tiene su propio Pipeline, entrenado con las piezas
+  del out-of-core (preprocesamiento en streaming + bosque por bloques) filtrando por el segmento;
+  los preprocesamientos de todos los segmentos se ajustan en una sola pasada sobre datos_clean.
+  Las columnas de SEGMENT_BY no son features (son constantes dentro del segmento)
+- los artefactos van a SEGMENTS_DIR/run_<fecha>/ (.joblib + formato plano) y el índice
+  (SEGMENTS_INDEX_PATH) se reemplaza atómicamente al final; se conservan las últimas SEGMENT_RUNS_KEEP corridas
+- el índice lleva el promotion_id del modelo promovido al empezar la corrida: la API solo rutea
+  por segmento mientras ese siga siendo el modelo promovido
+Los segmentos sin modelo se sirven con el modelo promovido.
+'''
+
+SEGMENT_RUNS_KEEP = 2
+
+
+def segment_slug(values) -> str:
+    """Nombre de archivo del segmento (ej: Venta__Departamento)."""
+    return "__".join(re.sub(r"[^0-9A-Za-z]+", "_", str(v)).strip("_") or "NA" for v in values)
+
+
+def segment_where(values) -> str:
+    return " AND ".join(f"{col} = {_sql_str(str(v))}" for col, v in zip(SEGMENT_BY, values))
+
+
+def _segment_preprocessors(con, numeric, categorical) -> list[tuple[tuple, object, int]]:
+    """
+    (valores, preprocesamiento, filas de train) de cada segmento (sin NULL en las columnas del segmento),
+    de mayor a menor: un solo recorrido de datos_clean para todos.
+    """
+    not_null = " AND ".join(f"{c} IS NOT NULL" for c in SEGMENT_BY)
+    preprocs = build_preprocessors_by(con, numeric, categorical, SEGMENT_BY, f"{TRAIN_WHERE} AND {not_null}")
+    segments = [(values, preproc, n_train) for values, (preproc, n_train) in preprocs.items()]
+    return sorted(segments, key=lambda segment: segment[2], reverse=True)
+
+
+def _write_index(index: dict):
+    tmp_path = f"{SEGMENTS_INDEX_PATH}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(index, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, SEGMENTS_INDEX_PATH)
+
+
+def _prune_runs(keep_dir: str):
+    """Borra las corridas viejas, salvo las últimas SEGMENT_RUNS_KEEP (incluida keep_dir)."""
+    runs = sorted(
+        (d for d in os.listdir(SEGMENTS_DIR) if d.startswith("run_") and os.path.isdir(os.path.join(SEGMENTS_DIR, d))),
+        reverse=True,
+    )
+    keep = set(runs[:SEGMENT_RUNS_KEEP]) | {os.path.basename(keep_dir)}
+    for d in runs:
+        if d not in keep:
+            shutil.rmtree(os.path.join(SEGMENTS_DIR, d), ignore_errors=True)
+
+
+def run_segment_training(job: JobContext | None = None):
+    """
+    Entrena un modelo por segmento (SEGMENT_BY) sobre el dataset nacional y publica el índice.
+    Corre en el pool de procesos; la API recarga el modelo (y el índice) al terminar.
+    """
+    logger.info(f"--- Iniciando Entrenamiento por Segmento ({' x '.join(SEGMENT_BY)}) ---")
+    job = job or JobContext.local("train_segments")
+    where = training_filter(OOC_L2, OOC_OPERATIONS)
+    numeric = list(OOC_NUMERIC_FEATURES)
+    categorical = [c for c in OOC_CATEGORICAL_FEATURES if c not in SEGMENT_BY]
+    features = numeric + categorical
+    run_dir = os.path.join(SEGMENTS_DIR, "run_" + datetime.now().strftime("%Y%m%d_%H%M%S"))
+    entries, skipped = [], []
+    # modelo promovido que atiende los segmentos sin modelo propio
+    promotion_id = current_promotion_id()
+
+    try:
+        with connection(DB_PATH) as con:
+            if prepare_clean_table(con, where, job) == 0:
+                logger.error(f"No se encontraron datos para {where}. Exit entrenamiento.")
+                return {"status": "error", "message": "No hay datos para entrenar."}
+
+            with job.stage("preprocess"):
+                segments = _segment_preprocessors(con, numeric, categorical)
+
+            with job.stage("fit_segments"):
+                os.makedirs(run_dir, exist_ok=True)
+                for values, preproc, n_train in segments:
+                    label = " / ".join(map(str, values))
+                    if n_train < SEGMENT_MIN_ROWS:
+                        skipped.append({"key": dict(zip(SEGMENT_BY, values)), "train_rows": int(n_train)})
+                        continue
+                    logger.info(f"Segmento {label}: {n_train} filas de train")
+                    seg_where = segment_where(values)
+                    train_where = f"{TRAIN_WHERE} AND {seg_where}"
+                    test_where = f"{TEST_WHERE} AND {seg_where}"
+                    params = {
+                        "train_mode": "segments",
+                        "segment": dict(zip(SEGMENT_BY, values)),
+                        "ooc_chunk_rows": OOC_CHUNK_ROWS,
+                        "ooc_max_leaf_nodes": OOC_MAX_LEAF_NODES,
+                        "rf_n_estimators": SEGMENT_N_ESTIMATORS,
+                        "rf_min_samples_split": 4,
+                    }
+                    estimator, n_chunks = fit_bagged_forest(con, preproc, features, n_train, params, job, where=train_where)
+                    model = Pipeline([("preproc", preproc), ("est", estimator)])
+                    metrics = evaluate_streaming(model, con, features, where=test_where, name=f"Segmento {label}")
+
+                    slug = segment_slug(values)
+                    path = os.path.join(run_dir, f"{slug}.joblib")
+                    joblib.dump(model, path)
+                    flat_dir = os.path.join(run_dir, f"{slug}_flat")
+                    try:
+                        X_check = con.execute(
+                            f"SELECT {', '.join(features)} FROM datos_clean WHERE {test_where} LIMIT 1000"
+                        ).df()
+                        export_flat_model(model, X_check, out_dir=flat_dir)
+                    except Exception as e:
+                        logger.error(f"Segmento {label}: no se pudo exportar el formato plano: {e}")
+                        shutil.rmtree(flat_dir, ignore_errors=True)
+                        flat_dir = None
+
+                    params.update({
+                        "rf_n_estimators": len(estimator.regressor_.estimators_), "ooc_chunks": n_chunks,
+                        "rf_params": {"segment": label, "train_rows": int(n_train), "chunks": n_chunks},
+                    })
+                    save_metrics_to_duckdb(params, metrics, None, name_a=f"RandomForest[{label}]")
+                    entries.append({
+                        "key": dict(zip(SEGMENT_BY, values)), "path": path, "flat_path": flat_dir,
+                        "train_rows": int(n_train), "metrics": metrics,
+                    })
+                    del model, estimator, preproc
+
+        with job.stage("save"):
+            _write_index({
+                "segment_by": SEGMENT_BY,
+                "features": {"numeric": numeric, "categorical": categorical},
+                "filter": where,
+                "promotion_id": promotion_id,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "segments": entries,
+                "skipped": skipped,
+            })
+            _prune_runs(run_dir)
+        logger.info(f"--- Entrenamiento por Segmento Finalizado: {len(entries)} modelos, {len(skipped)} segmentos sin modelo ---")
+        return {
+            "status": "ok", "message": "Entrenamiento por segmento completo.", "mode": "segments",
+            "segments": len(entries), "skipped": len(skipped),
+        }
+
+    except JobCancelled as e:
+        logger.warning(f"Entrenamiento cancelado: {e}")
+        shutil.rmtree(run_dir, ignore_errors=True)
+        return {"status": "cancelled", "message": str(e)}
+    except Exception as e:
+        logger.error(f"ERROR en el entrenamiento por segmento: {e}", exc_info=True)
+        shutil.rmtree(run_dir, ignore_errors=True)
+        return {"status": "error", "message": str(e)}
+
+
+if __name__ == "__main__":
+    # python -m app.processing.segments
+    run_segment_training()
@@ -1,84 +1,222 @@
-import duckdb
-import pandas as pd
 import numpy as np
 import os
 import json
+import hashlib
+import glob
+import shutil
 import yaml
 import joblib
 from datetime import datetime
 from sklearn.model_selection import train_test_split
-from sklearn.pipeline import Pipeline
-from sklearn.compose import ColumnTransformer, TransformedTargetRegressor
-from sklearn.impute import SimpleImputer
-from sklearn.preprocessing import OneHotEncoder, StandardScaler, RobustScaler
-from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
+from sklearn.compose import TransformedTargetRegressor
+from sklearn.preprocessing import StandardScaler, RobustScaler
+from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor, HistGradientBoostingRegressor
 from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
 from dvclive import Live
+from app.utils.config import (
+    MANIFEST_PATH, METRICS_DB_PATH, LAKE_DIR, TRAINING_DB_PATH, TRAINING_L2, TRAINING_OPERATION, TRAIN_SEARCH, SEARCH_VALIDATION_SIZE, MODEL_B,
+    SPATIAL_FEATURES_ENABLED, SPATIAL_K, SPATIAL_CELL_DEG, SPATIAL_MIN_CELL_COUNT,
+    COMPARABLES_ENABLED, COMPARABLES_INDEX_PATH, COMPARABLES_GEO_KM, COMPARABLES_SURFACE_LOG, COMPARABLES_ROOMS_STEP,
+)
 from app.utils.log_config import logger
+from app.utils.jobs import JobContext, JobCancelled
+from app.utils.db import connection, snapshot_lake_files, lake_source
 
-from app.utils.model_loader import load_model
+from app.utils.flat_forest import export_flat_forest, load_flat_forest
+from app.utils.spatial import SpatialFeatures, GEO_COLUMNS, GEO_FEATURES
+from app.utils.comparables import ComparablesIndex, COMPARABLE_COLUMNS
+from app.processing.search import SEARCH_MODES, SEARCH_SPACES, search_model, refit_best, to_jsonable
+from app.processing.preprocessing import shared_features, scale_features, compose_pipeline, append_columns
 
 #  CONFIGURACIÓN DE RUTAS 
 BASE_DIR = "app/data"
-DB_PATH = os.path.join(BASE_DIR, "DB/entrenamiento.duckdb")
-METRICS_DB_PATH = os.path.join(BASE_DIR, "DB/experimento.duckdb")
+# base de trabajo del entrenamiento (datos_perfil / datos_clean); los datos crudos se leen del lago Parquet
+DB_PATH = TRAINING_DB_PATH
 MODEL_DIR = os.path.join(BASE_DIR, "artifacts/housing_models")
 MODEL_RF_PATH = os.path.join(MODEL_DIR, "random_forest.joblib")
 MODEL_GB_PATH = os.path.join(MODEL_DIR, "gradient_boosting.joblib")
-MANIFEST_PATH = os.path.join(MODEL_DIR, "manifest.json")
+MODEL_HGB_PATH = os.path.join(MODEL_DIR, "hist_gradient_boosting.joblib")
+# índice espacial del último entrenamiento (también va dentro de los Pipelines)
+MODEL_SPATIAL_PATH = os.path.join(MODEL_DIR, "spatial_index.joblib")
+# modelo promovido (el que sirve la API) y su formato plano
+MODEL_BEST_PATH = os.path.join(MODEL_DIR, "best_model.joblib")
+MODEL_BEST_FLAT_DIR = os.path.join(MODEL_DIR, "best_model_flat")
 METRICS_DIR = os.path.join(BASE_DIR, "metrics")
 PARAMS_PATH = os.path.join(METRICS_DIR, "params.yaml")
 
-#   FEATURE ENGINEERING Y LIMPIEZA 
-
-def profile(df: pd.DataFrame):
-    """Genera un perfil estadístico del DataFrame."""
-    logger.info("Generando perfil de datos...")
-    return pd.DataFrame(
-        {
-            "dtype": df.dtypes,
-            "n_nulls": df.isnull().sum(),
-            "n_unique": df.nunique(),
-            "min": df.min(numeric_only=True),
-            "Q1": df.quantile(0.25, numeric_only=True),
-            "median": df.median(numeric_only=True),
-            "mean": df.mean(numeric_only=True),
-            "Q3": df.quantile(0.75, numeric_only=True),
-            "max": df.max(numeric_only=True),
-        }
+#   FEATURE ENGINEERING Y LIMPIEZA (en DuckDB)
+'''
+Toda la limpieza corre como SQL dentro de DuckDB y arma la tabla datos_clean sin pasar por pandas.
+Los datos se leen del lago Parquet particionado con read_parquet(hive_partitioning): los archivos de la
+versión del último snapshot publicado por la ingesta (no espera a una ingesta en curso), y el filtro de
+l2 / operation_type descarta particiones enteras.
+datos_perfil y datos_clean se escriben en la base de trabajo del entrenamiento (TRAINING_DB_PATH).
+- datos_perfil: Q1/Q3 (quantile_cont) y límites IQR de cada columna numérica
+- datos_clean: fechas placeholder -> NULL, clip IQR (NULL se mantiene NULL) y features derivadas
+Solo la matriz final de features vuelve a Python.
+'''
+
+def _sql_str(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+def training_filter(l2: list[str] | None, operations: list[str] | None) -> str:
+    """WHERE del dataset de entrenamiento; una lista vacía o None no filtra esa columna."""
+    conditions = [
+        f"{col} IN ({', '.join(_sql_str(v) for v in values)})"
+        for col, values in (("l2", l2), ("operation_type", operations)) if values
+    ]
+    return " AND ".join(conditions) or "TRUE"
+
+# filtro del dataset de entrenamiento (por defecto CABA y Venta, ver config.py)
+TRAINING_FILTER = training_filter([TRAINING_L2], [TRAINING_OPERATION])
+DROP_COLUMNS = ["l1", "l2", "l4", "l5", "l6", "ad_type", "title", "description", "id"]
+DATE_COLUMNS = ["start_date", "end_date", "created_on"]
+# features del modelo (el target es price)
+NUMERIC_FEATURES = [
+    "lon", "lat", "rooms", "bedrooms", "bathrooms",
+    "surface_total", "surface_covered", "days_active", "created_age_days",
+]
+CATEGORICAL_FEATURES = ["l3", "currency", "price_period", "property_type", "operation_type"]
+DATE_PLACEHOLDER = "9999-12-31"
+NUMERIC_TYPES = {
+    "TINYINT", "SMALLINT", "INTEGER", "BIGINT", "HUGEINT",
+    "UTINYINT", "USMALLINT", "UINTEGER", "UBIGINT", "FLOAT", "DOUBLE",
+}
+
+def training_source(con):
+    """
+    Relación de la que lee el entrenamiento: read_parquet(hive_partitioning) sobre los archivos del lago
+    del último snapshot de la ingesta o, si todavía no hay snapshot, sobre el lago entero.
+    """
+    files = snapshot_lake_files(con)
+    if files is None:
+        files = sorted(glob.glob(os.path.join(LAKE_DIR, "**", "*.parquet"), recursive=True))
+    if not files:
+        raise FileNotFoundError(f"No hay datos de entrenamiento en {LAKE_DIR}. Ejecute la ingesta.")
+    logger.info(f"Fuente de entrenamiento: lago Parquet {LAKE_DIR} ({len(files)} archivos).")
+    return lake_source(files)
+
+def _numeric_columns(con, source):
+    """Columnas numéricas de la fuente (las que se perfilan y recortan), sin las descartadas."""
+    columns = con.execute(f"SELECT column_name, column_type FROM (DESCRIBE SELECT * FROM {source})").fetchall()
+    return [
+        name for name, col_type in columns
+        if name not in DROP_COLUMNS and (col_type in NUMERIC_TYPES or col_type.startswith("DECIMAL"))
+    ]
+
+def profile(con, source, where=TRAINING_FILTER):
+    """
+    Genera el perfil estadístico de las columnas numéricas en la tabla datos_perfil.
+    Los cuantiles usan quantile_cont (interpolación lineal, ignora NULL).
+    where: filtro de filas (por defecto el dataset de entrenamiento en memoria).
+    """
+    logger.info("Generando perfil de datos (DuckDB)...")
+    numeric = _numeric_columns(con, source)
+    casted = ", ".join(f"CAST({c} AS DOUBLE) AS {c}" for c in numeric)
+    con.execute(f"""
+        CREATE OR REPLACE TABLE datos_perfil AS
+        WITH largo AS (
+            UNPIVOT (SELECT {casted} FROM {source} WHERE {where})
+            ON {", ".join(numeric)}
+            INTO NAME columna VALUE valor
+        ),
+        stats AS (
+            SELECT
+                columna,
+                count(valor) AS n,
+                min(valor) AS min,
+                quantile_cont(valor, 0.25) AS q1,
+                median(valor) AS median,
+                avg(valor) AS mean,
+                quantile_cont(valor, 0.75) AS q3,
+                max(valor) AS max
+            FROM largo
+            GROUP BY columna
+        )
+        SELECT
+            *,
+            q3 - q1 AS iqr,
+            CASE WHEN q3 - q1 > 0 THEN q1 - 1.5 * (q3 - q1) END AS lim_inf,
+            CASE WHEN q3 - q1 > 0 THEN q3 + 1.5 * (q3 - q1) END AS lim_sup
+        FROM stats
+    """)
+    return con.execute("SELECT * FROM datos_perfil ORDER BY columna").df()
+
+def _clip_expr(col):
+    """Recorte IQR de una columna; NULL sigue NULL y sin límites (IQR <= 0) no se recorta."""
+    lim = f"(SELECT {{}} FROM datos_perfil WHERE columna = '{col}')"
+    lower, upper = lim.format("lim_inf"), lim.format("lim_sup")
+    return (
+        f"CASE WHEN {col} IS NULL OR {lower} IS NULL THEN {col} "
+        f"WHEN {col} < {lower} THEN {lower} "
+        f"WHEN {col} > {upper} THEN {upper} "
+        f"ELSE {col} END AS {col}"
     )
 
-def clip_outliers(df, profile_df):
-    """Recorta outliers usando el método IQR (clip, sin eliminar filas)"""
-    logger.info("Recortando outliers (clip)...")
-    df_clipped = df.copy()
-    for col in df_clipped.select_dtypes(include=np.number).columns:
-        if col in profile_df.index:
-            Q1 = profile_df.loc[col, "Q1"]
-            Q3 = profile_df.loc[col, "Q3"]
-            IQR = Q3 - Q1
-            if pd.notna(IQR) and IQR > 0:
-                lower = Q1 - 1.5 * IQR
-                upper = Q3 + 1.5 * IQR
-                df_clipped[col] = df_clipped[col].clip(lower, upper)
-    return df_clipped
-
-def clean_temporal_columns(df, date_cols, placeholder="9999-12-31"):
-    """Limpia columnas de fecha, reemplaza placeholders y convierte a datetime."""
-    logger.info("Limpiando columnas temporales...")
-    for col in date_cols:
-        if col in df.columns:
-            if df[col].astype(str).str.contains(placeholder).any():
-                df[col] = df[col].replace(placeholder, pd.NA)
-            df[col] = pd.to_datetime(df[col], errors="coerce")
-    return df
-
-def create_features(df):
-    """Crea nuevas features a partir de las columnas existentes."""
-    logger.info("Creando nuevas features (days_active, created_age_days)...")
-    df["days_active"] = (df["end_date"] - df["start_date"]).dt.days.astype(float)
-    df["created_age_days"] = (pd.Timestamp.today() - df["created_on"]).dt.days.astype(float)
-    return df
+def clean_table_key(source, where=TRAINING_FILTER, keep=()) -> str:
+    """
+    Clave de una datos_clean: archivos del lago (source), filtro, columnas conservadas y fecha
+    (created_age_days se calcula contra current_date). build_clean_table la deja como comentario de la tabla.
+    """
+    payload = json.dumps({"source": source, "where": where, "keep": sorted(keep), "date": datetime.now().date().isoformat()})
+    return hashlib.sha256(payload.encode()).hexdigest()[:24]
+
+def current_clean_key(con) -> str | None:
+    """Clave de la datos_clean que hay en la base (None si no hay o la armó otra versión del código)."""
+    row = con.execute(
+        "SELECT comment FROM duckdb_tables() WHERE database_name = current_database() "
+        "AND schema_name = 'main' AND table_name = 'datos_clean'"
+    ).fetchone()
+    return row[0] if row else None
+
+def build_clean_table(con, source, where=TRAINING_FILTER, keep=()):
+    """
+    Construye datos_clean dentro de DuckDB a partir de la fuente y datos_perfil:
+    descarta columnas, limpia fechas placeholder, recorta outliers y crea
+    days_active / created_age_days. Las filas quedan ordenadas por id.
+    keep: columnas de DROP_COLUMNS que se conservan (ej: l2 en el modelo nacional).
+    """
+    logger.info("Limpiando datos en DuckDB (fechas, clip IQR, features)...")
+    numeric = _numeric_columns(con, source)
+    dates = ", ".join(
+        f"NULLIF(TRY_CAST({c} AS DATE), DATE '{DATE_PLACEHOLDER}') AS {c}" for c in DATE_COLUMNS
+    )
+    clipped = ", ".join(_clip_expr(c) for c in numeric)
+    drop = [c for c in DROP_COLUMNS if c not in keep]
+    con.execute(f"""
+        CREATE OR REPLACE TABLE datos_clean AS
+        WITH filtrado AS (
+            SELECT * EXCLUDE ({", ".join(drop)}) REPLACE ({dates})
+            FROM {source}
+            WHERE {where}
+            ORDER BY id
+        )
+        SELECT
+            * REPLACE ({clipped}),
+            CAST(date_diff('day', start_date, end_date) AS DOUBLE) AS days_active,
+            CAST(date_diff('day', created_on, current_date) AS DOUBLE) AS created_age_days
+        FROM filtrado
+    """)
+    con.execute(f"COMMENT ON TABLE datos_clean IS '{clean_table_key(source, where, keep)}'")
+    return con.execute("SELECT count(*) FROM datos_clean").fetchone()[0]
+
+def load_feature_matrix(con, features, target="price"):
+    """Trae a pandas solo las features y el target (filas con target no nulo) de datos_clean."""
+    cols = ", ".join(features + [target])
+    df = con.execute(f"SELECT {cols} FROM datos_clean WHERE {target} IS NOT NULL ORDER BY rowid").df()
+    return df[features], df[target].values
+
+def build_comparables(con, source, where=TRAINING_FILTER) -> ComparablesIndex:
+    """Índice de comparables con los avisos originales del dataset de entrenamiento (sin clip IQR)."""
+    df = con.execute(f"""
+        SELECT {", ".join(COMPARABLE_COLUMNS)} FROM {source}
+        WHERE {where} AND price > 0 AND surface_total > 0 AND lat IS NOT NULL AND lon IS NOT NULL
+    """).df()
+    index = ComparablesIndex(
+        geo_km=COMPARABLES_GEO_KM, surface_log=COMPARABLES_SURFACE_LOG, rooms_step=COMPARABLES_ROOMS_STEP,
+    ).fit(df)
+    logger.info(f"Índice de comparables: {index.n_indexed_} avisos en {len(index.groups_)} grupos.")
+    return index
 
 #  FUNCIONES DE EVALUACIÓN Y GUARDADO 
 
@@ -91,12 +229,7 @@ def evaluate(model, X_te, y_te, name="model"):
     logger.info(f"--- {name} --- RMSE: {rmse:.2f}, MAE: {mae:.2f}, R2: {r2:.4f}")
     return {"rmse": float(rmse), "mae": float(mae), "r2": float(r2)}
 
-def save_metrics_to_duckdb(params, metrics_rf, metrics_gb):
-    """Guarda los parámetros y métricas de la ejecución en la DB de experimentos."""
-    logger.info(f"Guardando métricas en DuckDB: {METRICS_DB_PATH}")
-    os.makedirs(os.path.dirname(METRICS_DB_PATH), exist_ok=True)
-    con = duckdb.connect(METRICS_DB_PATH)
-    
+def _ensure_metrics_table(con):
     con.execute("""
     CREATE TABLE IF NOT EXISTS metricas (
         fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -113,6 +246,43 @@ def save_metrics_to_duckdb(params, metrics_rf, metrics_gb):
         gb_subsample DOUBLE,
         test_size DOUBLE
     )""")
+    # búsqueda de hiperparámetros: todos los parámetros del trial y sobre qué conjunto se midió
+    con.execute("ALTER TABLE metricas ADD COLUMN IF NOT EXISTS params_json TEXT")
+    con.execute("ALTER TABLE metricas ADD COLUMN IF NOT EXISTS conjunto TEXT")
+
+_METRICS_INSERT = """
+    INSERT INTO metricas (
+        fecha, experimento, modelo, rmse, mae, r2,
+        rf_n_estimators, rf_min_samples_split,
+        gb_n_estimators, gb_learning_rate, gb_max_depth, gb_subsample,
+        test_size, params_json, conjunto
+    ) VALUES (CURRENT_TIMESTAMP, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+def _trial_row(exp_name, trial, validation_size):
+    """Fila de metricas para un candidato de la búsqueda (métricas de validación)."""
+    p, m = trial["params"], trial["metrics"]
+    return [
+        exp_name, trial["model"], m["rmse"], m["mae"], m["r2"],
+        p.get("regressor__n_estimators"), p.get("regressor__min_samples_split"),
+        p.get("n_estimators"), p.get("learning_rate"), p.get("max_depth"), p.get("subsample"),
+        validation_size, json.dumps({**to_jsonable(p), **trial["extra"]}), "validacion",
+    ]
+
+def save_metrics_to_duckdb(params, metrics_rf, metrics_gb, trials=None, name_b="GradientBoosting",
+                           name_a="RandomForest"):
+    """
+    Guarda los parámetros y métricas de la ejecución en la DB de experimentos.
+    trials: candidatos de la búsqueda de hiperparámetros (una fila por trial, conjunto='validacion').
+    name_b: nombre del modelo B (GradientBoosting / HistGradientBoosting); usa las columnas gb_*.
+    metrics_gb=None: ejecución con un solo modelo (ej: entrenamiento out-of-core), sin fila del modelo B.
+    """
+    logger.info(f"Guardando métricas en DuckDB: {METRICS_DB_PATH}")
+    with connection(METRICS_DB_PATH) as con:
+        _insert_metrics(con, params, metrics_rf, metrics_gb, trials, name_b, name_a)
+
+def _insert_metrics(con, params, metrics_rf, metrics_gb, trials, name_b, name_a):
+    _ensure_metrics_table(con)
 
     exp_name = "exp_" + datetime.now().strftime("%Y%m%d_%H%M%S")
     
@@ -125,95 +295,122 @@ def save_metrics_to_duckdb(params, metrics_rf, metrics_gb):
     gb_subsample = params.get("gb_subsample")
     test_size = params.get("split_test_size", 0.2)
 
+    # Trials de la búsqueda (si hubo)
+    if trials:
+        con.executemany(_METRICS_INSERT, [
+            _trial_row(exp_name, t, params.get("search_validation_size")) for t in trials
+        ])
+
     # Insertar métricas  de RandomForest en tabla
-    con.execute("""
-    INSERT INTO metricas VALUES (
-        CURRENT_TIMESTAMP, ?, 'RandomForest', ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
-    )""", [
-        exp_name,
+    con.execute(_METRICS_INSERT, [
+        exp_name, name_a,
         metrics_rf["rmse"], metrics_rf["mae"], metrics_rf["r2"],
         rf_n_estimators, rf_min_samples_split,
         None, None, None, None,
-        test_size,
+        test_size, json.dumps(params.get("rf_params", {})), "test",
     ])
 
-    # Insertar métricas de GradientBoosting
-    con.execute("""
-    INSERT INTO metricas VALUES (
-        CURRENT_TIMESTAMP, ?, 'GradientBoosting', ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
-    )""", [
-        exp_name,
-        metrics_gb["rmse"], metrics_gb["mae"], metrics_gb["r2"],
-        None, None,
-        gb_n_estimators, gb_learning_rate, gb_max_depth, gb_subsample,
-        test_size,
-    ])
+    # Insertar métricas del modelo B (GradientBoosting / HistGradientBoosting)
+    if metrics_gb is not None:
+        con.execute(_METRICS_INSERT, [
+            exp_name, name_b,
+            metrics_gb["rmse"], metrics_gb["mae"], metrics_gb["r2"],
+            None, None,
+            gb_n_estimators, gb_learning_rate, gb_max_depth, gb_subsample,
+            test_size, json.dumps(params.get("gb_params", {})), "test",
+        ])
 
-    con.close()
     logger.info(f"Métricas guardadas exitosamente para el experimento: {exp_name}")
 
+def export_flat_model(model, X_te, out_dir=MODEL_BEST_FLAT_DIR):
+    """
+    Exporta el modelo promovido al formato plano memory-mappable y verifica que prediga
+    lo mismo que el Pipeline de sklearn sobre una muestra del test.
+    """
+    logger.info(f"Exportando modelo en formato plano: {out_dir}")
+    export_flat_forest(model, out_dir)
+    sample = X_te.iloc[:1000]
+    flat_pred = load_flat_forest(out_dir, mmap=True).predict(sample)
+    if not np.allclose(flat_pred, model.predict(sample), rtol=1e-9, atol=0):
+        raise ValueError("El modelo en formato plano no coincide con el Pipeline de sklearn.")
+    logger.info("Formato plano verificado contra sklearn.")
+
+def promote_model(source_path, dest_path=MODEL_BEST_PATH) -> str:
+    """
+    Publica un .joblib ya guardado como el modelo que sirve la API.
+    Hardlink (o copia) a un temporal y os.replace: la API nunca ve un archivo a medio escribir.
+    Devuelve el promotion_id que se guarda en el manifiesto (los segmentos se atan a él).
+    """
+    tmp_path = f"{dest_path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        os.link(source_path, tmp_path)
+    except OSError:
+        shutil.copyfile(source_path, tmp_path)
+    os.replace(tmp_path, dest_path)
+    promotion_id = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    logger.info(f"Modelo promovido: {source_path} -> {dest_path} (promotion_id={promotion_id})")
+    return promotion_id
+
+def current_promotion_id() -> str | None:
+    """promotion_id del modelo promovido según el manifiesto (None si no hay o es anterior a los ids)."""
+    try:
+        with open(MANIFEST_PATH) as f:
+            return json.load(f).get("promoted", {}).get("promotion_id")
+    except (OSError, ValueError):
+        return None
+
 #  PIPELINE  DE ENTRENAMIENTO 
 
-async def run_training_pipeline():
-    """Función principal que ejecuta todo el pipeline de entrenamiento."""
+# MODEL_B -> nombre del segundo modelo (manifest, métricas y búsqueda)
+MODEL_B_NAMES = {"gb": "GradientBoosting", "hgb": "HistGradientBoosting"}
+
+def run_training_pipeline(job: JobContext | None = None, search: str | None = None, model_b: str | None = None):
+    """
+    Función principal que ejecuta todo el pipeline de entrenamiento.
+    Corre en el pool de procesos (app/utils/task_pool.py); la API recarga el modelo al terminar.
+    job: contexto del job (etapas y cancelación); None al correr como script.
+    search: búsqueda de hiperparámetros (off | grid | random | halving); None usa TRAIN_SEARCH.
+    model_b: segundo modelo (gb | hgb); None usa MODEL_B.
+    """
     logger.info("--- Iniciando Pipeline de Entrenamiento ---")
+    job = job or JobContext.local("train")
+    search = (search or TRAIN_SEARCH).lower()
+    if search != "off" and search not in SEARCH_MODES:
+        return {"status": "error", "message": f"Búsqueda desconocida: {search}. Opciones: off, {', '.join(SEARCH_MODES)}"}
+    model_b = (model_b or MODEL_B).lower()
+    if model_b not in MODEL_B_NAMES:
+        return {"status": "error", "message": f"Modelo B desconocido: {model_b}. Opciones: {', '.join(MODEL_B_NAMES)}"}
+    name_b = MODEL_B_NAMES[model_b]
     
     try:
-        #  Cargar datos desde DuckDB (generados por la ingesta)
-        logger.info(f"Conectando a DuckDB en {DB_PATH} para cargar datos...")
-        con = duckdb.connect(DB_PATH)
-        # Filtra solo CABA (l2 = 'Capital Federal') y Venta para que el dataset sea manejable
-        df_raw = con.execute("""
-            SELECT * FROM datos_raw 
-            WHERE l2 = 'Capital Federal' AND operation_type = 'Venta'
-        """).df()
-        con.close()
-        
-        if df_raw.empty:
-            logger.error("No se encontraron datos en 'datos_raw'. Exit entrenamiento.")
-            return {"status": "error", "message": "No hay datos para entrenar."}
-            
-        logger.info(f"Datos cargados: {df_raw.shape[0]} filas.")
+        # Definición de Features y Target
+        numeric_feats = list(NUMERIC_FEATURES)
+        categorical_feats = list(CATEGORICAL_FEATURES)
 
-        #  Limpieza de datos
-        df = df_raw.drop(columns=["l1", "l2", "l4", "l5", "l6", "ad_type", "title", "description", "id"], errors='ignore')
-        df = clean_temporal_columns(df, ["start_date", "end_date", "created_on"])
+        #  Limpieza en DuckDB sobre el lago Parquet de la última ingesta
+        logger.info(f"Conectando a DuckDB en {DB_PATH}...")
+        with connection(DB_PATH) as con:
+            source = training_source(con)
+            logger.info(f"Filtro de entrenamiento: {TRAINING_FILTER}")
 
-        #  Profiling y Clipping de Outliers
-        profile_df = profile(df)
-        df = clip_outliers(df, profile_df)
+            #  Profiling (cuantiles y límites IQR)
+            with job.stage("profile"):
+                profile(con, source)
 
-        #  Feature Engineering
-        df = create_features(df)
-        
-        #  Guardar datos limpios en DuckDB 
-        logger.info(f"Guardando datos limpios en la tabla 'datos_clean' de {DB_PATH}...")
-        try:
-            con = duckdb.connect(DB_PATH)
-            con.register("df_clean_temp", df)
-            con.execute("""
-                CREATE OR REPLACE TABLE datos_clean AS 
-                SELECT * FROM df_clean_temp
-            """)
-            con.close()
-            logger.info("Tabla 'datos_clean' guardada")
-        except Exception as e:
-            logger.error(f"No se pudo guardar la tabla 'datos_clean': {e}")
-       
+            #  Fechas, clipping de outliers y feature engineering -> datos_clean
+            with job.stage("clean"):
+                n_rows = build_clean_table(con, source)
+            logger.info(f"Tabla 'datos_clean' guardada: {n_rows} filas.")
 
-        # Definición de Features y Target
-        numeric_feats = [
-            "lon", "lat", "rooms", "bedrooms", "bathrooms",
-            "surface_total", "surface_covered", "days_active", "created_age_days",
-        ]
-        categorical_feats = [
-            "l3", "currency", "price_period", "property_type", "operation_type",
-        ]
-        
-        # Eliminar filas donde el target (price) es nulo
-        df = df.dropna(subset=["price"])
-        X = df[numeric_feats + categorical_feats].copy()
-        y = df["price"].values
+            if n_rows == 0:
+                logger.error(f"No se encontraron datos para {TRAINING_FILTER}. Exit entrenamiento.")
+                return {"status": "error", "message": "No hay datos para entrenar."}
+
+            #  Solo la matriz final vuelve a Python (filas con price no nulo)
+            with job.stage("duckdb_load"):
+                X, y = load_feature_matrix(con, numeric_feats + categorical_feats)
         logger.info(f"Datos listos para entrenamiento: {X.shape[0]} filas.")
 
         #  División Train/Test
@@ -221,28 +418,33 @@ async def run_training_pipeline():
             X, y, test_size=0.2, random_state=42
         )
 
-        #   Pipelines de Preprocesamiento
-        num_transform_rf = Pipeline([
-            ("imputer", SimpleImputer(strategy="median")),
-            ("robust_scaler", RobustScaler()),
-        ])
-        num_transform_gb = Pipeline([
-            ("imputer", SimpleImputer(strategy="median")),
-            ("scaler", StandardScaler()),
-        ])
-        cat_transform = Pipeline([
-            ("imputer", SimpleImputer(strategy="constant", fill_value="missing")),
-            ("ohe", OneHotEncoder(handle_unknown="ignore", sparse_output=False)),
-        ])
+        #   Preprocesamiento: imputación + one-hot compartidos (una vez, con caché) y un scaler por modelo
+        with job.stage("preprocess"):
+            shared = shared_features(X_train, X_test, numeric_feats, categorical_feats)
+            scaler_rf, Xt_train_rf, Xt_test_rf = scale_features(shared, RobustScaler())
+            if model_b == "hgb":
+                # HistGradientBoosting: categorías como códigos (soporte nativo), sin one-hot ni scaler
+                shared_b = shared_features(X_train, X_test, numeric_feats, categorical_feats, kind="ordinal")
+                scaler_gb, Xt_train_gb, Xt_test_gb = None, shared_b.matrix("train"), shared_b.matrix("test")
+            else:
+                shared_b = shared
+                scaler_gb, Xt_train_gb, Xt_test_gb = scale_features(shared, StandardScaler(), accept_sparse=True)
+            categorical_mask_b = shared_b.categorical_mask
 
-        preproc_rf = ColumnTransformer([
-            ("num", num_transform_rf, numeric_feats),
-            ("cat", cat_transform, categorical_feats),
-        ])
-        preproc_gb = ColumnTransformer([
-            ("num", num_transform_gb, numeric_feats),
-            ("cat", cat_transform, categorical_feats),
-        ])
+            #  Features espaciales (precio por m² del entorno), iguales para los dos modelos
+            spatial, geo_blocks = None, ()
+            if SPATIAL_FEATURES_ENABLED:
+                spatial = SpatialFeatures(k=SPATIAL_K, cell_deg=SPATIAL_CELL_DEG, min_cell_count=SPATIAL_MIN_CELL_COUNT)
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    ppm2_train = y_train / X_train["surface_total"].to_numpy(dtype=np.float64)
+                # train leave-one-out: ningún aviso ve su propio precio
+                geo_train = spatial.fit_transform(X_train[GEO_COLUMNS], ppm2_train)
+                geo_test = spatial.transform(X_test[GEO_COLUMNS])
+                Xt_train_rf, Xt_test_rf = append_columns(Xt_train_rf, geo_train), append_columns(Xt_test_rf, geo_test)
+                Xt_train_gb, Xt_test_gb = append_columns(Xt_train_gb, geo_train), append_columns(Xt_test_gb, geo_test)
+                categorical_mask_b = np.r_[categorical_mask_b, np.zeros(len(GEO_FEATURES), dtype=bool)]
+                geo_blocks = [("geo", spatial, GEO_COLUMNS)]
+                logger.info(f"Índice espacial: {spatial.n_indexed_} avisos, features {', '.join(GEO_FEATURES)}")
 
         #  Parámetros y Modelos
         params = {
@@ -250,12 +452,20 @@ async def run_training_pipeline():
             "rf_n_estimators": 100,
             "rf_min_samples_split": 4,
             "rf_scaler": "RobustScaler",
+            "gb_scaler": "StandardScaler",
+            "preproc_key": shared.key,
+            "preproc_cached": shared.cached,
+            "feature_layout": shared.layout,
+            "model_b": name_b,
             "gb_n_estimators": 200,
             "gb_learning_rate": 0.05,
             "gb_max_depth": 3,
             "gb_subsample": 0.8,
             "numeric_features": numeric_feats,
             "categorical_features": categorical_feats,
+            "spatial_features": GEO_FEATURES if spatial is not None else None,
+            "spatial_k": SPATIAL_K if spatial is not None else None,
+            "spatial_cell_deg": SPATIAL_CELL_DEG if spatial is not None else None,
         }
         
         rf_regressor = RandomForestRegressor(
@@ -264,82 +474,192 @@ async def run_training_pipeline():
             n_jobs=-1,
             random_state=42,
         )
-        
         # Transformamos el target (log-transform) para RF
-        model_rf = Pipeline([
-            ("preproc", preproc_rf),
-            ("est", TransformedTargetRegressor(
-                regressor=rf_regressor, func=np.log1p, inverse_func=np.expm1
-            )),
-        ])
-
-        model_gb = Pipeline([
-            ("preprocessor", preproc_gb),
-            ("model", GradientBoostingRegressor(
+        rf_estimator = TransformedTargetRegressor(
+            regressor=rf_regressor, func=np.log1p, inverse_func=np.expm1
+        )
+        if model_b == "hgb":
+            # gb_n_estimators es el máximo: el early stopping corta antes (se guarda n_iter_)
+            params.update({
+                "gb_scaler": None,
+                "gb_n_estimators": 500,
+                "gb_learning_rate": 0.1,
+                "gb_max_depth": None,
+                "gb_subsample": None,
+                "hgb_max_leaf_nodes": 31,
+                "hgb_validation_fraction": 0.1,
+                "hgb_n_iter_no_change": 20,
+                "preproc_b_key": shared_b.key,
+            })
+            gb_estimator = HistGradientBoostingRegressor(
+                max_iter=params["gb_n_estimators"],
+                learning_rate=params["gb_learning_rate"],
+                max_leaf_nodes=params["hgb_max_leaf_nodes"],
+                categorical_features=categorical_mask_b,
+                early_stopping=True,
+                validation_fraction=params["hgb_validation_fraction"],
+                n_iter_no_change=params["hgb_n_iter_no_change"],
+                random_state=42,
+            )
+            # HistGradientBoosting no acepta monitor: la cancelación se revisa al terminar el fit
+            gb_fit_params = {}
+        else:
+            gb_estimator = GradientBoostingRegressor(
                 n_estimators=params["gb_n_estimators"],
                 learning_rate=params["gb_learning_rate"],
                 max_depth=params["gb_max_depth"],
                 subsample=params["gb_subsample"],
                 random_state=42,
-            )),
-        ])
+            )
+            # el monitor corta el fit entre iteraciones si se cancela el job
+            gb_fit_params = {"monitor": job.gb_monitor}
         
         #  Entrenamiento y Logging con DVCLive
         os.makedirs(METRICS_DIR, exist_ok=True)
+        trials = None
         
         with Live(METRICS_DIR, save_dvc_exp=False, resume=True) as live:
+            if search == "off":
+                with job.stage("fit_rf"):
+                    logger.info("Entrenando modelo A RandomForest...")
+                    rf_fitted = rf_estimator.fit(Xt_train_rf, y_train)
+                    logger.info("Entrenamiento de RandomForest completo.")
+
+                with job.stage("fit_gb"):
+                    logger.info(f"Entrenando modelo B {name_b}...")
+                    gb_fitted = gb_estimator.fit(Xt_train_gb, y_train, **gb_fit_params)
+                    job.check_cancelled()
+                    logger.info(f"Entrenamiento de {name_b} completo.")
+                # se sirve el RandomForest
+                promoted = "RandomForest"
+                params["rf_params"] = {k: v for k, v in rf_estimator.get_params().items() if k in SEARCH_SPACES["RandomForest"]}
+                params["gb_params"] = {k: v for k, v in gb_estimator.get_params().items() if k in SEARCH_SPACES[name_b]}
+            else:
+                #  Búsqueda de hiperparámetros: todos los candidatos usan la matriz ya preprocesada
+                with job.stage("fit_rf"):
+                    rf_best, rf_val_rmse, rf_trials = search_model("RandomForest", rf_estimator, Xt_train_rf, y_train, search)
+                    job.check_cancelled()
+                    logger.info("Reentrenando el mejor RandomForest con todo el train...")
+                    rf_fitted = refit_best("RandomForest", rf_estimator, rf_best, Xt_train_rf, y_train)
+
+                with job.stage("fit_gb"):
+                    gb_best, gb_val_rmse, gb_trials = search_model(name_b, gb_estimator, Xt_train_gb, y_train, search)
+                    job.check_cancelled()
+                    logger.info(f"Reentrenando el mejor {name_b} con todo el train...")
+                    gb_fitted = refit_best(name_b, gb_estimator, gb_best, Xt_train_gb, y_train, **gb_fit_params)
+                    job.check_cancelled()
+
+                trials = rf_trials + gb_trials
+                # se promueve el mejor en validación (el test queda solo para reportar)
+                promoted = "RandomForest" if rf_val_rmse <= gb_val_rmse else name_b
+                params.update({
+                    "search": search,
+                    "search_validation_size": SEARCH_VALIDATION_SIZE,
+                    "search_trials": len(trials),
+                    "rf_params": to_jsonable(rf_best),
+                    "gb_params": to_jsonable(gb_best),
+                    "rf_n_estimators": rf_best.get("regressor__n_estimators", params["rf_n_estimators"]),
+                    "rf_min_samples_split": rf_best.get("regressor__min_samples_split", params["rf_min_samples_split"]),
+                    "gb_n_estimators": gb_best.get("n_estimators", params["gb_n_estimators"]),
+                    "gb_learning_rate": gb_best.get("learning_rate", params["gb_learning_rate"]),
+                    "gb_max_depth": gb_best.get("max_depth", params["gb_max_depth"]),
+                    "gb_subsample": gb_best.get("subsample", params["gb_subsample"]),
+                })
+            if model_b == "hgb":
+                # iteraciones que quedaron tras el early stopping
+                params["gb_n_estimators"] = int(gb_fitted.n_iter_)
+            params["promoted_model"] = promoted
             live.log_params(params)
-            
-            logger.info("Entrenando modelo A RandomForest...")
-            model_rf.fit(X_train, y_train)
-            logger.info("Entrenamiento de RandomForest completo.")
 
-            logger.info("Entrenando modelo B GradientBoosting...")
-            model_gb.fit(X_train, y_train)
-            logger.info("Entrenamiento de GradientBoosting completo.")
-            
-            #  Evaluación
-            logger.info("Evaluando modelos...")
-            metrics_rf = evaluate(model_rf, X_test, y_test, name="RandomForest")
-            metrics_gb = evaluate(model_gb, X_test, y_test, name="GradientBoosting")
-
-            # Loggear métricas
-            live.log_metric("rf_rmse", metrics_rf["rmse"])
-            live.log_metric("rf_mae", metrics_rf["mae"])
-            live.log_metric("rf_r2", metrics_rf["r2"])
-            live.log_metric("gb_rmse", metrics_gb["rmse"])
-            live.log_metric("gb_mae", metrics_gb["mae"])
-            live.log_metric("gb_r2", metrics_gb["r2"])
+            #  Pipelines servibles: ColumnTransformer (piezas ya ajustadas) + estimador
+            model_rf = compose_pipeline(
+                shared, rf_fitted, X_train.iloc[:2], scaler=scaler_rf, scaler_name="robust_scaler", extra=geo_blocks,
+            )
+            model_gb = compose_pipeline(
+                shared_b, gb_fitted, X_train.iloc[:2], scaler=scaler_gb, scaler_name="scaler",
+                step_names=("preprocessor", "model"), extra=geo_blocks,
+            )
             
-            #  Guardar modelos .joblib
-            os.makedirs(MODEL_DIR, exist_ok=True)
-            logger.info(f"Guardando RandomForest en: {MODEL_RF_PATH}")
-            joblib.dump(model_rf, MODEL_RF_PATH)
-            logger.info(f"Guardando GradientBoosting en: {MODEL_GB_PATH}")
-            joblib.dump(model_gb, MODEL_GB_PATH)
-
-            #  Guardar Manifiesto
-            manifest = {
-                "models": [
-                    {"name": "RandomForest", "path": MODEL_RF_PATH, "metrics": metrics_rf},
-                    {"name": "GradientBoosting", "path": MODEL_GB_PATH, "metrics": metrics_gb},
-                ]
-            }
-            with open(MANIFEST_PATH, "w") as f:
-                json.dump(manifest, f, indent=2)
+            #  Evaluación (sobre el test ya preprocesado, sin volver a transformarlo por modelo)
+            with job.stage("evaluate"):
+                logger.info("Evaluando modelos...")
+                metrics_rf = evaluate(rf_fitted, Xt_test_rf, y_test, name="RandomForest")
+                metrics_gb = evaluate(gb_fitted, Xt_test_gb, y_test, name=name_b)
+
+                # Loggear métricas
+                live.log_metric("rf_rmse", metrics_rf["rmse"])
+                live.log_metric("rf_mae", metrics_rf["mae"])
+                live.log_metric("rf_r2", metrics_rf["r2"])
+                live.log_metric("gb_rmse", metrics_gb["rmse"])
+                live.log_metric("gb_mae", metrics_gb["mae"])
+                live.log_metric("gb_r2", metrics_gb["r2"])
             
-            #  Guardar métricas en DuckDB
-            save_metrics_to_duckdb(params, metrics_rf, metrics_gb)
-        
-        #  Recargar el modelo en la API 
-        logger.info("Entrenamiento finalizado. Recargando el modelo en la API...")
+            #  Índice de comparables (/v1/comparables): avisos originales, se carga junto al modelo
+            comparables = None
+            if COMPARABLES_ENABLED:
+                with job.stage("comparables"):
+                    try:
+                        with connection(DB_PATH) as con:
+                            comparables = build_comparables(con, training_source(con))
+                    except Exception as e:
+                        logger.error(f"No se pudo armar el índice de comparables: {e}")
+
+            with job.stage("save"):
+                #  Guardar modelos .joblib
+                os.makedirs(MODEL_DIR, exist_ok=True)
+                logger.info(f"Guardando RandomForest en: {MODEL_RF_PATH}")
+                joblib.dump(model_rf, MODEL_RF_PATH)
+                path_b = MODEL_HGB_PATH if model_b == "hgb" else MODEL_GB_PATH
+                logger.info(f"Guardando {name_b} en: {path_b}")
+                joblib.dump(model_gb, path_b)
+                if spatial is not None:
+                    joblib.dump(spatial, MODEL_SPATIAL_PATH)
+                if comparables is not None:
+                    joblib.dump(comparables, COMPARABLES_INDEX_PATH)
+
+                #  Promover el modelo que sirve la API (+ formato plano, mmap compartido entre workers)
+                paths = {"RandomForest": MODEL_RF_PATH, name_b: path_b}
+                models = {"RandomForest": model_rf, name_b: model_gb}
+                promotion_id = promote_model(paths[promoted])
+                flat_dir = None
+                try:
+                    export_flat_model(models[promoted], X_test)
+                    flat_dir = MODEL_BEST_FLAT_DIR
+                except Exception as e:
+                    logger.error(f"No se pudo exportar el formato plano: {e}")
+                    # el formato plano anterior es de otro modelo: no se debe seguir sirviendo
+                    shutil.rmtree(MODEL_BEST_FLAT_DIR, ignore_errors=True)
+
+                #  Guardar Manifiesto
+                manifest = {
+                    "models": [
+                        {"name": "RandomForest", "path": MODEL_RF_PATH, "metrics": metrics_rf},
+                        {"name": name_b, "path": path_b, "metrics": metrics_gb},
+                    ],
+                    "promoted": {
+                        "name": promoted, "path": MODEL_BEST_PATH, "flat_path": flat_dir, "promotion_id": promotion_id,
+                        "search": search, "metrics": {"RandomForest": metrics_rf, name_b: metrics_gb}[promoted],
+                    },
+                    "spatial_index": MODEL_SPATIAL_PATH if spatial is not None else None,
+                    "comparables_index": COMPARABLES_INDEX_PATH if comparables is not None else None,
+                }
+                with open(MANIFEST_PATH, "w") as f:
+                    json.dump(manifest, f, indent=2)
+                
+                #  Guardar métricas en DuckDB
+                save_metrics_to_duckdb(params, metrics_rf, metrics_gb, trials=trials, name_b=name_b)
         
-        load_model(force_reload=True) 
-        logger.info("Modelo recargado en la caché ")
+        logger.info("Entrenamiento finalizado. La API recarga el modelo en segundo plano.")
         
         logger.info("--- Pipeline de Entrenamiento Finalizado ---")
-        return {"status": "ok", "message": "Entrenamiento completo y modelo recargado.", "metrics_rf": metrics_rf, "metrics_gb": metrics_gb}
+        return {
+            "status": "ok", "message": "Entrenamiento completo.", "metrics_rf": metrics_rf, "metrics_gb": metrics_gb,
+            "promoted_model": promoted, "search": search, "model_b": name_b, "trials": len(trials or []),
+        }
 
+    except JobCancelled as e:
+        logger.warning(f"Entrenamiento cancelado: {e}")
+        return {"status": "cancelled", "message": str(e)}
     except Exception as e:
         logger.error(f"ERROR en el pipeline de entrenamiento: {e}", exc_info=True)
         return {"status": "error", "message": str(e)}
@@ -0,0 +1,50 @@
+import time
+from typing import Annotated
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from app.models.schemas import Sample, ComparablesOut
+from app.utils.config import COMPARABLES_K, COMPARABLES_MAX_K
+from app.utils.model_loader import get_active_version
+from app.utils.log_config import logger
+
+router = APIRouter(prefix="/v1/comparables", tags=["Comparables"])
+
+def _comparables(sample: Sample, k: int) -> ComparablesOut:
+    """Busca en el índice de comparables de la versión activa (en memoria, sin DuckDB)."""
+    start_time = time.time()
+    try:
+        version = get_active_version()
+    except Exception:
+        version = None
+    if version is None or version.comparables is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Índice de comparables no cargado. Ejecute el entrenamiento o revise los logs."
+        )
+
+    try:
+        comparables, reference = version.comparables.query(sample, k)
+    except LookupError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    # la latencia por ruta la mide el middleware de /metrics
+    latency = (time.time() - start_time) * 1000
+    logger.info(f"Comparables: {len(comparables)} avisos ({reference['located_by']}), {latency:.1f} ms")
+    return ComparablesOut(comparables=comparables, k=len(comparables), reference=reference, latency_ms=round(latency, 3))
+
+@router.get("/", response_model=ComparablesOut, operation_id="comparables_get")
+def comparables_get(
+    sample: Annotated[Sample, Depends()],
+    k: Annotated[int, Query(ge=1, le=COMPARABLES_MAX_K)] = COMPARABLES_K,
+):
+    """
+    Los k avisos del dataset de entrenamiento más parecidos a la propiedad (misma operación, tipo y moneda;
+    cerca en ubicación, superficie y ambientes). La propiedad va como query params (?surface_total=...&lat=...).
+    """
+    return _comparables(sample, k)
+
+@router.post("/", response_model=ComparablesOut, operation_id="comparables_post")
+def comparables_post(sample: Sample, k: Annotated[int, Query(ge=1, le=COMPARABLES_MAX_K)] = COMPARABLES_K):
+    """Igual que GET, con la propiedad en el body (el mismo Sample de /v1/predict)."""
+    return _comparables(sample, k)
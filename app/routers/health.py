@@ -1,7 +1,10 @@
 from fastapi import APIRouter
-from app.utils.config import MODEL_PATH
-from app.utils.latency import average_latency
-from app.utils.model_loader import get_model
+from app.utils.config import MODEL_PATH, MODEL_FORMAT, MICRO_BATCH_ENABLED
+from app.utils.metrics import route_summary
+from app.utils.model_loader import get_active_version, reload_status
+from app.utils.micro_batcher import get_batcher
+from app.utils.prediction_cache import PREDICTION_CACHE
+from app.utils.task_pool import running_tasks
 from app.utils.log_config import logger
 
 router = APIRouter(prefix="/v1/health", tags=["Estado"])
@@ -11,16 +14,27 @@ def health_check():
     """
     Verifica el estado de la API y si el modelo está cargado en memoria.
     """
-    model = None
+    version = None
     try:
-        model = get_model()
+        version = get_active_version()
     except Exception as e:
         
         logger.warning(f"Health check: No se pudo obtener el modelo: {e}")
         
     return {
         "status": "ok",
-        "model_loaded": model is not None,
+        "model_loaded": version is not None,
+        # versión activa del registro (cambia con cada recarga)
+        "model_version": version.info() if version is not None else None,
+        "model_reload": reload_status(),
         "model_path": MODEL_PATH,
-        "avg_latency_ms": average_latency(),
+        "model_format": MODEL_FORMAT,
+        # estimador final que atiende las predicciones (sklearn o motor nativo)
+        "estimator": type(version.model.steps[-1][1]).__name__ if version is not None else None,
+        # resumen de POST /v1/predict/ desde el histograma de /metrics (promedio y percentiles estimados)
+        "latency_ms": route_summary("POST", "/v1/predict/"),
+        "micro_batch": get_batcher().stats() if MICRO_BATCH_ENABLED else {"enabled": False},
+        "prediction_cache": PREDICTION_CACHE.stats() if PREDICTION_CACHE is not None else {"enabled": False},
+        # ingesta / entrenamiento corriendo en el pool de procesos
+        "running_tasks": running_tasks(),
     }
\ No newline at end of file
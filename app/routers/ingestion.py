@@ -1,24 +1,31 @@
-from fastapi import APIRouter, BackgroundTasks, status, HTTPException
+from fastapi import APIRouter, status, HTTPException
 from app.processing.ingestor import run_ingestion_pipeline
+from app.utils.task_pool import TaskAlreadyRunning
+from app.utils.jobs import start_job
 from app.utils.log_config import logger
 
 router = APIRouter(prefix="/v1/ingest", tags=["Ingesta de Datos"])
 
 @router.post("/", status_code=status.HTTP_202_ACCEPTED, operation_id="trigger_ingestion_post")
-def trigger_ingestion(background_tasks: BackgroundTasks):
+def trigger_ingestion():
     """
     Inicia el proceso de ingesta de datos 
-    Este proceso se ejecuta en segundo plano.
+    Este proceso se ejecuta en un proceso aparte. Devuelve 409 si ya hay una ingesta o entrenamiento en curso.
     """
     try:
-        logger.info("Endpoint /v1/ingest llamado. Añadiendo tarea en segundo plano.")
-        # Añade la función de ingesta como una tarea en segundo plano
-        background_tasks.add_task(run_ingestion_pipeline)
+        logger.info("Endpoint /v1/ingest llamado. Enviando tarea al pool de procesos.")
+        # la ingesta corre en el pool de procesos
+        job_id = start_job("ingest", run_ingestion_pipeline)
         
         return {
             "status": "ok", 
-            "message": "Proceso de ingesta iniciado en segundo plano. Revise los logs para ver el estado."
+            "job_id": job_id,
+            "job_url": f"/v1/jobs/{job_id}",
+            "message": "Proceso de ingesta iniciado en segundo plano. Seguir el estado en job_url."
         }
+    except TaskAlreadyRunning as e:
+        logger.warning(str(e))
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
     except Exception as e:
         logger.error(f"Error al iniciar la tarea de ingesta: {e}")
         raise HTTPException(
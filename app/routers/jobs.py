@@ -0,0 +1,38 @@
+from fastapi import APIRouter, HTTPException, Query, status
+from app.utils.jobs import get_job_async, list_jobs_async, cancel_job
+from app.utils.log_config import logger
+
+router = APIRouter(prefix="/v1/jobs", tags=["Jobs"])
+
+@router.get("/", operation_id="list_jobs_get")
+async def jobs_list(limit: int = Query(20, ge=1, le=500)):
+    """
+    Lista los jobs de ingesta / entrenamiento: primero los que están en curso y después el historial.
+    """
+    return {"jobs": await list_jobs_async(limit=limit)}
+
+@router.get("/{job_id}", operation_id="get_job_get")
+async def job_detail(job_id: str):
+    """
+    Estado de un job: status (queued, running, succeeded, failed, cancelled), etapa actual,
+    y por cada etapa terminada el tiempo de pared (wall_s) y el pico de RSS de la etapa (peak_rss_mb;
+    y python_peak_mb, el pico de memoria Python, con JOBS_TRACE_MEMORY).
+    """
+    job = await get_job_async(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No existe el job {job_id}.")
+    return job
+
+@router.post("/{job_id}/cancel", status_code=status.HTTP_202_ACCEPTED, operation_id="cancel_job_post")
+def job_cancel(job_id: str):
+    """
+    Pide la cancelación del job. Es cooperativa: un job en cola se cancela de inmediato y uno
+    en ejecución se detiene al empezar la próxima etapa (o en la próxima iteración del GradientBoosting).
+    """
+    result = cancel_job(job_id)
+    if result is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No existe el job {job_id}.")
+    if result in ("succeeded", "failed"):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"El job {job_id} ya terminó ({result}).")
+    logger.info(f"Cancelación pedida para el job {job_id}: {result}")
+    return {"job_id": job_id, "status": result}
@@ -0,0 +1,12 @@
+from fastapi import APIRouter, Response
+from app.utils.metrics import REGISTRY, CONTENT_TYPE
+
+router = APIRouter(tags=["Estado"])
+
+@router.get("/metrics", operation_id="metrics_get")
+def metrics():
+    """
+    Métricas en formato de texto de Prometheus: latencia por ruta y por etapa de /v1/predict,
+    errores (incluye 422), predicciones fuera de rango y versión / tiempo de carga del modelo.
+    """
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE)
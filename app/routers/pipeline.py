@@ -1,62 +1,79 @@
-from fastapi import APIRouter, BackgroundTasks, status, HTTPException
+from fastapi import APIRouter, status, HTTPException
 from app.processing.ingestor import run_ingestion_pipeline
 from app.processing.trainer import run_training_pipeline
+from app.processing.out_of_core import run_out_of_core_training
+from app.processing.segments import run_segment_training
+from app.utils.model_loader import reload_after_training
+from app.utils.task_pool import TaskAlreadyRunning
+from app.utils.jobs import JobContext, start_job
+from app.utils.config import TRAIN_MODE
 from app.utils.log_config import logger
 
 
 router = APIRouter(prefix="/v1/pipeline", tags=["Pipeline Completo"])
 
-async def run_full_pipeline_task():
+def run_full_pipeline_task(job: JobContext | None = None):
     """
-    Tarea de orquestación que se ejecuta en segundo plano.
-    (Versión simplificada sin monitor de estado)
+    Tarea de orquestación que se ejecuta en el pool de procesos.
+    Las etapas de ingesta y entrenamiento se reportan en el mismo job.
     """
+    job = job or JobContext.local("pipeline")
     try:
         logger.info("--- INICIO: Pipeline de Configuración  ---")
         
         #  PASO 1: INGESTA 
         logger.info("Pipeline (Paso 1/2): Iniciando ingesta de datos...")
-        ingest_result = await run_ingestion_pipeline()
+        ingest_result = run_ingestion_pipeline(job=job)
         
         # Comprobación de que ingest_result es un diccionario
         if isinstance(ingest_result, dict):
             logger.info(f"Pipeline (Paso 1/2): Ingesta completa. Mensaje: {ingest_result.get('message')}")
-            if ingest_result.get("status") == "error":
+            if ingest_result.get("status") in ("error", "cancelled"):
                  logger.error("Error en el paso de ingesta. Saliendo del entrenamiento.")
-                 return
+                 return ingest_result
         else:
              logger.warning(f"La ingesta no devolvió un diccionario. Resultado: {ingest_result}")
 
 
         #  PASO 2: ENTRENAMIENTO 
         logger.info("Pipeline (Paso 2/2): Iniciando entrenamiento del modelo...")
-        train_result = await run_training_pipeline()
+        # TRAIN_MODE=out_of_core: modelo nacional entrenado por bloques; segments: un modelo por segmento
+        trainer = {
+            "out_of_core": run_out_of_core_training, "segments": run_segment_training,
+        }.get(TRAIN_MODE, run_training_pipeline)
+        train_result = trainer(job=job)
         
         if isinstance(train_result, dict):
             logger.info(f"Pipeline (Paso 2/2): Entrenamiento completado. Mensaje: {train_result.get('message')}")
         
         logger.info("--- FIN: Pipeline de Configuración Completa ---")
+        return train_result
 
     except Exception as e:
         error_msg = f"Error fatal durante la ejecución del pipeline: {e}"
         logger.error(error_msg, exc_info=True)
+        return {"status": "error", "message": error_msg}
         
 
 @router.post("/ingest-train", status_code=status.HTTP_202_ACCEPTED, operation_id="run_full_pipeline_post")
-def trigger_full_pipeline(background_tasks: BackgroundTasks):
+def trigger_full_pipeline():
     """
-    Inicia el pipeline completo (Ingesta Y Entrenamiento) en segundo plano.
-        
+    Inicia el pipeline completo (Ingesta Y Entrenamiento) en un proceso aparte.
+    Devuelve 409 si ya hay una ingesta, entrenamiento o pipeline en curso.
     """
     try:
-        logger.info("Endpoint /v1/pipeline/ingest-train llamado. Añadiendo tarea en segundo plano.")
-        background_tasks.add_task(run_full_pipeline_task)
+        logger.info("Endpoint /v1/pipeline/ingest-train llamado. Enviando tarea al pool de procesos.")
+        job_id = start_job("pipeline", run_full_pipeline_task, on_done=reload_after_training)
         
         return {
             "status": "ok", 
-            
-            "message": "Proceso de ingesta y entrenamiento iniciado en segundo plano. Revise los logs para ver el estado."
+            "job_id": job_id,
+            "job_url": f"/v1/jobs/{job_id}",
+            "message": "Proceso de ingesta y entrenamiento iniciado en segundo plano. Seguir el estado en job_url."
         }
+    except TaskAlreadyRunning as e:
+        logger.warning(str(e))
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
     except Exception as e:
         logger.error(f"Error al iniciar la tarea del pipeline: {e}")
         raise HTTPException(
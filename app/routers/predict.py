@@ -1,65 +1,206 @@
 from fastapi import APIRouter, HTTPException, status
 import time
-import pandas as pd
 import numpy as np
-from app.models.schemas import Sample, PredictionOut
-from app.utils.model_loader import get_model, load_model
-from app.utils.latency import record_latency
+from app.models.schemas import Sample, PredictionOut, PredictionInterval, BatchItemOut, BatchPredictionOut
+from app.utils.config import BATCH_MAX_SIZE, MICRO_BATCH_ENABLED, INTERVAL_LOWER, INTERVAL_UPPER
+from app.utils.model_loader import get_active_version, reload_model_async, reload_status
+from app.utils.inference import predict_samples, predict_samples_interval, IntervalsUnavailable
+from app.utils.micro_batcher import get_batcher, BatcherTimeout
+from app.utils.prediction_cache import PREDICTION_CACHE, sample_key
+from app.utils.metrics import (
+    PREDICTION_FAILURES, PREDICTIONS_OUT_OF_RANGE, handler_span,
+)
 from app.utils.log_config import logger 
 
 router = APIRouter(prefix="/v1/predict", tags=["Predicciones"])
 #  modelo se cargará en la primera petición
 
-@router.post("/", response_model=PredictionOut, operation_id="predict_price_post")
-def predict(sample: Sample):
-    start_time = time.time()
-    
-    
-    model = get_model() 
-    
-    if model is None:
+def precio_fuera_de_rango(prediction) -> bool:
+    """Chequeo de rango de una predicción (no finita, negativa/cero o > 1e9)."""
+    return not np.isfinite(prediction) or prediction <= 0 or prediction > 1e9
+
+def _get_version_or_503():
+    """Versión del modelo que usa el request de principio a fin (aunque haya una recarga en el medio)."""
+    try:
+        version = get_active_version()
+    except Exception:
+        version = None
+
+    if version is None:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail="Modelo no cargado. Ejecute el entrenamiento o revise los logs."
         )
+    return version
+
+def _cached_predict(samples: list[Sample], version, predict_fn) -> np.ndarray:
+    """Resuelve desde el cache lo que se pueda y predice solo las filas faltantes con predict_fn."""
+    if PREDICTION_CACHE is None:
+        return predict_fn(samples)
+
+    generation = PREDICTION_CACHE.generation
+    # la versión va en la clave: una predicción de otro modelo nunca se sirve desde el cache
+    keys = [(version.version_id, sample_key(s)) for s in samples]
+    predictions = np.empty(len(samples), dtype=np.float64)
+    missing = []
+    for i, key in enumerate(keys):
+        value = PREDICTION_CACHE.get(key)
+        if value is None:
+            missing.append(i)
+        else:
+            predictions[i] = value
+
+    if missing:
+        computed = predict_fn([samples[i] for i in missing])
+        for i, value in zip(missing, computed):
+            predictions[i] = value
+            PREDICTION_CACHE.put(keys[i], value, generation)
+    return predictions
+
+def _intervals_unavailable(e: IntervalsUnavailable) -> HTTPException:
+    """interval=true con un modelo sin RandomForest: no es una falla del modelo, es un pedido que no puede atender."""
+    logger.warning(f"Intervalos no disponibles: {e}")
+    return HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail=f"{e} Reintentar sin interval=true o servir un modelo RandomForest.",
+    )
+
+def _interval_out(lower, upper) -> PredictionInterval:
+    return PredictionInterval(
+        lower=round(float(lower), 2), upper=round(float(upper), 2),
+        lower_quantile=INTERVAL_LOWER, upper_quantile=INTERVAL_UPPER,
+    )
+
+@router.post("/", response_model=PredictionOut, operation_id="predict_price_post")
+def predict(sample: Sample, interval: bool = False):
+    """
+    Predice el precio de una propiedad.
+    interval=true: agrega la banda INTERVAL_LOWER / INTERVAL_UPPER de los árboles del RandomForest
+    (mismo recorrido que la predicción; no pasa por el cache ni el micro-batcher).
+    409 si el modelo servido no tiene RandomForest para las bandas.
+    """
+    start_time = time.perf_counter()
+    with handler_span():
+        version = _get_version_or_503()
 
-    logger.info(f"Nueva predicción: {sample.model_dump()}")
-    input_df = pd.DataFrame([sample.model_dump()])
+        logger.info(f"Nueva predicción: {sample.model_dump()}")
     
-    try:
-        prediction = model.predict(input_df)[0]
-    except Exception as e:
-        logger.error(f"Error durante la predicción: {e}")
-        raise HTTPException(status_code=422, detail=f"Error al procesar la predicción: {e}")
+        band = None
+        try:
+            if interval:
+                predictions, lower, upper = predict_samples_interval([sample], version)
+                prediction, band = predictions[0], _interval_out(lower[0], upper[0])
+            elif MICRO_BATCH_ENABLED:
+                # se agrupa con otras predicciones concurrentes en un solo predict
+                prediction = _cached_predict([sample], version, lambda s: [get_batcher().submit(s[0], version)])[0]
+            else:
+                prediction = _cached_predict([sample], version, lambda s: predict_samples(s, version))[0]
+        except BatcherTimeout as e:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+        except IntervalsUnavailable as e:
+            raise _intervals_unavailable(e)
+        except Exception as e:
+            logger.error(f"Error durante la predicción: {e}")
+            PREDICTION_FAILURES.labels(router.prefix + "/").inc()
+            raise HTTPException(status_code=422, detail=f"Error al procesar la predicción: {e}")
 
-    latency = record_latency(start_time, time.time())
+        latency = (time.perf_counter() - start_time) * 1000
 
-    if not np.isfinite(prediction) or prediction <= 0 or prediction > 1e9:
-        logger.warning(f"Precio fuera de rango detectado: {prediction}")
-        raise HTTPException(
-            status_code=422, 
-            detail=f"El modelo generó un precio fuera de rango: {prediction}"
+        if precio_fuera_de_rango(prediction):
+            logger.warning(f"Precio fuera de rango detectado: {prediction}")
+            PREDICTIONS_OUT_OF_RANGE.labels(router.prefix + "/").inc()
+            raise HTTPException(
+                status_code=422, 
+                detail=f"El modelo generó un precio fuera de rango: {prediction}"
+            )
+
+        result = PredictionOut(
+            predicted_price=round(float(prediction), 2),
+            currency=sample.currency,
+            latency_ms=round(latency, 3),
+            interval=band,
         )
 
-    result = PredictionOut(
-        predicted_price=round(float(prediction), 2),
-        currency=sample.currency,
-        latency_ms=round(latency, 3),
-    )
+        logger.info(f"Predicción exitosa: {result.model_dump(mode='json')}")
+        return result
+
+@router.post("/batch", response_model=BatchPredictionOut, operation_id="predict_price_batch_post")
+def predict_batch(samples: list[Sample], interval: bool = False):
+    """
+    Predice el precio de muchas propiedades en una sola llamada al modelo.
+    Cada fila tiene su propio chequeo de rango: una fila fuera de rango devuelve
+    su error en `error` sin hacer fallar el resto del lote.
+    interval=true: cada fila agrega su banda (un solo recorrido del bosque para todo el lote);
+    409 si el modelo servido no tiene RandomForest para las bandas.
+    """
+    start_time = time.perf_counter()
+    with handler_span():
+        if not samples:
+            raise HTTPException(status_code=422, detail="El lote está vacío.")
+        if len(samples) > BATCH_MAX_SIZE:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"El lote tiene {len(samples)} filas. Máximo permitido: {BATCH_MAX_SIZE}."
+            )
+
+        version = _get_version_or_503()
 
-    logger.info(f"Predicción exitosa: {result.model_dump(mode='json')}")
-    return result
+        logger.info(f"Nueva predicción por lotes: {len(samples)} filas")
 
-@router.post("/reload-model", status_code=status.HTTP_200_OK, operation_id="reload_model_post")
+        try:
+            # un solo predict para todo el lote
+            if interval:
+                predictions, lower, upper = predict_samples_interval(samples, version)
+            else:
+                predictions = _cached_predict(samples, version, lambda s: predict_samples(s, version))
+        except IntervalsUnavailable as e:
+            raise _intervals_unavailable(e)
+        except Exception as e:
+            logger.error(f"Error durante la predicción por lotes: {e}")
+            PREDICTION_FAILURES.labels(router.prefix + "/batch").inc()
+            raise HTTPException(status_code=422, detail=f"Error al procesar la predicción: {e}")
+
+        results = []
+        for i, (sample, prediction) in enumerate(zip(samples, predictions)):
+            if precio_fuera_de_rango(prediction):
+                results.append(BatchItemOut(
+                    index=i,
+                    currency=sample.currency,
+                    error=f"El modelo generó un precio fuera de rango: {prediction}",
+                ))
+            else:
+                results.append(BatchItemOut(
+                    index=i,
+                    predicted_price=round(float(prediction), 2),
+                    currency=sample.currency,
+                    interval=_interval_out(lower[i], upper[i]) if interval else None,
+                ))
+
+        n_errors = sum(1 for r in results if r.error is not None)
+        if n_errors:
+            logger.warning(f"Predicción por lotes: {n_errors} filas con precio fuera de rango")
+            PREDICTIONS_OUT_OF_RANGE.labels(router.prefix + "/batch").inc(n_errors)
+
+        latency = (time.perf_counter() - start_time) * 1000
+        logger.info(f"Predicción por lotes exitosa: {len(results) - n_errors} ok, {n_errors} con error, {latency:.1f} ms")
+
+        return BatchPredictionOut(
+            results=results,
+            n_ok=len(results) - n_errors,
+            n_errors=n_errors,
+            latency_ms=round(latency, 3),
+        )
+
+@router.post("/reload-model", status_code=status.HTTP_202_ACCEPTED, operation_id="reload_model_post")
 def reload_model():
     """
-    Fuerza la recarga del modelo desde el disco (archivo .joblib) después de ejecutar un re-entrenamiento.
+    Recarga el modelo desde el disco (archivo .joblib) después de ejecutar un re-entrenamiento.
+    La carga y el warm-up corren en segundo plano; mientras tanto se sigue sirviendo la versión actual.
+    El resultado se ve en /v1/health/ (model_version y model_reload).
     """
-    try:
-        load_model(force_reload=True)
-        return {"status": "ok", "message": "Modelo recargado exitosamente."}
-    except Exception as e:
+    if not reload_model_async():
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=str(e)
-        )
\ No newline at end of file
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Ya hay una recarga del modelo en curso."
+        )
+    return {"status": "accepted", "message": "Recarga del modelo iniciada en segundo plano.", "reload": reload_status()}
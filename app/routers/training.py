@@ -1,24 +1,52 @@
-from fastapi import APIRouter, BackgroundTasks, status, HTTPException
+from functools import partial
+from typing import Literal
+from fastapi import APIRouter, status, HTTPException
 from app.processing.trainer import run_training_pipeline
+from app.processing.out_of_core import run_out_of_core_training
+from app.processing.segments import run_segment_training
+from app.utils.model_loader import reload_after_training
+from app.utils.task_pool import TaskAlreadyRunning
+from app.utils.jobs import start_job
+from app.utils.config import TRAIN_MODE
 from app.utils.log_config import logger
 
 router = APIRouter(prefix="/v1/train", tags=["Entrenamiento"])
  # Los docstring se muestra en localhost
 @router.post("/", status_code=status.HTTP_202_ACCEPTED, operation_id="trigger_training_post")
-def trigger_training(background_tasks: BackgroundTasks):
+def trigger_training(
+    search: Literal["off", "grid", "random", "halving"] | None = None,
+    model_b: Literal["gb", "hgb"] | None = None,
+    mode: Literal["memory", "out_of_core", "segments"] | None = None,
+):
     """
     Inicia el proceso de entrenamiento de modelos (Carga -> Limpieza -> FE -> Train -> Save).
-    Este proceso se ejecuta en segundo plano, ya que demora un poco. Seguir el proceso mirando la informacion de la terminal
+    Este proceso se ejecuta en un proceso aparte, ya que demora un poco. Seguir el proceso mirando la informacion de la terminal.
+    search: búsqueda de hiperparámetros (grid / random / halving); sin valor usa TRAIN_SEARCH. Se promueve el mejor modelo.
+    model_b: segundo modelo (gb = GradientBoosting, hgb = HistGradientBoosting); sin valor usa MODEL_B.
+    mode: memory (CABA / Venta en memoria), out_of_core (modelo nacional por bloques) o
+    segments (un modelo por segmento, SEGMENT_BY); sin valor usa TRAIN_MODE.
+    Al terminar, el modelo nuevo se recarga en segundo plano. Devuelve 409 si ya hay un entrenamiento en curso.
     """
     try:
-        logger.info("Endpoint /v1/train llamado. Añadiendo tarea en segundo plano.")
-        # entrenamiento como una tarea en segundo plano
-        background_tasks.add_task(run_training_pipeline)
+        logger.info("Endpoint /v1/train llamado. Enviando tarea al pool de procesos.")
+        # entrenamiento en el pool de procesos: no bloquea las predicciones
+        mode = mode or TRAIN_MODE
+        if mode == "out_of_core":
+            job_id = start_job("train_ooc", run_out_of_core_training, on_done=reload_after_training)
+        elif mode == "segments":
+            job_id = start_job("train_segments", run_segment_training, on_done=reload_after_training)
+        else:
+            job_id = start_job("train", partial(run_training_pipeline, search=search, model_b=model_b), on_done=reload_after_training)
         
         return {
             "status": "ok", 
-            "message": "Proceso de entrenamiento iniciado en segundo plano. Revise los logs para ver el estado."
+            "job_id": job_id,
+            "job_url": f"/v1/jobs/{job_id}",
+            "message": "Proceso de entrenamiento iniciado en segundo plano. Seguir el estado en job_url."
         }
+    except TaskAlreadyRunning as e:
+        logger.warning(str(e))
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
     except Exception as e:
         logger.error(f"Error al iniciar la tarea de entrenamiento: {e}")
         raise HTTPException(
@@ -0,0 +1,131 @@
+import numpy as np
+from scipy.spatial import cKDTree
+from app.utils.spatial import EARTH_RADIUS_KM, _unit_xyz, _arc_km
+
+'''
+COMPARABLES (propiedades parecidas del dataset de entrenamiento)
+Índice de vecinos más cercanos que se arma al final del entrenamiento y se carga junto al modelo:
+la API responde sin tocar DuckDB.
+- un KD-tree por grupo (operation_type, property_type, currency): un comparable nunca es de otra
+  operación, otro tipo de propiedad ni otra moneda
+- dentro del grupo la distancia combina ubicación (xyz en la esfera, 1 unidad = geo_km km),
+  superficie (log, 1 unidad = surface_log) y ambientes (1 unidad = rooms_step ambientes)
+- los valores que se devuelven son los del aviso original (sin el clip IQR del entrenamiento)
+Sin lat/lon se usa el centro (mediana) del barrio l3 del Sample; sin ambientes, la mediana del grupo.
+'''
+
+COMPARABLE_COLUMNS = [
+    "id", "price", "currency", "operation_type", "property_type", "l3", "lat", "lon",
+    "surface_total", "surface_covered", "rooms", "bedrooms", "bathrooms",
+]
+GROUP_COLUMNS = ["operation_type", "property_type", "currency"]
+_TEXT_COLUMNS = {"currency", "operation_type", "property_type", "l3"}
+
+
+class ComparablesIndex:
+    """
+    Índice de comparables. fit(df): df con COMPARABLE_COLUMNS (filas sin lat/lon, superficie o precio
+    válidos no entran). query(sample, k): los k avisos más parecidos del grupo del Sample.
+    """
+
+    def __init__(self, geo_km: float = 1.0, surface_log: float = 0.25, rooms_step: float = 1.0):
+        self.geo_km = geo_km
+        self.surface_log = surface_log
+        self.rooms_step = rooms_step
+
+    def fit(self, df):
+        lat, lon = df["lat"].to_numpy(np.float64), df["lon"].to_numpy(np.float64)
+        surface, price = df["surface_total"].to_numpy(np.float64), df["price"].to_numpy(np.float64)
+        keep = (
+            np.isfinite(lat) & np.isfinite(lon) & (surface > 0) & (price > 0)
+            & df[GROUP_COLUMNS].notna().all(axis=1).to_numpy()
+        )
+        df = df[keep].reset_index(drop=True)
+        if df.empty:
+            raise ValueError("No hay avisos con ubicación, superficie y precio para el índice de comparables.")
+        self.n_indexed_ = len(df)
+        self.columns_ = {
+            c: df[c].to_numpy(object if c in _TEXT_COLUMNS else np.float64) for c in COMPARABLE_COLUMNS
+        }
+        # id entero (float64 pierde precisión en ids grandes); -1 = sin id
+        self.columns_["id"] = df["id"].fillna(-1).to_numpy(np.int64)
+
+        self.groups_ = {}
+        for key, rows in df.groupby(GROUP_COLUMNS, sort=False).indices.items():
+            rows = np.asarray(rows, dtype=np.int64)
+            rooms = self.columns_["rooms"][rows]
+            rooms_fill = float(np.nanmedian(rooms)) if np.isfinite(rooms).any() else 0.0
+            vectors = self._vectors(
+                self.columns_["lat"][rows], self.columns_["lon"][rows],
+                self.columns_["surface_total"][rows], np.where(np.isfinite(rooms), rooms, rooms_fill),
+            )
+            self.groups_[tuple(key)] = (rows, cKDTree(vectors), rooms_fill)
+
+        # centro de cada barrio, para los Sample sin coordenadas
+        centers = df.dropna(subset=["l3"]).groupby("l3")[["lat", "lon"]].median()
+        self.l3_centers_ = {l3: (float(r.lat), float(r.lon)) for l3, r in centers.iterrows()}
+        return self
+
+    def _vectors(self, lat, lon, surface, rooms) -> np.ndarray:
+        out = np.empty((lat.shape[0], 5))
+        out[:, :3] = _unit_xyz(lat, lon) * (EARTH_RADIUS_KM / self.geo_km)
+        out[:, 3] = np.log(surface) / self.surface_log
+        out[:, 4] = rooms / self.rooms_step
+        return out
+
+    def locate(self, sample):
+        """(lat, lon, origen) del Sample: sus coordenadas o el centro de su barrio. ValueError si no hay ninguno."""
+        if sample.lat is not None and sample.lon is not None:
+            return sample.lat, sample.lon, "coordinates"
+        center = self.l3_centers_.get(sample.l3)
+        if center is None:
+            raise ValueError("Se necesitan lat/lon o un barrio (l3) conocido para buscar comparables.")
+        return center[0], center[1], "l3"
+
+    def query(self, sample, k: int) -> tuple[list[dict], dict]:
+        """
+        Los k comparables más parecidos, del más al menos parecido, y la referencia usada.
+        LookupError si no hay avisos del grupo del Sample; ValueError si no se lo puede ubicar.
+        """
+        key = tuple(getattr(sample, c) for c in GROUP_COLUMNS)
+        group = self.groups_.get(key)
+        if group is None:
+            raise LookupError(f"No hay avisos de {' / '.join(map(str, key))} en el índice de comparables.")
+        if not sample.surface_total or sample.surface_total <= 0:
+            raise ValueError("surface_total debe ser mayor a 0 para buscar comparables.")
+        rows, tree, rooms_fill = group
+        lat, lon, located_by = self.locate(sample)
+        rooms = rooms_fill if sample.rooms is None else sample.rooms
+
+        point = self._vectors(np.array([lat]), np.array([lon]), np.array([sample.surface_total]), np.array([rooms]))
+        k = min(k, rows.shape[0])
+        score, ind = tree.query(point[0], k=k)
+        rows = rows[np.atleast_1d(ind)]
+        # distancia en km: cuerda de la esfera unitaria entre la referencia y cada comparable
+        xyz = tree.data[np.atleast_1d(ind), :3] - point[0, :3]
+        distance_km = _arc_km(np.sqrt((xyz ** 2).sum(axis=1)) * self.geo_km / EARTH_RADIUS_KM)
+
+        cols = self.columns_
+        comparables = []
+        for row, s, d in zip(rows, np.atleast_1d(score), distance_km):
+            item = {c: _clean(cols[c][row]) for c in COMPARABLE_COLUMNS if c != "id"}
+            item["id"] = int(cols["id"][row]) if cols["id"][row] >= 0 else None
+            item["price_per_m2"] = round(item["price"] / item["surface_total"], 2)
+            item["distance_km"] = round(float(d), 3)
+            item["score"] = round(float(s), 4)
+            comparables.append(item)
+        reference = {"lat": lat, "lon": lon, "located_by": located_by, "rooms": rooms}
+        return comparables, reference
+
+    def stats(self) -> dict:
+        return {"indexed": self.n_indexed_, "groups": len(self.groups_)}
+
+
+def _clean(value):
+    """NaN / None -> None, números NumPy -> float (serializable a JSON)."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return value
+    value = float(value)
+    return None if np.isnan(value) else value
@@ -1,17 +1,274 @@
-from collections import deque
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
 
 
 '''
 ELECCION DE MODELO: load_model en model_loader.py -> model en predict.py
 '''
 
-MODEL_PATH = "app/data/artifacts/housing_models/random_forest.joblib"
+# modelo promovido por trainer.py (el RandomForest, o el mejor de la búsqueda de hiperparámetros)
+MODEL_PATH = os.getenv("MODEL_PATH", "app/data/artifacts/housing_models/best_model.joblib")
+# artefactos de antes de la promoción: se usan si todavía no hay modelo promovido
+MODEL_LEGACY_PATH = "app/data/artifacts/housing_models/random_forest.joblib"
+# manifiesto del último entrenamiento: modelos, métricas y la promoción vigente (promotion_id)
+MANIFEST_PATH = "app/data/artifacts/housing_models/manifest.json"
+
+# Formato del modelo servido: "joblib" (pickle de sklearn) o "flat" (arrays planos con mmap,
+# compartidos entre workers; lo exporta trainer.py junto al .joblib)
+MODEL_FORMAT = os.getenv("MODEL_FORMAT", "joblib").lower()
+MODEL_FLAT_DIR = "app/data/artifacts/housing_models/best_model_flat"
+MODEL_LEGACY_FLAT_DIR = "app/data/artifacts/housing_models/random_forest_flat"
+
+# Motor de inferencia para el .joblib: "sklearn" (predict de sklearn), "native" (árboles
+# aplanados en arrays NumPy, app/utils/flat_forest.py) o "auto" (nativo en los lotes chicos,
+# sklearn en los grandes). El nativo baja la latencia de lotes chicos pero en lotes grandes el loop
+# en C de sklearn rinde más: "auto" mide al cargar hasta qué tamaño gana el nativo (máximo
+# NATIVE_MAX_ROWS filas). El formato "flat" siempre usa el nativo.
+INFERENCE_ENGINE = os.getenv("INFERENCE_ENGINE", "sklearn").lower()
+NATIVE_MAX_ROWS = int(os.getenv("NATIVE_MAX_ROWS", "128"))
 
-''''
-registra la latencia de cada solicitud y lo añade a la cola, solo almacena
-los últimos 50 valores. Si se agrega un valor nuevo, el  más viejo
-se descarta automáticamente.
+# Filas de prueba (medianas y categorías del modelo) con las que se precalienta cada versión nueva antes de activarla (0 = sin warm-up)
+MODEL_WARMUP_ROWS = int(os.getenv("MODEL_WARMUP_ROWS", "32"))
+
+'''
+MÉTRICAS: /metrics en formato de texto de Prometheus (app/utils/metrics.py). Histogramas de latencia
+por ruta y por etapa de /v1/predict, contadores de errores y gauges del modelo activo.
+METRICS_BUCKETS: límites de los histogramas, en segundos. METRICS_ENABLED=false no mide ni expone /metrics.
 '''
 #======================================================================
 
-LATENCY_WINDOW = deque(maxlen=50)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_BUCKETS = tuple(sorted(float(b) for b in os.getenv(
+    "METRICS_BUCKETS", "0.0005,0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10"
+).split(",")))
+
+'''
+PREDICCION POR LOTES: cantidad máxima de filas aceptadas por /v1/predict/batch
+'''
+BATCH_MAX_SIZE = 50_000
+
+'''
+MICRO-BATCHING (opcional): agrupa predicciones individuales concurrentes en un solo predict.
+Se activa con MICRO_BATCH_ENABLED=true. La ventana se cierra al llegar a
+MICRO_BATCH_MAX_SIZE filas o al pasar MICRO_BATCH_MAX_WAIT_MS desde la primera.
+MICRO_BATCH_TIMEOUT_S: espera máxima de un request por su fila (si el hilo del batcher se cuelga -> 503).
+'''
+MICRO_BATCH_ENABLED = os.getenv("MICRO_BATCH_ENABLED", "false").lower() == "true"
+MICRO_BATCH_MAX_WAIT_MS = float(os.getenv("MICRO_BATCH_MAX_WAIT_MS", "5"))
+MICRO_BATCH_MAX_SIZE = int(os.getenv("MICRO_BATCH_MAX_SIZE", "64"))
+MICRO_BATCH_TIMEOUT_S = float(os.getenv("MICRO_BATCH_TIMEOUT_S", "10"))
+
+'''
+CAMINO RAPIDO DE INFERENCIA: al cargar el modelo se compila un codificador NumPy
+(app/utils/encoding.py) que evita armar un DataFrame por request. Se valida bit a bit
+contra el Pipeline al cargar; FAST_ENCODER_ENABLED=false fuerza el camino pandas.
+'''
+FAST_ENCODER_ENABLED = os.getenv("FAST_ENCODER_ENABLED", "true").lower() == "true"
+
+'''
+CACHE DE PREDICCIONES: LRU con PREDICTION_CACHE_MAX_ENTRIES entradas (0 lo desactiva)
+y TTL opcional en segundos (PREDICTION_CACHE_TTL_S, 0 = sin vencimiento).
+Se invalida solo cuando se carga un modelo nuevo.
+'''
+PREDICTION_CACHE_MAX_ENTRIES = int(os.getenv("PREDICTION_CACHE_MAX_ENTRIES", "10000"))
+PREDICTION_CACHE_TTL_S = float(os.getenv("PREDICTION_CACHE_TTL_S", "0")) or None
+
+'''
+POOL DE TAREAS: ingesta, entrenamiento y pipeline completo corren en procesos aparte
+(app/utils/task_pool.py). TASK_POOL_MAX_WORKERS = tareas simultáneas;
+TASK_POOL_NICE = prioridad extra (nice) de los procesos hijos para no frenar las predicciones.
+'''
+TASK_POOL_MAX_WORKERS = int(os.getenv("TASK_POOL_MAX_WORKERS", "1"))
+TASK_POOL_NICE = int(os.getenv("TASK_POOL_NICE", "10"))
+
+'''
+JOBS: cada ingesta / entrenamiento es un job consultable en /v1/jobs/{id}.
+El historial se guarda en la DB de experimentos (METRICS_DB_PATH, tabla jobs), junto a las métricas de trainer.py.
+JOBS_TRACE_MEMORY=true suma el pico de memoria Python de cada etapa (tracemalloc). Apagado por defecto:
+tracemalloc registra cada asignación y las etapas en Python puro se vuelven 1.5x a 5x más lentas
+(en un entrenamiento de 200k filas: carga 0.12 -> 0.45 s, comparables 0.13 -> 0.7 s, +35 MB de RSS);
+los fits en C casi no cambian.
+El pico de RSS de cada etapa (peak_rss_mb) se registra siempre: al entrar se reinicia el pico del proceso
+(VmHWM, /proc/self/clear_refs) y al salir se lee. No se usa ru_maxrss: es el pico de toda la vida del
+proceso del pool, que se reutiliza entre jobs. Sin /proc (fuera de Linux) peak_rss_mb queda en None.
+'''
+METRICS_DB_PATH = "app/data/DB/experimento.duckdb"
+JOBS_TRACE_MEMORY = os.getenv("JOBS_TRACE_MEMORY", "false").lower() == "true"
+JOBS_HISTORY_SIZE = int(os.getenv("JOBS_HISTORY_SIZE", "100"))
+
+'''
+INGESTA: INGEST_MODE = "incremental" compara cada versión nueva del CSV contra datos_raw
+(id + hash del contenido de la fila) y solo inserta / actualiza / borra lo que cambió.
+"full" vuelve a armar datos_raw desde cero. Sin tabla previa, incremental hace una carga full.
+'''
+INGEST_MODE = os.getenv("INGEST_MODE", "incremental").lower()
+
+'''
+LAGO PARQUET: la ingesta exporta datos_raw como dataset Parquet particionado estilo Hive
+(LAKE_PARTITION_BY) con row groups de LAKE_ROW_GROUP_SIZE filas.
+El entrenamiento lo lee con read_parquet(hive_partitioning=true): el filtro por
+TRAINING_L2 / TRAINING_OPERATION solo abre las particiones que corresponden.
+'''
+LAKE_DIR = os.getenv("LAKE_DIR", "app/data/artifacts/parquet/lake")
+LAKE_PARTITION_BY = ["l2", "operation_type", "property_type"]
+LAKE_ROW_GROUP_SIZE = int(os.getenv("LAKE_ROW_GROUP_SIZE", "100000"))
+TRAINING_L2 = os.getenv("TRAINING_L2", "Capital Federal")
+TRAINING_OPERATION = os.getenv("TRAINING_OPERATION", "Venta")
+
+'''
+INGESTA EN STREAMING: el CSV se lee con el esquema explícito de Properati (sin inferencia de tipos)
+y DuckDB corre con memoria e hilos acotados; lo que no entra en INGEST_MEMORY_LIMIT va a disco.
+'''
+INGEST_MEMORY_LIMIT = os.getenv("INGEST_MEMORY_LIMIT", "1GB")
+INGEST_THREADS = int(os.getenv("INGEST_THREADS", "2"))
+
+'''
+DESCARGA DE KAGGLE (app/processing/downloader.py): KAGGLE_API_BASE_URL se puede apuntar a un
+servidor local que imite la API para probar sin red. La descarga se hace por bloques de
+DOWNLOAD_CHUNK_BYTES y se reanuda hasta DOWNLOAD_MAX_RETRIES veces si se corta.
+'''
+KAGGLE_API_BASE_URL = os.getenv("KAGGLE_API_BASE_URL", "https://www.kaggle.com/api/v1")
+DOWNLOAD_CHUNK_BYTES = int(os.getenv("DOWNLOAD_CHUNK_BYTES", str(1024 * 1024)))
+DOWNLOAD_MAX_RETRIES = int(os.getenv("DOWNLOAD_MAX_RETRIES", "3"))
+
+'''
+BÚSQUEDA DE HIPERPARÁMETROS (app/processing/search.py): TRAIN_SEARCH = off | grid | random | halving
+(también ?search= en POST /v1/train/). Los candidatos corren en paralelo en SEARCH_N_JOBS procesos
+(-1 = todos los núcleos) y se validan en un holdout de SEARCH_VALIDATION_SIZE del train.
+SEARCH_N_ITER = candidatos por modelo en random / halving. Se promueve el mejor en validación.
+'''
+TRAIN_SEARCH = os.getenv("TRAIN_SEARCH", "off").lower()
+SEARCH_N_ITER = int(os.getenv("SEARCH_N_ITER", "8"))
+SEARCH_N_JOBS = int(os.getenv("SEARCH_N_JOBS", "-1"))
+SEARCH_VALIDATION_SIZE = float(os.getenv("SEARCH_VALIDATION_SIZE", "0.2"))
+
+'''
+PREPROCESAMIENTO COMPARTIDO (app/processing/preprocessing.py): imputación + one-hot se ajustan una vez
+para todos los modelos y se guardan en PREPROC_CACHE_DIR con clave = huella de los datos + features.
+Se conservan las últimas PREPROC_CACHE_KEEP entradas. PREPROC_CACHE_ENABLED=false siempre recalcula.
+'''
+PREPROC_CACHE_ENABLED = os.getenv("PREPROC_CACHE_ENABLED", "true").lower() == "true"
+PREPROC_CACHE_DIR = os.getenv("PREPROC_CACHE_DIR", "app/data/artifacts/preproc_cache")
+PREPROC_CACHE_KEEP = int(os.getenv("PREPROC_CACHE_KEEP", "2"))
+
+'''
+MODELO B DEL ENTRENAMIENTO: MODEL_B = gb | hgb
+- gb: GradientBoostingRegressor sobre el one-hot denso (splits exactos, un solo hilo)
+- hgb: HistGradientBoostingRegressor con histogramas, multihilo, soporte categórico nativo
+  (l3, property_type, ... como códigos, sin one-hot) y early stopping. No tiene formato plano:
+  si se promueve se sirve desde el .joblib.
+'''
+MODEL_B = os.getenv("MODEL_B", "gb").lower()
+
+'''
+FORMATO DE LAS FEATURES DE ENTRENAMIENTO (app/processing/preprocessing.py): FEATURE_LAYOUT = dense | compact
+- dense: one-hot denso float64 (como antes)
+- compact: one-hot CSR float32, matrices de RF / GB en float32 y códigos de HistGradientBoosting en int16.
+  Los árboles entrenan en float32 igual: mismos modelos con menos memoria.
+  Los códigos int16 solo achican la caché y las partes compartidas: la matriz de HistGradientBoosting
+  se arma en float64 igual que en dense (el estimador la convierte a float64 de todos modos).
+  Medición: python -m benchmarks.feature_layout_memory.
+  GradientBoosting recibe CSR si la densidad de la matriz es <= SPARSE_MAX_DENSITY (muchas categorías);
+  el RandomForest siempre denso (con CSR usa un splitter mucho más lento).
+'''
+FEATURE_LAYOUT = os.getenv("FEATURE_LAYOUT", "compact").lower()
+SPARSE_MAX_DENSITY = float(os.getenv("SPARSE_MAX_DENSITY", "0.3"))
+
+'''
+ENTRENAMIENTO OUT-OF-CORE (app/processing/out_of_core.py): TRAIN_MODE = memory | out_of_core | segments
+(también ?mode= en POST /v1/train/). Modelo nacional: OOC_L2 / OOC_OPERATIONS separadas por coma
+(vacío = todas). Nada se materializa entero en pandas:
+- las estadísticas del preprocesamiento (medianas, categorías, scaler) salen de SQL y de lotes
+  de OOC_BATCH_ROWS filas leídos en streaming
+- el RandomForest se arma por bagging: un bosque por bloque de ~OOC_CHUNK_ROWS filas y los
+  árboles se juntan en un solo modelo (OOC_N_ESTIMATORS en total, al menos uno por bloque)
+- OOC_MAX_LEAF_NODES acota el tamaño de cada árbol; DuckDB corre con OOC_MEMORY_LIMIT / OOC_THREADS
+  y lo que no entra va a disco
+La memoria pico depende del bloque y del tamaño del bosque, no del tamaño del dataset.
+'''
+TRAIN_MODE = os.getenv("TRAIN_MODE", "memory").lower()
+OOC_L2 = [v.strip() for v in os.getenv("OOC_L2", "").split(",") if v.strip()]
+OOC_OPERATIONS = [v.strip() for v in os.getenv("OOC_OPERATIONS", "Venta,Alquiler").split(",") if v.strip()]
+OOC_CHUNK_ROWS = int(os.getenv("OOC_CHUNK_ROWS", "250000"))
+OOC_BATCH_ROWS = int(os.getenv("OOC_BATCH_ROWS", "65536"))
+OOC_N_ESTIMATORS = int(os.getenv("OOC_N_ESTIMATORS", "100"))
+OOC_MAX_LEAF_NODES = int(os.getenv("OOC_MAX_LEAF_NODES", "20000"))
+OOC_MEMORY_LIMIT = os.getenv("OOC_MEMORY_LIMIT", "1GB")
+OOC_THREADS = int(os.getenv("OOC_THREADS", "2"))
+
+'''
+MODELOS POR SEGMENTO (app/processing/segments.py, TRAIN_MODE=segments o ?mode=segments en /v1/train/):
+un modelo por combinación de SEGMENT_BY (ej: operation_type x property_type) sobre el dataset
+nacional (OOC_L2 / OOC_OPERATIONS), entrenado out-of-core con SEGMENT_N_ESTIMATORS árboles.
+Los segmentos con menos de SEGMENT_MIN_ROWS filas de train no tienen modelo propio.
+En la API cada Sample va al modelo de su segmento (o al modelo promovido si no hay);
+los modelos se cargan al primer uso y quedan en un LRU de SEGMENT_CACHE_SIZE modelos por versión.
+El índice guarda el promotion_id del modelo promovido al entrenar los segmentos: si después se
+promueve otro modelo (POST /v1/train/ normal u out-of-core) el índice queda retirado hasta la
+próxima corrida por segmento.
+SEGMENT_MODELS_ENABLED=false ignora los segmentos y sirve solo el modelo promovido.
+'''
+SEGMENT_BY = [c.strip() for c in os.getenv("SEGMENT_BY", "operation_type,property_type").split(",") if c.strip()]
+SEGMENT_MIN_ROWS = int(os.getenv("SEGMENT_MIN_ROWS", "2000"))
+SEGMENT_N_ESTIMATORS = int(os.getenv("SEGMENT_N_ESTIMATORS", "50"))
+SEGMENT_CACHE_SIZE = int(os.getenv("SEGMENT_CACHE_SIZE", "4"))
+SEGMENT_MODELS_ENABLED = os.getenv("SEGMENT_MODELS_ENABLED", "true").lower() == "true"
+SEGMENTS_DIR = "app/data/artifacts/housing_models/segments"
+SEGMENTS_INDEX_PATH = os.path.join(SEGMENTS_DIR, "index.json")
+
+'''
+FEATURES ESPACIALES (app/utils/spatial.py): índice de los avisos del train por lat/lon (KD-tree + grilla)
+con el precio por m² del entorno: mediana de los SPATIAL_K vecinos más cercanos, distancia al k-ésimo y
+media de la celda de SPATIAL_CELL_DEG grados (si tiene >= SPATIAL_MIN_CELL_COUNT avisos).
+Va dentro del Pipeline servido y se guarda también aparte (spatial_index.joblib, junto al modelo).
+SPATIAL_FEATURES_ENABLED=false entrena solo con lat/lon crudos.
+'''
+SPATIAL_FEATURES_ENABLED = os.getenv("SPATIAL_FEATURES_ENABLED", "true").lower() == "true"
+SPATIAL_K = int(os.getenv("SPATIAL_K", "10"))
+SPATIAL_CELL_DEG = float(os.getenv("SPATIAL_CELL_DEG", "0.005"))
+SPATIAL_MIN_CELL_COUNT = int(os.getenv("SPATIAL_MIN_CELL_COUNT", "5"))
+
+'''
+COMPARABLES (app/utils/comparables.py, GET/POST /v1/comparables): al final del entrenamiento se arma un
+índice (KD-tree por operation_type x property_type x currency) con los avisos del dataset de entrenamiento
+y se carga junto al modelo. La distancia combina ubicación (1 unidad = COMPARABLES_GEO_KM km),
+log de la superficie (1 unidad = COMPARABLES_SURFACE_LOG) y ambientes (1 unidad = COMPARABLES_ROOMS_STEP).
+COMPARABLES_K por defecto, hasta COMPARABLES_MAX_K por request. COMPARABLES_ENABLED=false no lo arma ni lo carga.
+'''
+COMPARABLES_ENABLED = os.getenv("COMPARABLES_ENABLED", "true").lower() == "true"
+COMPARABLES_INDEX_PATH = "app/data/artifacts/housing_models/comparables_index.joblib"
+COMPARABLES_K = int(os.getenv("COMPARABLES_K", "10"))
+COMPARABLES_MAX_K = int(os.getenv("COMPARABLES_MAX_K", "50"))
+COMPARABLES_GEO_KM = float(os.getenv("COMPARABLES_GEO_KM", "1.0"))
+COMPARABLES_SURFACE_LOG = float(os.getenv("COMPARABLES_SURFACE_LOG", "0.25"))
+COMPARABLES_ROOMS_STEP = float(os.getenv("COMPARABLES_ROOMS_STEP", "1.0"))
+
+'''
+INTERVALOS DE PREDICCIÓN (?interval=true en /v1/predict/ y /v1/predict/batch): cuantiles INTERVAL_LOWER /
+INTERVAL_UPPER de las predicciones de los árboles del RandomForest (en log, vuelven con expm1), calculados en
+el mismo recorrido que la predicción puntual con el motor nativo. Si el modelo servido no es un RandomForest
+las bandas salen de random_forest.joblib (un recorrido aparte). Con INFERENCE_ENGINE=sklearn se arma al cargar
+una copia nativa del bosque. PREDICTION_INTERVALS_ENABLED=false no la arma.
+'''
+PREDICTION_INTERVALS_ENABLED = os.getenv("PREDICTION_INTERVALS_ENABLED", "true").lower() == "true"
+INTERVAL_LOWER = float(os.getenv("INTERVAL_LOWER", "0.1"))
+INTERVAL_UPPER = float(os.getenv("INTERVAL_UPPER", "0.9"))
+
+'''
+ACCESO A DUCKDB (app/utils/db.py): un pool por archivo y por proceso (una instancia de la base abierta
+hasta el apagado, hasta DB_POOL_SIZE cursores a la vez). Si otro proceso tiene tomado el archivo se le
+pide que lo suelte y se reintenta DB_LOCK_RETRIES veces; cada proceso revisa esos pedidos cada
+DB_RELEASE_POLL_S segundos y cierra su instancia si no la está usando.
+La ingesta escribe DB_PATH y el lago Parquet, y al terminar publica el snapshot (DB_SNAPSHOT_PATH): la
+lista de archivos del lago de esa versión, sin copiar filas. El entrenamiento lee esos archivos con
+read_parquet(hive_partitioning) y escribe datos_perfil / datos_clean en su propia base (TRAINING_DB_PATH):
+una ingesta y un entrenamiento pueden correr a la vez sin pelear por el lock.
+'''
+DB_PATH = "app/data/DB/entrenamiento.duckdb"
+DB_SNAPSHOT_PATH = "app/data/DB/entrenamiento_snapshot.duckdb"
+TRAINING_DB_PATH = "app/data/DB/entrenamiento_clean.duckdb"
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+DB_LOCK_RETRIES = int(os.getenv("DB_LOCK_RETRIES", "5"))
+DB_RELEASE_POLL_S = float(os.getenv("DB_RELEASE_POLL_S", "0.2"))
@@ -0,0 +1,283 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+import duckdb
+from app.utils.config import DB_POOL_SIZE, DB_LOCK_RETRIES, DB_RELEASE_POLL_S, DB_SNAPSHOT_PATH
+from app.utils.log_config import logger
+
+'''
+ACCESO A DUCKDB (único punto de conexión de la app)
+- ConnectionPool: una sola instancia de la base por archivo y por proceso, abierta hasta el apagado;
+  cada uso toma un cursor (una conexión de esa instancia, segura por hilo) de los libres, hasta
+  DB_POOL_SIZE a la vez. Al devolverlo se borran sus tablas temporales y, si era el último prestado,
+  se restauran los SET de la instancia (memory_limit, threads...) para el próximo uso.
+- DuckDB admite un solo proceso escritor por archivo: si otro proceso lo tiene tomado, la apertura
+  deja un pedido de liberación ({archivo}.release) y se reintenta DB_LOCK_RETRIES veces. El proceso
+  que lo tiene abierto ve el pedido (cada DB_RELEASE_POLL_S) y cierra la instancia cuando no
+  quedan cursores prestados.
+- run_async / fetch_df_async / fetchall_async: la consulta corre en un executor de hilos,
+  fuera del event loop.
+- snapshot: al terminar cada ingesta se publica un puntero de solo lectura al lago Parquet
+  (la lista de archivos de esa versión; publish_snapshot). Los archivos del lago no se modifican:
+  una ingesta escribe archivos nuevos y retira los viejos, así que leer un snapshot nunca espera
+  a una ingesta en curso ni ve una versión a medias.
+'''
+
+# opciones de la instancia que cambian la ingesta y el entrenamiento out-of-core
+INSTANCE_SETTINGS = ("memory_limit", "threads", "preserve_insertion_order")
+
+
+def _release_request(path: str) -> str:
+    return f"{path}.release"
+
+
+class ConnectionPool:
+    """Cursores de una instancia de DuckDB (un archivo, un modo) compartida por los hilos del proceso."""
+
+    def __init__(self, path: str, read_only: bool = False, size: int = DB_POOL_SIZE):
+        self.path = path
+        self.read_only = read_only
+        self._db = None
+        self._idle = []
+        self._leased = 0
+        self._opens = 0
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max(1, size))
+
+    def _open(self):
+        if not self.read_only:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        request = _release_request(self.path)
+        for attempt in range(DB_LOCK_RETRIES):
+            try:
+                db = duckdb.connect(self.path, read_only=self.read_only)
+            except duckdb.IOException as e:
+                # otro proceso tiene tomado el archivo: se le pide que lo suelte
+                if attempt == DB_LOCK_RETRIES - 1:
+                    if os.path.exists(request):
+                        os.remove(request)
+                    raise
+                logger.warning(f"{self.path} ocupado ({e}). Reintento {attempt + 1}/{DB_LOCK_RETRIES - 1}.")
+                open(request, "a").close()
+                time.sleep(0.5 * (attempt + 1))
+                continue
+            if os.path.exists(request):
+                os.remove(request)
+            self._opens += 1
+            _start_release_watcher()
+            return db
+
+    def _close(self):
+        for cursor in self._idle:
+            cursor.close()
+        self._idle.clear()
+        self._db.close()
+        self._db = None
+
+    def _reset(self, cursor) -> bool:
+        """Deja el cursor listo para otro uso; False si no se puede (se descarta)."""
+        try:
+            temporary = cursor.execute(
+                "SELECT table_name FROM duckdb_tables() WHERE temporary"
+            ).fetchall()
+            for (name,) in temporary:
+                cursor.execute(f'DROP TABLE temp.main."{name}"')
+            if self._leased == 0:
+                for name in INSTANCE_SETTINGS:
+                    cursor.execute(f"RESET GLOBAL {name}")
+            return True
+        except duckdb.Error as e:
+            logger.warning(f"Cursor de {self.path} descartado: {e}")
+            return False
+
+    @contextmanager
+    def connection(self):
+        """Cursor de la instancia compartida; al salir vuelve a los libres."""
+        with self._slots:
+            with self._lock:
+                if self._db is None:
+                    self._db = self._open()
+                cursor = self._idle.pop() if self._idle else self._db.cursor()
+                self._leased += 1
+            reusable = False
+            try:
+                yield cursor
+                reusable = True
+            finally:
+                with self._lock:
+                    self._leased -= 1
+                    if reusable and self._reset(cursor):
+                        self._idle.append(cursor)
+                    else:
+                        cursor.close()
+                self.release_if_requested()
+
+    def release_if_requested(self):
+        """Cierra la instancia si otro proceso pidió el archivo y no hay cursores prestados."""
+        with self._lock:
+            if self._db is not None and self._leased == 0 and os.path.exists(_release_request(self.path)):
+                logger.info(f"Otro proceso pidió {self.path}. Se cierra la instancia.")
+                self._close()
+
+    def close(self):
+        """Apagado: cierra la instancia (los cursores prestados se cierran al devolverse)."""
+        with self._lock:
+            if self._db is not None and self._leased == 0:
+                self._close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "path": self.path, "read_only": self.read_only, "open": self._db is not None,
+                "leased": self._leased, "idle": len(self._idle), "opens": self._opens,
+            }
+
+
+# (pid, ruta absoluta, solo lectura) -> pool; el pid evita heredar instancias en un fork
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(path: str, read_only: bool = False) -> ConnectionPool:
+    key = (os.getpid(), os.path.abspath(path), read_only)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(path, read_only)
+        return pool
+
+
+@contextmanager
+def connection(path: str, read_only: bool = False):
+    """with connection(DB_PATH) as con: ... (cursor del pool del archivo)."""
+    with get_pool(path, read_only).connection() as con:
+        yield con
+
+
+def _current_pools() -> list[ConnectionPool]:
+    with _pools_lock:
+        return [pool for (pid, _, _), pool in _pools.items() if pid == os.getpid()]
+
+
+# --- Pedidos de liberación de otros procesos ---
+
+_watcher = None
+_watcher_stop = threading.Event()
+
+
+def _watch_release_requests():
+    while not _watcher_stop.wait(DB_RELEASE_POLL_S):
+        for pool in _current_pools():
+            pool.release_if_requested()
+
+
+def _start_release_watcher():
+    global _watcher
+    with _pools_lock:
+        if _watcher is None or not _watcher.is_alive():
+            _watcher_stop.clear()
+            _watcher = threading.Thread(target=_watch_release_requests, name="duckdb-release", daemon=True)
+            _watcher.start()
+
+
+# --- Acceso asíncrono ---
+
+_executor = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _pools_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="duckdb")
+        return _executor
+
+
+def _run(path, read_only, fn, *args):
+    with connection(path, read_only) as con:
+        return fn(con, *args)
+
+
+async def run_async(path: str, fn, *args, read_only: bool = False):
+    """fn(con, *args) con un cursor del pool, en un hilo del executor (no bloquea el event loop)."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), partial(_run, path, read_only, fn, *args))
+
+
+async def fetch_df_async(path: str, sql: str, params=None, read_only: bool = False):
+    return await run_async(path, lambda con: con.execute(sql, params).df(), read_only=read_only)
+
+
+async def fetchall_async(path: str, sql: str, params=None, read_only: bool = False):
+    return await run_async(path, lambda con: con.execute(sql, params).fetchall(), read_only=read_only)
+
+
+def shutdown_db():
+    """Apagado: termina el executor de consultas asíncronas y cierra las instancias abiertas."""
+    global _executor, _watcher
+    with _pools_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
+        _watcher_stop.set()
+        _watcher = None
+    for pool in _current_pools():
+        pool.close()
+
+
+# --- Snapshot de solo lectura (puntero al lago Parquet) ---
+
+def lake_source(files: list[str], filename: bool = False) -> str:
+    """
+    read_parquet de files con particiones Hive: los filtros por columnas de partición descartan
+    archivos enteros y el resto baja a las estadísticas de los row groups.
+    """
+    paths = ", ".join("'" + path.replace("'", "''") + "'" for path in files)
+    return (
+        f"read_parquet([{paths}], hive_partitioning = true, hive_types_autocast = false"
+        f"{', filename = true' if filename else ''})"
+    )
+
+
+def publish_snapshot(con, lake_files: list[str], tables: list[str] = (), path: str | None = None):
+    """
+    Publica el snapshot de una versión: la lista de archivos del lago que la forman (no se copian filas)
+    y una copia de tables (tablas chicas de control). Se arma en un archivo nuevo y se reemplaza de
+    forma atómica; los lectores que ya leyeron el anterior siguen con sus archivos.
+    """
+    path = path or DB_SNAPSHOT_PATH
+    tmp_path = f"{path}.tmp"
+    for leftover in (tmp_path, f"{tmp_path}.wal"):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+    con.execute(f"ATTACH '{tmp_path}' AS snapshot_out")
+    try:
+        con.execute("CREATE TABLE snapshot_out.lake_files AS SELECT unnest(?::VARCHAR[]) AS path", [lake_files])
+        for table in tables:
+            con.execute(f"CREATE TABLE snapshot_out.{table} AS SELECT * FROM {table}")
+    finally:
+        # DETACH hace el checkpoint: el archivo queda completo, sin WAL
+        con.execute("DETACH snapshot_out")
+    os.replace(tmp_path, path)
+    logger.info(f"Snapshot publicado en {path} ({len(lake_files)} archivos del lago).")
+
+
+def snapshot_lake_files(con, path: str | None = None) -> list[str] | None:
+    """
+    Archivos del lago del último snapshot publicado (None si todavía no hay).
+    El snapshot se monta READ_ONLY solo para leer la lista: la instancia del pool no queda
+    atada a una versión vieja.
+    """
+    path = path or DB_SNAPSHOT_PATH
+    if not os.path.exists(path):
+        return None
+    alias = f"snapshot_{threading.get_ident()}"
+    con.execute(f"ATTACH '{path}' AS {alias} (READ_ONLY)")
+    try:
+        return [row[0] for row in con.execute(f"SELECT path FROM {alias}.lake_files").fetchall()]
+    finally:
+        con.execute(f"DETACH {alias}")
@@ -0,0 +1,257 @@
+import numpy as np
+import pandas as pd
+from sklearn.pipeline import Pipeline
+from sklearn.compose import ColumnTransformer
+from sklearn.frozen import FrozenEstimator
+from sklearn.impute import SimpleImputer
+from sklearn.preprocessing import OneHotEncoder, OrdinalEncoder, StandardScaler, RobustScaler, FunctionTransformer
+from app.models.schemas import Sample
+from app.utils.spatial import SpatialFeatures, GEO_COLUMNS
+from app.utils.log_config import logger
+
+'''
+CODIFICACION DE FEATURES: Sample -> fila numérica que recibe el estimador final.
+- samples_to_frame: camino pandas (DataFrame -> ColumnTransformer del Pipeline)
+- FastEncoder: camino compilado. Lee del Pipeline entrenado las medianas del imputer,
+  centros/escalas del scaler y categorías del OneHotEncoder (o códigos del OrdinalEncoder),
+  y escribe cada Sample directo en una fila NumPy preasignada, sin pandas ni dispatch de sklearn.
+  Las features espaciales (SpatialFeatures) se buscan en el índice una vez por lote.
+'''
+
+def samples_to_frame(samples: list[Sample]) -> pd.DataFrame:
+    """
+    DataFrame de entrada para el Pipeline. Los None se pasan a NaN para que el
+    SimpleImputer los trate como faltantes igual que en el entrenamiento,
+    sin importar si la columna queda como object (ej: lote de una sola fila).
+    """
+    return pd.DataFrame([s.model_dump() for s in samples]).fillna(np.nan)
+
+
+class FastEncoder:
+    def __init__(self, template, numeric, categorical, estimator, ordinal=(), spatial=()):
+        # fila con los valores por defecto (medianas imputadas y escaladas, one-hot en cero)
+        self._template = template
+        # (feature, columna, centro, escala)
+        self._numeric = numeric
+        # (feature, {categoría: columna}, valor de relleno para None)
+        self._categorical = categorical
+        # (feature, columna, {categoría: código}, valor de relleno para None, código de desconocidas)
+        self._ordinal = ordinal
+        # (SpatialFeatures, columnas de salida): features de entorno buscadas en el índice por lote
+        self._spatial = spatial
+        self.estimator = estimator
+        self.n_features = template.shape[0]
+
+    def encode(self, samples: list[Sample]) -> np.ndarray:
+        """Codifica una lista de Sample en una matriz (n_samples, n_features)."""
+        X = np.repeat(self._template[np.newaxis, :], len(samples), axis=0)
+        for i, sample in enumerate(samples):
+            row = X[i]
+            for name, col, center, scale in self._numeric:
+                value = getattr(sample, name)
+                if value is not None and value == value:
+                    # mismo orden de operaciones que el scaler de sklearn: (x - centro) / escala
+                    row[col] = (value - center) / scale
+            for name, columns, fill_value in self._categorical:
+                value = getattr(sample, name)
+                col = columns.get(fill_value if value is None else value)
+                if col is not None:
+                    row[col] = 1.0
+            for name, col, codes, fill_value, unknown in self._ordinal:
+                value = getattr(sample, name)
+                row[col] = codes.get(fill_value if value is None else value, unknown)
+        for index, out in self._spatial:
+            # None -> NaN: el índice devuelve los valores globales del train
+            lat = np.array([getattr(s, GEO_COLUMNS[0]) for s in samples], dtype=np.float64)
+            lon = np.array([getattr(s, GEO_COLUMNS[1]) for s in samples], dtype=np.float64)
+            X[:, out] = index.lookup(lat, lon)
+        return X
+
+    def predict(self, samples: list[Sample]) -> np.ndarray:
+        return self.estimator.predict(self.encode(samples))
+
+
+def _numeric_params(transformer, n_cols):
+    """Medianas, centros y escalas de un bloque numérico (imputer [+ scaler] o passthrough)."""
+    if isinstance(transformer, FunctionTransformer) and transformer.func is None:
+        # passthrough (HistGradientBoosting): los faltantes quedan NaN
+        return np.full(n_cols, np.nan), np.zeros(n_cols), np.ones(n_cols)
+    steps = transformer.steps if isinstance(transformer, Pipeline) else [("t", transformer)]
+    if not steps or not isinstance(steps[0][1], SimpleImputer):
+        return None
+    imputer = steps[0][1]
+    try:
+        fill = np.asarray(imputer.statistics_, dtype=np.float64)
+    except (TypeError, ValueError):
+        # imputer de texto: es un bloque categórico
+        return None
+    # si el imputer descartó columnas vacías la salida no coincide con la entrada
+    if fill.shape[0] != n_cols or np.isnan(fill).any() or imputer.add_indicator:
+        return None
+
+    center = np.zeros(n_cols)
+    scale = np.ones(n_cols)
+    for _, step in steps[1:]:
+        if isinstance(step, RobustScaler):
+            if step.center_ is not None:
+                center = np.asarray(step.center_, dtype=np.float64)
+            if step.scale_ is not None:
+                scale = np.asarray(step.scale_, dtype=np.float64)
+        elif isinstance(step, StandardScaler):
+            if step.with_mean:
+                center = np.asarray(step.mean_, dtype=np.float64)
+            if step.with_std:
+                scale = np.asarray(step.scale_, dtype=np.float64)
+        else:
+            return None
+    if len(steps) > 2:
+        return None
+    return fill, center, scale
+
+
+def _categorical_params(transformer):
+    """Valor de relleno y categorías de un bloque categórico (imputer constante + OneHotEncoder)."""
+    if not isinstance(transformer, Pipeline) or len(transformer.steps) != 2:
+        return None
+    imputer, ohe = transformer.steps[0][1], transformer.steps[1][1]
+    if not isinstance(imputer, SimpleImputer) or imputer.strategy != "constant" or imputer.add_indicator:
+        return None
+    if not isinstance(ohe, OneHotEncoder) or ohe.drop_idx_ is not None or ohe.handle_unknown != "ignore":
+        return None
+    # one-hot CSR / float32 (FEATURE_LAYOUT=compact): el ColumnTransformer igual devuelve filas densas 0/1
+    if getattr(ohe, "_infrequent_enabled", False) or np.dtype(ohe.dtype) not in (np.float32, np.float64):
+        return None
+    return imputer.fill_value, ohe.categories_
+
+
+def _ordinal_params(transformer):
+    """Valor de relleno, categorías y código de desconocidas de un bloque (imputer constante + OrdinalEncoder)."""
+    if not isinstance(transformer, Pipeline) or len(transformer.steps) != 2:
+        return None
+    imputer, encoder = transformer.steps[0][1], transformer.steps[1][1]
+    if not isinstance(imputer, SimpleImputer) or imputer.strategy != "constant" or imputer.add_indicator:
+        return None
+    if not isinstance(encoder, OrdinalEncoder) or encoder.handle_unknown != "use_encoded_value":
+        return None
+    # códigos float64 o enteros chicos (FEATURE_LAYOUT=compact)
+    if np.dtype(encoder.dtype) != np.float64 and not np.issubdtype(encoder.dtype, np.signedinteger):
+        return None
+    # categorías agrupadas como infrecuentes: el mapeo ya no es uno a uno
+    if encoder._infrequent_enabled and any(c is not None for c in encoder.infrequent_categories_):
+        return None
+    return imputer.fill_value, encoder.categories_, float(encoder.unknown_value)
+
+
+def build_fast_encoder(model):
+    """
+    Compila el Pipeline (preproc ColumnTransformer + estimador) entrenado por trainer.py.
+    Devuelve None si la estructura no es la soportada; en ese caso se usa el camino pandas.
+    """
+    if not isinstance(model, Pipeline) or len(model.steps) < 2:
+        return None
+    preproc = model.steps[0][1]
+    if not isinstance(preproc, ColumnTransformer) or preproc.sparse_output_:
+        return None
+
+    numeric, categorical, ordinal, spatial = [], [], [], []
+    template_parts = {}
+    for name, transformer, columns in preproc.transformers_:
+        out = preproc.output_indices_[name]
+        if name == "remainder":
+            if transformer != "drop" and out.stop > out.start:
+                return None
+            continue
+        if not isinstance(columns, list) or not all(isinstance(c, str) for c in columns):
+            return None
+        # bloques ajustados una vez y congelados por el preprocesamiento compartido del trainer
+        if isinstance(transformer, FrozenEstimator):
+            transformer = transformer.estimator
+
+        if isinstance(transformer, SpatialFeatures) and columns == GEO_COLUMNS:
+            spatial.append((transformer, out))
+            template_parts[name] = (out, transformer.fill_)
+            continue
+
+        num = _numeric_params(transformer, len(columns))
+        if num is not None:
+            fill, center, scale = num
+            for j, feature in enumerate(columns):
+                numeric.append((feature, out.start + j, center[j], scale[j]))
+            template_parts[name] = (out, (fill - center) / scale)
+            continue
+
+        cat = _categorical_params(transformer)
+        if cat is not None:
+            fill_value, categories = cat
+            offset = out.start
+            block = np.zeros(out.stop - out.start)
+            for feature, cats in zip(columns, categories):
+                categorical.append((feature, {c: offset + k for k, c in enumerate(cats)}, fill_value))
+                offset += len(cats)
+            if offset != out.stop:
+                return None
+            template_parts[name] = (out, block)
+            continue
+
+        ordn = _ordinal_params(transformer)
+        if ordn is not None:
+            fill_value, categories, unknown = ordn
+            for j, (feature, cats) in enumerate(zip(columns, categories)):
+                ordinal.append((feature, out.start + j, {c: float(k) for k, c in enumerate(cats)}, fill_value, unknown))
+            template_parts[name] = (out, np.full(out.stop - out.start, unknown))
+            continue
+
+        logger.info(f"FastEncoder: bloque '{name}' no soportado, se usa el camino pandas.")
+        return None
+
+    if not template_parts:
+        return None
+    n_features = max(out.stop for out, _ in template_parts.values())
+    template = np.zeros(n_features, dtype=np.float64)
+    for out, values in template_parts.values():
+        template[out] = values
+
+    fields = Sample.model_fields
+    if any(feature not in fields for feature, *_ in numeric + categorical + ordinal):
+        return None
+    if spatial and any(c not in fields for c in GEO_COLUMNS):
+        return None
+
+    estimator = model[1:] if len(model.steps) > 2 else model.steps[-1][1]
+    return FastEncoder(template, numeric, categorical, estimator, ordinal, spatial)
+
+
+def _probe_samples(encoder: FastEncoder, n: int = 64, seed: int = 0) -> list[Sample]:
+    """Samples sintéticos que recorren categorías, faltantes y valores numéricos variados."""
+    rng = np.random.default_rng(seed)
+    probes = []
+    for i in range(n):
+        values = {}
+        for name, _, center, scale in encoder._numeric:
+            choice = rng.integers(0, 4)
+            if choice == 0:
+                values[name] = None
+            elif choice == 1:
+                values[name] = float(center)
+            else:
+                values[name] = float(center + scale * rng.normal(0, 2))
+        for name, columns, _ in encoder._categorical:
+            options = list(columns) + [None, "__desconocido__"]
+            values[name] = options[(i + rng.integers(0, len(options))) % len(options)]
+        for name, _, codes, _, _ in encoder._ordinal:
+            options = list(codes) + [None, "__desconocido__"]
+            values[name] = options[(i + rng.integers(0, len(options))) % len(options)]
+        probes.append(Sample.model_construct(**values))
+    return probes
+
+
+def verify_parity(model, encoder: FastEncoder) -> bool:
+    """Compara bit a bit el camino compilado contra el Pipeline completo (lote y fila a fila)."""
+    probes = _probe_samples(encoder)
+    expected = model.predict(samples_to_frame(probes))
+    if not np.array_equal(encoder.predict(probes), expected):
+        return False
+    return all(
+        np.array_equal(encoder.predict([p]), model.predict(samples_to_frame([p])))
+        for p in probes[:8]
+    )
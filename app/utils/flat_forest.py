@@ -0,0 +1,373 @@
+import json
+import os
+import shutil
+import time
+import joblib
+import numpy as np
+from sklearn.base import BaseEstimator, RegressorMixin
+from sklearn.pipeline import Pipeline
+from sklearn.compose import TransformedTargetRegressor
+from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
+from sklearn.dummy import DummyRegressor
+from app.utils.log_config import logger
+
+'''
+FORMATO PLANO DE ENSAMBLES DE ARBOLES (memory-mappable) + MOTOR DE INFERENCIA NATIVO
+Los nodos de todos los árboles se concatenan en arrays NumPy contiguos (.npy sin comprimir):
+  feature, threshold, children, value, missing_left  + roots (nodo raíz de cada árbol)
+children intercala los hijos (izquierdo en 2*i, derecho en 2*i + 1): un solo gather por nivel.
+Las hojas apuntan a sí mismas (ambos hijos = propio índice). El preprocesamiento
+(ColumnTransformer) va aparte en preproc.joblib.
+Al cargar con mmap_mode='r' los N workers de uvicorn comparten los nodos vía page cache.
+
+Soporta RandomForestRegressor (promedio de árboles, opcional log1p/expm1 del target)
+y GradientBoostingRegressor (init + learning_rate * suma de árboles, en el mismo orden que sklearn).
+Del RandomForest también da intervalos (cuantiles de los árboles) en el mismo recorrido: predict_quantiles.
+'''
+
+FLAT_FORMAT_VERSION = 2
+_ARRAYS = ("feature", "threshold", "children", "value", "missing_left", "roots")
+
+
+def _flatten_trees(estimators):
+    """Concatena los árboles de sklearn en arrays planos con índices globales."""
+    feature, threshold, children, value, missing_left, roots = [], [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for est in estimators:
+        tree = est.tree_
+        n = tree.node_count
+        idx = np.arange(n, dtype=np.int64) + offset
+        is_leaf = tree.children_left == -1
+
+        feature.append(np.where(is_leaf, 0, tree.feature).astype(np.int32))
+        threshold.append(np.where(is_leaf, np.inf, tree.threshold).astype(np.float64))
+        pair = np.empty((n, 2), dtype=np.int32)
+        pair[:, 0] = np.where(is_leaf, idx, tree.children_left + offset)
+        pair[:, 1] = np.where(is_leaf, idx, tree.children_right + offset)
+        children.append(pair.ravel())
+        value.append(tree.value[:, 0, 0].astype(np.float64))
+        mgl = getattr(tree, "missing_go_to_left", None)
+        missing_left.append(
+            np.asarray(mgl, dtype=np.uint8) if mgl is not None else np.zeros(n, dtype=np.uint8)
+        )
+        roots.append(offset)
+        max_depth = max(max_depth, tree.max_depth)
+        offset += n
+
+    arrays = {
+        "feature": np.concatenate(feature),
+        "threshold": np.concatenate(threshold),
+        "children": np.concatenate(children),
+        "value": np.concatenate(value),
+        "missing_left": np.concatenate(missing_left),
+        "roots": np.asarray(roots, dtype=np.int32),
+    }
+    return arrays, max_depth
+
+
+class FlatForestRegressor(RegressorMixin, BaseEstimator):
+    """
+    Estimador de solo lectura sobre el formato plano. Reproduce el predict de
+    TransformedTargetRegressor(RandomForestRegressor, expm1) o de GradientBoostingRegressor.
+    """
+
+    # filas por bloque: mantiene los arrays de trabajo (n_trees * filas) en cache
+    chunk_rows = 1024
+
+    def __init__(self, arrays: dict, meta: dict):
+        self.arrays = arrays
+        self.meta = meta
+        for name in _ARRAYS:
+            setattr(self, name, arrays[name])
+        self.max_depth = meta["max_depth"]
+        self.n_trees = len(self.roots)
+        self.n_features_in_ = meta["n_features"]
+        self._roots32 = np.asarray(self.roots, dtype=np.int32)
+
+    def __repr__(self, N_CHAR_MAX=700):
+        return f"FlatForestRegressor({self.meta.get('estimator')}, n_trees={self.n_trees}, n_nodes={self.meta['n_nodes']})"
+
+    def fit(self, X, y=None):
+        raise TypeError("El formato plano es de solo lectura: reentrenar con trainer.py.")
+
+    def __sklearn_is_fitted__(self):
+        return True
+
+    def _leaves(self, X):
+        """
+        Hoja alcanzada en cada árbol para cada fila: (n_trees, n_samples).
+        Recorre todos los árboles a la vez, nivel por nivel, y en cada nivel
+        descarta los pares (árbol, fila) que ya llegaron a una hoja.
+        """
+        # sklearn compara X en float32 contra umbrales float64
+        X = np.asarray(X, dtype=np.float32)
+        n, n_features = X.shape
+        leaves = np.empty((self.n_trees, n), dtype=np.int64)
+        for start in range(0, n, self.chunk_rows):
+            Xc = X[start:start + self.chunk_rows]
+            m = Xc.shape[0]
+            flat_X = Xc.ravel()
+            has_nan = np.isnan(Xc).any()
+
+            # índices int32: la mitad de memoria que mover en cada nivel
+            node = np.repeat(self._roots32, m)
+            row_offset = np.tile(np.arange(m, dtype=np.int32) * n_features, self.n_trees)
+            pos = np.arange(self.n_trees * m, dtype=np.int32)
+            out = np.empty(self.n_trees * m, dtype=np.int64)
+            while pos.size:
+                x = flat_X[row_offset + self.feature[node]]
+                go_right = x > self.threshold[node]
+                if has_nan:
+                    go_right |= np.isnan(x) & (self.missing_left[node] == 0)
+                nxt = self.children[2 * node + go_right]
+                done = nxt == node
+                n_done = np.count_nonzero(done)
+                if n_done == pos.size:
+                    out[pos] = node
+                    break
+                if n_done:
+                    out[pos[done]] = node[done]
+                    keep = ~done
+                    pos, row_offset, node = pos[keep], row_offset[keep], nxt[keep]
+                else:
+                    node = nxt
+            leaves[:, start:start + m] = out.reshape(self.n_trees, m)
+        return leaves
+
+    def tree_values(self, X):
+        """Valor de hoja de cada árbol para cada fila: (n_trees, n_samples)."""
+        return self.value[self._leaves(X)]
+
+    def predict(self, X):
+        return self._aggregate(self._leaves(X))
+
+    def predict_quantiles(self, X, quantiles) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Predicción y cuantiles de las predicciones por árbol en el mismo recorrido (solo RandomForest).
+        Los cuantiles se toman en el espacio del target de entrenamiento (log1p) y vuelven con expm1.
+        Devuelve (predicción (n,), cuantiles (len(quantiles), n)).
+        """
+        if self.meta.get("aggregation", "mean") != "mean":
+            raise ValueError("Los intervalos por árbol solo se soportan para RandomForest.")
+        leaves = self._leaves(X)
+        bands = np.quantile(self.value[leaves], quantiles, axis=0)
+        if self.meta.get("target_transform") == "log1p":
+            bands = np.expm1(bands)
+        return self._aggregate(leaves), bands
+
+    def _aggregate(self, leaves):
+        # fila 0 = valor inicial; cumsum acumula árbol por árbol en el mismo orden que sklearn
+        acc = np.empty((self.n_trees + 1, leaves.shape[1]), dtype=np.float64)
+        if self.meta.get("aggregation", "mean") == "sum":
+            # GradientBoosting: init + learning_rate * valor, etapa por etapa
+            acc[0] = self.meta["init"]
+            np.multiply(self.meta["learning_rate"], self.value[leaves], out=acc[1:])
+            y = np.cumsum(acc, axis=0, out=acc)[-1]
+        else:
+            # RandomForest: suma de los árboles dividida por n
+            acc[0] = 0.0
+            np.take(self.value, leaves, out=acc[1:])
+            y = np.cumsum(acc, axis=0, out=acc)[-1] / self.n_trees
+        if self.meta.get("target_transform") == "log1p":
+            y = np.expm1(y)
+        return y
+
+
+class HybridRegressor(RegressorMixin, BaseEstimator):
+    """
+    Motor "auto": lotes chicos con el motor nativo (menor latencia) y lotes grandes
+    con el estimador de sklearn, cuyo loop en C rinde más a partir de cierto tamaño
+    (cientos de filas en el RandomForest, decenas en el GradientBoosting: ver calibrate).
+    """
+
+    def __init__(self, native, sklearn_estimator, max_native_rows: int):
+        self.native = native
+        self.sklearn_estimator = sklearn_estimator
+        self.max_native_rows = max_native_rows
+        self.n_features_in_ = native.n_features_in_
+
+    def __repr__(self, N_CHAR_MAX=700):
+        return f"HybridRegressor({self.native!r}, max_native_rows={self.max_native_rows})"
+
+    def fit(self, X, y=None):
+        raise TypeError("Estimador de solo lectura: reentrenar con trainer.py.")
+
+    def __sklearn_is_fitted__(self):
+        return True
+
+    def predict(self, X):
+        if X.shape[0] <= self.max_native_rows:
+            return self.native.predict(X)
+        return self.sklearn_estimator.predict(X)
+
+    def calibrate(self, X, repeats: int = 3) -> int:
+        """
+        Baja max_native_rows al lote más grande (1, 2, 4, ... hasta el máximo configurado)
+        en el que el motor nativo es más rápido que sklearn sobre las filas de X. Devuelve el corte.
+        """
+        def best_ms(predict, Xb):
+            times = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                predict(Xb)
+                times.append(time.perf_counter() - start)
+            return min(times) * 1000
+
+        limit, cutoff, rows = self.max_native_rows, 0, 1
+        while rows <= limit:
+            Xb = np.resize(X, (rows, X.shape[1]))
+            if best_ms(self.native.predict, Xb) >= best_ms(self.sklearn_estimator.predict, Xb):
+                break
+            cutoff = rows
+            rows = limit if rows < limit < rows * 2 else rows * 2
+        self.max_native_rows = cutoff
+        return cutoff
+
+
+def flatten_estimator(est):
+    """
+    Aplana el estimador final de un Pipeline entrenado (arrays + metadatos).
+    Lanza ValueError si el tipo de modelo no está soportado.
+    """
+    target_transform = None
+    if isinstance(est, TransformedTargetRegressor):
+        if est.func is not np.log1p or est.inverse_func is not np.expm1:
+            raise ValueError("Solo se soporta la transformación log1p/expm1 del target.")
+        target_transform = "log1p"
+        est = est.regressor_
+
+    if isinstance(est, RandomForestRegressor) and est.n_outputs_ == 1:
+        trees = est.estimators_
+        extra = {"estimator": "RandomForestRegressor", "aggregation": "mean"}
+    elif isinstance(est, GradientBoostingRegressor):
+        if isinstance(est.init_, DummyRegressor):
+            init = float(np.ravel(est.init_.constant_)[0])
+        elif est.init_ == "zero":
+            init = 0.0
+        else:
+            raise ValueError("Solo se soporta init por defecto (DummyRegressor) o 'zero'.")
+        trees = est.estimators_[:, 0]
+        extra = {
+            "estimator": "GradientBoostingRegressor",
+            "aggregation": "sum",
+            "learning_rate": float(est.learning_rate),
+            "init": init,
+        }
+    else:
+        raise ValueError(f"Estimador no soportado para el formato plano: {type(est).__name__}")
+
+    arrays, max_depth = _flatten_trees(trees)
+    meta = {
+        "format_version": FLAT_FORMAT_VERSION,
+        **extra,
+        "target_transform": target_transform,
+        "n_trees": len(trees),
+        "n_nodes": int(arrays["value"].shape[0]),
+        "n_features": int(est.n_features_in_),
+        "max_depth": int(max_depth),
+    }
+    return arrays, meta
+
+
+def to_native(model, hybrid_max_rows: int | None = None) -> Pipeline:
+    """
+    Convierte en memoria un Pipeline(preproc, estimador) de sklearn al motor nativo.
+    Con hybrid_max_rows, los lotes más grandes siguen usando el estimador de sklearn.
+    """
+    if not isinstance(model, Pipeline) or len(model.steps) != 2:
+        raise ValueError("Se esperaba un Pipeline (preproc, estimador).")
+    preproc, est = model.steps[0][1], model.steps[1][1]
+    native = FlatForestRegressor(*flatten_estimator(est))
+    if hybrid_max_rows is not None:
+        native = HybridRegressor(native, est, hybrid_max_rows)
+    return Pipeline([("preproc", preproc), ("est", native)])
+
+
+def forest_for_intervals(model) -> FlatForestRegressor | None:
+    """
+    Motor nativo del RandomForest final de un Pipeline (plano, híbrido o de sklearn) para predict_quantiles.
+    None si el estimador final no es un RandomForest.
+    """
+    est = model.steps[-1][1]
+    if isinstance(est, HybridRegressor):
+        est = est.native
+    if isinstance(est, FlatForestRegressor):
+        return est if est.meta.get("aggregation", "mean") == "mean" else None
+    inner = est.regressor_ if isinstance(est, TransformedTargetRegressor) else est
+    if not isinstance(inner, RandomForestRegressor):
+        return None
+    return FlatForestRegressor(*flatten_estimator(est))
+
+
+def probe_matrix(est: FlatForestRegressor, n: int = 256, seed: int = 0) -> np.ndarray:
+    """
+    Matriz sintética para comparar motores: cada valor es un umbral de algún nodo
+    (empate, va a la izquierda), el float32 siguiente (va a la derecha) o ruido.
+    """
+    rng = np.random.default_rng(seed)
+    X = rng.normal(0, 2, size=(n, est.n_features_in_)).astype(np.float32)
+    internal = est.children[0::2] != np.arange(est.value.shape[0])
+    for j in range(est.n_features_in_):
+        thresholds = np.asarray(est.threshold[internal & (est.feature == j)], dtype=np.float32)
+        # con faltantes sklearn puede partir en umbral +inf (NaN a un lado, el resto al otro)
+        thresholds = thresholds[np.isfinite(thresholds)]
+        if thresholds.size == 0:
+            continue
+        picked = rng.choice(thresholds, n)
+        kind = rng.integers(0, 3, n)
+        X[kind == 0, j] = picked[kind == 0]
+        X[kind == 1, j] = np.nextafter(picked[kind == 1], np.float32(np.inf))
+    return X
+
+
+def export_flat_forest(model, out_dir: str):
+    """
+    Exporta un Pipeline(preproc, estimador) de trainer.py al formato plano.
+    Escribe en un directorio temporal y lo reemplaza al final, para que un worker
+    nunca vea un artefacto a medio escribir.
+    """
+    if not isinstance(model, Pipeline) or len(model.steps) != 2:
+        raise ValueError("Se esperaba un Pipeline (preproc, estimador).")
+    preproc, est = model.steps[0][1], model.steps[1][1]
+    arrays, meta = flatten_estimator(est)
+
+    tmp_dir = f"{out_dir}.tmp-{int(time.time() * 1000)}"
+    os.makedirs(tmp_dir)
+    for name, arr in arrays.items():
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), np.ascontiguousarray(arr))
+    joblib.dump(preproc, os.path.join(tmp_dir, "preproc.joblib"))
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+    old_dir = None
+    if os.path.exists(out_dir):
+        old_dir = f"{out_dir}.old-{int(time.time() * 1000)}"
+        os.replace(out_dir, old_dir)
+    os.replace(tmp_dir, out_dir)
+    if old_dir:
+        # los workers que tengan mapeado el artefacto anterior conservan sus inodos
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+    logger.info(f"Modelo exportado en formato plano: {out_dir} ({meta['n_nodes']} nodos, {meta['n_trees']} árboles)")
+    return meta
+
+
+def load_flat_forest(model_dir: str, mmap: bool = True) -> Pipeline:
+    """
+    Abre el formato plano. Con mmap=True los arrays de nodos se mapean en solo lectura
+    (compartidos entre procesos). Devuelve un Pipeline(preproc, FlatForestRegressor).
+    """
+    with open(os.path.join(model_dir, "meta.json")) as f:
+        meta = json.load(f)
+    version = meta.get("format_version")
+    if version != FLAT_FORMAT_VERSION:
+        raise ValueError(
+            f"{model_dir}: formato plano v{version} no soportado (se espera v{FLAT_FORMAT_VERSION}). "
+            "Volver a exportar el modelo."
+        )
+
+    mmap_mode = "r" if mmap else None
+    arrays = {name: np.load(os.path.join(model_dir, f"{name}.npy"), mmap_mode=mmap_mode) for name in _ARRAYS}
+    preproc = joblib.load(os.path.join(model_dir, "preproc.joblib"))
+    return Pipeline([("preproc", preproc), ("est", FlatForestRegressor(arrays, meta))])
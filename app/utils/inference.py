@@ -0,0 +1,91 @@
+import numpy as np
+from app.models.schemas import Sample
+from app.utils.config import INTERVAL_LOWER, INTERVAL_UPPER
+from app.utils.encoding import samples_to_frame
+from app.utils.model_loader import ModelVersion, IntervalModel, get_active_version
+from app.utils.metrics import stage
+
+'''
+PUNTO UNICO DE INFERENCIA: lo usan /v1/predict/, /v1/predict/batch y el micro-batcher.
+Si el modelo cargado se pudo compilar (FastEncoder) se evita pandas; si no, se usa el Pipeline.
+Con modelos por segmento, cada Sample va al modelo de su segmento (cargado a demanda).
+predict_samples_interval agrega las bandas INTERVAL_LOWER / INTERVAL_UPPER de los árboles del RandomForest.
+Cada llamada suma sus etapas encoding / inference al histograma de etapas de /metrics.
+'''
+
+class IntervalsUnavailable(LookupError):
+    """El modelo (o el modelo del segmento) no tiene RandomForest para dar intervalos."""
+
+def predict_samples(samples: list[Sample], version: ModelVersion | None = None) -> np.ndarray:
+    """
+    Predice una lista de Sample con una sola llamada al estimador.
+    version: la versión tomada por el request (por defecto, la activa).
+    """
+    if version is None:
+        version = get_active_version()
+    if version.segments is None:
+        return _predict(version.model, version.encoder, samples)
+
+    # un predict por segmento; los Sample sin modelo de segmento van al modelo promovido
+    groups = {}
+    for i, sample in enumerate(samples):
+        groups.setdefault(version.segments.key(sample), []).append(i)
+    predictions = np.empty(len(samples), dtype=np.float64)
+    for key, rows in groups.items():
+        segment = version.segments.get(key)
+        group = samples if len(rows) == len(samples) else [samples[i] for i in rows]
+        if segment is not None:
+            predictions[rows] = _predict(segment.model, segment.encoder, group)
+        else:
+            predictions[rows] = _predict(version.model, version.encoder, group)
+    return predictions
+
+
+def predict_samples_interval(samples: list[Sample], version: ModelVersion | None = None):
+    """
+    Predicción puntual y bandas (lower, upper) por Sample, con el mismo ruteo por segmento que predict_samples.
+    Lanza IntervalsUnavailable si la versión no tiene RandomForest para los intervalos.
+    """
+    if version is None:
+        version = get_active_version()
+    predictions = np.empty(len(samples), dtype=np.float64)
+    bands = np.empty((2, len(samples)), dtype=np.float64)
+    groups = {}
+    for i, sample in enumerate(samples):
+        groups.setdefault(version.segments.key(sample) if version.segments is not None else None, []).append(i)
+    for key, rows in groups.items():
+        segment = version.segments.get(key) if key is not None else None
+        group = samples if len(rows) == len(samples) else [samples[i] for i in rows]
+        if segment is not None and segment.interval is not None:
+            predictions[rows], bands[:, rows] = _predict_interval(segment.model, segment.encoder, segment.interval, group)
+        elif segment is not None:
+            raise IntervalsUnavailable(f"El modelo del segmento {key} no da intervalos.")
+        elif version.interval is not None:
+            predictions[rows], bands[:, rows] = _predict_interval(version.model, version.encoder, version.interval, group)
+        else:
+            raise IntervalsUnavailable("El modelo cargado no da intervalos (no hay RandomForest).")
+    return predictions, bands[0], bands[1]
+
+
+def _predict_interval(model, encoder, interval: IntervalModel, samples: list[Sample]):
+    """Un solo recorrido del bosque si el RandomForest es el modelo servido; si no, la puntual va aparte."""
+    with stage("encoding"):
+        X = interval.encode(samples)
+    with stage("inference"):
+        prediction, bands = interval.forest.predict_quantiles(X, [INTERVAL_LOWER, INTERVAL_UPPER])
+    if not interval.same_pass:
+        prediction = _predict(model, encoder, samples)
+    return prediction, bands
+
+
+def _predict(model, encoder, samples: list[Sample]) -> np.ndarray:
+    if encoder is not None:
+        with stage("encoding"):
+            X = encoder.encode(samples)
+        with stage("inference"):
+            return encoder.estimator.predict(X)
+    # sin FastEncoder el preprocesamiento del Pipeline queda dentro de inference
+    with stage("encoding"):
+        frame = samples_to_frame(samples)
+    with stage("inference"):
+        return model.predict(frame)
@@ -0,0 +1,441 @@
+import json
+import multiprocessing
+import os
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import duckdb
+from app.utils.config import METRICS_DB_PATH, JOBS_TRACE_MEMORY, JOBS_HISTORY_SIZE
+from app.utils.task_pool import submit_task
+from app.utils.db import connection, run_async
+from app.utils.log_config import logger
+
+'''
+JOBS: seguimiento de ingesta / entrenamiento / pipeline completo.
+Cada ejecución tiene un job_id. El estado vive en un dict compartido (multiprocessing.Manager)
+que el proceso del pool actualiza etapa por etapa (tiempo de pared y pico de RSS de la etapa).
+La cancelación es cooperativa: se pide con un Event compartido y el job la respeta al
+entrar a cada etapa (y entre iteraciones del GradientBoosting).
+Al terminar, el proceso de la API guarda el historial en la DB de experimentos (tabla jobs).
+Los endpoints leen el historial con get_job_async / list_jobs_async (DuckDB fuera del event loop).
+'''
+
+# etapas esperadas de cada tipo de job (para el progreso)
+JOB_STAGES = {
+    "ingest": ["download", "duckdb_load"],
+    "train": ["profile", "clean", "duckdb_load", "preprocess", "fit_rf", "fit_gb", "evaluate", "comparables", "save"],
+    "train_ooc": ["profile", "clean", "preprocess", "fit_rf", "evaluate", "save"],
+    "train_segments": ["profile", "clean", "preprocess", "fit_segments", "save"],
+}
+JOB_STAGES["pipeline"] = JOB_STAGES["ingest"] + JOB_STAGES["train"]
+
+class JobCancelled(Exception):
+    """El job recibió un pedido de cancelación."""
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class JobContext:
+    """
+    Lo recibe la función del pipeline (en el proceso hijo) para reportar etapas
+    y consultar si se pidió la cancelación. Es picklable: state y cancel_event son proxies.
+    """
+
+    def __init__(self, job_id: str | None, kind: str, state, cancel_event):
+        self.job_id = job_id
+        self.kind = kind
+        self._state = state
+        self._cancel = cancel_event
+
+    @classmethod
+    def local(cls, kind: str):
+        """Contexto sin Manager, para correr un pipeline como script."""
+        return cls(None, kind, _new_state(None, kind), threading.Event())
+
+    def mark_running(self):
+        self._state.update(status="running", started_at=_now(), pid=os.getpid())
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise JobCancelled(f"Job {self.job_id} cancelado.")
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Mide una etapa: tiempo de pared, pico de RSS de la etapa y, con JOBS_TRACE_MEMORY,
+        pico de memoria Python (tracemalloc).
+        """
+        self.check_cancelled()
+        self._state["stage"] = name
+        if JOBS_TRACE_MEMORY:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        rss_reset = _reset_peak_rss()
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            yield
+        except JobCancelled:
+            status = "cancelled"
+            raise
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            peak = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else None
+            peak_rss = _peak_rss_mb() if rss_reset else None
+            record = {
+                "name": name,
+                "status": status,
+                "wall_s": round(time.perf_counter() - start, 3),
+                "peak_rss_mb": round(peak_rss, 1) if peak_rss is not None else None,
+                "python_peak_mb": round(peak / 1e6, 1) if peak is not None else None,
+            }
+            self._state["stages"] = list(self._state["stages"]) + [record]
+            self._state["stage"] = None
+            logger.info(f"Job {self.job_id} etapa '{name}': {record['wall_s']} s, pico RSS {record['peak_rss_mb']} MB ({status})")
+
+    def gb_monitor(self, i, estimator, local_vars):
+        """monitor de GradientBoostingRegressor.fit: corta el fit si se pidió cancelar."""
+        self.check_cancelled()
+        return False
+
+
+def _reset_peak_rss() -> bool:
+    """Reinicia el pico de RSS del proceso (VmHWM). False si el sistema no lo permite."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_mb() -> float | None:
+    """Pico de RSS del proceso desde el último _reset_peak_rss (VmHWM, en KB en /proc)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def run_job(fn, job: JobContext):
+    """Punto de entrada en el proceso del pool: marca el job como corriendo y ejecuta el pipeline."""
+    job.mark_running()
+    return fn(job=job)
+
+
+def _new_state(job_id, kind):
+    return {
+        "job_id": job_id,
+        "kind": kind,
+        "status": "queued",
+        "stage": None,
+        "stages": [],
+        "expected_stages": JOB_STAGES.get(kind, []),
+        "created_at": _now(),
+        "started_at": None,
+        "finished_at": None,
+        "cancel_requested": False,
+        "pid": None,
+        "result": None,
+        "error": None,
+    }
+
+
+# --- Registro de jobs (proceso de la API) ---
+
+_manager = None
+_lock = threading.Lock()
+# job_id -> [state proxy, cancel event, future] de los jobs en curso
+_active = {}
+# últimos jobs terminados (copia en memoria del historial)
+_finished = OrderedDict()
+
+
+def _get_manager():
+    global _manager
+    if _manager is None:
+        _manager = multiprocessing.get_context("spawn").Manager()
+    return _manager
+
+
+def start_job(kind: str, fn, on_done=None) -> str:
+    """
+    Crea el job y envía fn(job=...) al pool de procesos. Devuelve el job_id.
+    Propaga TaskAlreadyRunning si ya hay otra tarea que usa los mismos recursos.
+    """
+    job_id = uuid.uuid4().hex[:12]
+    with _lock:
+        manager = _get_manager()
+        state = manager.dict(_new_state(job_id, kind))
+        cancel_event = manager.Event()
+        # [state, cancel_event, future]: el future se completa después del submit
+        _active[job_id] = [state, cancel_event, None]
+    job = JobContext(job_id, kind, state, cancel_event)
+    try:
+        future = submit_task(kind, run_job, fn, job, on_done=lambda result: _finish_job(job_id, result, on_done))
+    except Exception:
+        with _lock:
+            _active.pop(job_id, None)
+        raise
+    with _lock:
+        # el callback puede haber corrido ya si el job terminó muy rápido
+        if job_id in _active:
+            _active[job_id][2] = future
+    logger.info(f"Job {job_id} ({kind}) creado.")
+    return job_id
+
+
+def _finish_job(job_id: str, result: dict, on_done):
+    with _lock:
+        state, _, future = _active.pop(job_id, (None, None, None))
+    snapshot = _snapshot(state) if state is not None else _new_state(job_id, None)
+
+    status = result.get("status")
+    if future is not None and future.cancelled():
+        status = "cancelled"
+    snapshot["status"] = {"ok": "succeeded", "cancelled": "cancelled"}.get(status, "failed")
+    snapshot["finished_at"] = _now()
+    snapshot["stage"] = None
+    snapshot["result"] = result
+    if snapshot["status"] == "failed":
+        snapshot["error"] = result.get("message")
+
+    with _lock:
+        _finished[job_id] = snapshot
+        while len(_finished) > JOBS_HISTORY_SIZE:
+            _finished.popitem(last=False)
+    _persist(snapshot)
+    logger.info(f"Job {job_id} finalizado: {snapshot['status']}")
+
+    if on_done is not None and snapshot["status"] == "succeeded":
+        on_done(result)
+
+
+def _snapshot(state) -> dict:
+    try:
+        return dict(state)
+    except Exception as e:
+        # el Manager ya no responde (ej: apagado de la API)
+        logger.warning(f"No se pudo leer el estado del job: {e}")
+        return _new_state(None, None)
+
+
+def _with_progress(job: dict) -> dict:
+    expected = job.get("expected_stages") or []
+    done = [s["name"] for s in job.get("stages") or [] if s.get("status") == "ok"]
+    job["progress"] = round(len(done) / len(expected), 3) if expected else None
+    return job
+
+
+def _job_in_memory(job_id: str) -> dict | None:
+    with _lock:
+        active = _active.get(job_id)
+        finished = _finished.get(job_id)
+    if active is not None:
+        return _with_progress(_snapshot(active[0]))
+    if finished is not None:
+        return _with_progress(dict(finished))
+    return None
+
+
+def get_job(job_id: str) -> dict | None:
+    """Estado de un job: en curso, terminado en esta sesión o del historial en DuckDB."""
+    job = _job_in_memory(job_id)
+    if job is not None:
+        return job
+    rows = _load_history(job_id=job_id)
+    return _with_progress(rows[0]) if rows else None
+
+
+async def get_job_async(job_id: str) -> dict | None:
+    """get_job para los endpoints: la consulta al historial corre fuera del event loop."""
+    job = _job_in_memory(job_id)
+    if job is not None:
+        return job
+    rows = await _load_history_async(job_id=job_id)
+    return _with_progress(rows[0]) if rows else None
+
+
+def list_jobs(limit: int = 20) -> list[dict]:
+    """Jobs en curso primero y después los más recientes del historial."""
+    return _merge_jobs(_load_history(limit=limit), limit)
+
+
+async def list_jobs_async(limit: int = 20) -> list[dict]:
+    """list_jobs para los endpoints: la consulta al historial corre fuera del event loop."""
+    return _merge_jobs(await _load_history_async(limit=limit), limit)
+
+
+def _merge_jobs(history: list[dict], limit: int) -> list[dict]:
+    with _lock:
+        active = [state for state, _, _ in _active.values()]
+    jobs = [_snapshot(state) for state in active]
+    seen = {j["job_id"] for j in jobs}
+    for job in history:
+        if job["job_id"] not in seen:
+            jobs.append(job)
+            seen.add(job["job_id"])
+    with _lock:
+        for job in reversed(_finished.values()):
+            if job["job_id"] not in seen:
+                jobs.append(dict(job))
+    jobs.sort(key=lambda j: j.get("created_at") or "", reverse=True)
+    return [_with_progress(j) for j in jobs[:limit]]
+
+
+def cancel_job(job_id: str) -> str | None:
+    """
+    Pide la cancelación. Devuelve el estado resultante, o None si el job no existe.
+    Un job todavía en cola se cancela de inmediato; uno corriendo se detiene en la próxima etapa.
+    """
+    with _lock:
+        active = _active.get(job_id)
+    if active is None:
+        job = get_job(job_id)
+        return job["status"] if job is not None else None
+
+    state, cancel_event, future = active
+    cancel_event.set()
+    state["cancel_requested"] = True
+    if future is not None and future.cancel():
+        return "cancelled"
+    return "cancelling"
+
+
+def shutdown_jobs():
+    global _manager
+    with _lock:
+        if _manager is not None:
+            _manager.shutdown()
+            _manager = None
+
+
+# --- Historial en la DB de experimentos ---
+
+@contextmanager
+def _connection():
+    """Cursor del pool de METRICS_DB_PATH con la tabla jobs creada."""
+    with connection(METRICS_DB_PATH) as con:
+        _ensure_jobs_table(con)
+        yield con
+
+
+def _ensure_jobs_table(con):
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS jobs (
+        job_id TEXT PRIMARY KEY,
+        kind TEXT,
+        status TEXT,
+        created_at TIMESTAMP,
+        started_at TIMESTAMP,
+        finished_at TIMESTAMP,
+        duration_s DOUBLE,
+        stages_json TEXT,
+        result_json TEXT,
+        error TEXT
+    )""")
+
+
+def _to_db_ts(value: str | None):
+    """ISO con zona -> datetime UTC sin zona (columna TIMESTAMP)."""
+    if not value:
+        return None
+    return datetime.fromisoformat(value).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _from_db_ts(value) -> str | None:
+    return value.replace(tzinfo=timezone.utc).isoformat() if value else None
+
+
+def _persist(job: dict, retries: int = 5):
+    """Guarda el job en la tabla jobs. Reintenta si otro proceso tiene tomada la DB."""
+    started = job.get("started_at")
+    duration = None
+    if started and job.get("finished_at"):
+        duration = (datetime.fromisoformat(job["finished_at"]) - datetime.fromisoformat(started)).total_seconds()
+    row = [
+        job["job_id"], job.get("kind"), job["status"],
+        _to_db_ts(job.get("created_at")), _to_db_ts(started), _to_db_ts(job.get("finished_at")), duration,
+        json.dumps(job.get("stages") or []),
+        json.dumps(job.get("result"), default=str),
+        job.get("error"),
+    ]
+    for attempt in range(retries):
+        try:
+            with _connection() as con:
+                con.execute("INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+            return
+        except duckdb.Error as e:
+            if attempt == retries - 1:
+                logger.error(f"No se pudo guardar el job {job['job_id']} en {METRICS_DB_PATH}: {e}")
+            else:
+                time.sleep(0.5 * (attempt + 1))
+
+
+def _load_history(job_id: str | None = None, limit: int = 20) -> list[dict]:
+    if not os.path.exists(METRICS_DB_PATH):
+        return []
+    try:
+        with connection(METRICS_DB_PATH) as con:
+            return _query_history(con, job_id, limit)
+    except duckdb.Error as e:
+        logger.warning(f"No se pudo leer el historial de jobs: {e}")
+        return []
+
+
+async def _load_history_async(job_id: str | None = None, limit: int = 20) -> list[dict]:
+    if not os.path.exists(METRICS_DB_PATH):
+        return []
+    try:
+        return await run_async(METRICS_DB_PATH, _query_history, job_id, limit)
+    except duckdb.Error as e:
+        logger.warning(f"No se pudo leer el historial de jobs: {e}")
+        return []
+
+
+def _query_history(con, job_id: str | None, limit: int) -> list[dict]:
+    _ensure_jobs_table(con)
+    query = "SELECT * FROM jobs"
+    params = []
+    if job_id is not None:
+        query += " WHERE job_id = ?"
+        params.append(job_id)
+    query += " ORDER BY created_at DESC LIMIT ?"
+    params.append(limit)
+    cursor = con.execute(query, params)
+    columns = [c[0] for c in cursor.description]
+    rows = cursor.fetchall()
+
+    jobs = []
+    for row in rows:
+        record = dict(zip(columns, row))
+        kind = record["kind"]
+        jobs.append({
+            "job_id": record["job_id"],
+            "kind": kind,
+            "status": record["status"],
+            "stage": None,
+            "stages": json.loads(record["stages_json"] or "[]"),
+            "expected_stages": JOB_STAGES.get(kind, []),
+            "created_at": _from_db_ts(record["created_at"]),
+            "started_at": _from_db_ts(record["started_at"]),
+            "finished_at": _from_db_ts(record["finished_at"]),
+            "cancel_requested": record["status"] == "cancelled",
+            "pid": None,
+            "result": json.loads(record["result_json"]) if record["result_json"] else None,
+            "error": record["error"],
+        })
+    return jobs
@@ -0,0 +1,347 @@
+import bisect
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from contextvars import ContextVar
+from app.utils.config import METRICS_ENABLED, METRICS_BUCKETS
+
+'''
+MÉTRICAS EN FORMATO PROMETHEUS (GET /metrics, sin clientes externos)
+- Histogram / Counter: cada hilo suma en su propia lista (threading.local), sin lock en el camino
+  del request; el scrape suma las listas de todos los hilos.
+- Gauges: se calculan al momento del scrape con un collector (register_collector), ej. la versión
+  y el tiempo de carga del modelo activo (model_loader).
+- MetricsMiddleware (ASGI): duración, status y errores por ruta (la plantilla, ej. /v1/jobs/{job_id}).
+- Etapas de /v1/predict: validation (desde que llega el request hasta que corre el endpoint),
+  encoding, inference y serialization (desde el fin del endpoint hasta el inicio de la respuesta).
+'''
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# etiqueta de ruta de lo que se mide fuera de un request (ej. el hilo del micro-batcher)
+NO_ROUTE = "background"
+
+
+class _Shards:
+    """Contadores por hilo: cada hilo escribe solo su lista; la lectura suma todas."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._local = threading.local()
+        self._all = []
+        self._lock = threading.Lock()
+
+    def mine(self) -> list:
+        values = getattr(self._local, "values", None)
+        if values is None:
+            values = self._local.values = [0] * self.size
+            with self._lock:
+                self._all.append(values)
+        return values
+
+    def total(self) -> list:
+        with self._lock:
+            shards = list(self._all)
+        totals = [0] * self.size
+        for values in shards:
+            for i, value in enumerate(values):
+                totals[i] += value
+        return totals
+
+
+class _CounterChild:
+    def __init__(self):
+        self._shards = _Shards(1)
+
+    def inc(self, amount: float = 1):
+        self._shards.mine()[0] += amount
+
+    def value(self):
+        return self._shards.total()[0]
+
+
+class _HistogramChild:
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        # una posición por bucket, +Inf y la suma
+        self._shards = _Shards(len(buckets) + 2)
+
+    def observe(self, value: float):
+        values = self._shards.mine()
+        values[bisect.bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+    def snapshot(self):
+        """(conteos acumulados por bucket incluyendo +Inf, suma)."""
+        totals = self._shards.total()
+        cumulative, running = [], 0
+        for count in totals[:-1]:
+            running += count
+            cumulative.append(running)
+        return cumulative, totals[-1]
+
+
+def _quantile(buckets: tuple, cumulative: list, q: float) -> float | None:
+    """Estimación por interpolación lineal dentro del bucket (como histogram_quantile de Prometheus)."""
+    total = cumulative[-1]
+    if total == 0:
+        return None
+    rank = q * total
+    i = bisect.bisect_left(cumulative, rank)
+    if i >= len(buckets):
+        return buckets[-1]
+    lower = buckets[i - 1] if i > 0 else 0.0
+    below = cumulative[i - 1] if i > 0 else 0
+    in_bucket = cumulative[i] - below
+    return lower + (buckets[i] - lower) * ((rank - below) / in_bucket if in_bucket else 0)
+
+
+class _Metric(ABC):
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    @abstractmethod
+    def _new_child(self):
+        """Hijo nuevo para una combinación de labels."""
+
+    def labels(self, *values):
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} espera los labels {self.labelnames}, recibió {key}")
+            with self._lock:
+                child = self._children.get(key)
+                if child is None:
+                    child = self._children[key] = self._new_child()
+        return child
+
+    def children(self) -> list:
+        with self._lock:
+            return list(self._children.items())
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=METRICS_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in (*zip(names, values), *extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value) -> str:
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        if value.is_integer() and abs(value) < 1e15:
+            return str(int(value))
+    return repr(value)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def register_collector(self, collect):
+        """collect() -> [(nombre, tipo, ayuda, [(labels dict, valor), ...])], se llama en cada scrape."""
+        with self._lock:
+            self._collectors.append(collect)
+
+    def render(self) -> str:
+        """Todas las métricas en el formato de texto 0.0.4 de Prometheus."""
+        with self._lock:
+            metrics, collectors = list(self._metrics), list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for key, child in metric.children():
+                if metric.kind != "histogram":
+                    lines.append(f"{metric.name}{_labels(metric.labelnames, key)} {_number(child.value())}")
+                    continue
+                cumulative, total = child.snapshot()
+                for bound, count in zip((*metric.buckets, math.inf), cumulative):
+                    le = (("le", _number(float(bound))),)
+                    lines.append(f"{metric.name}_bucket{_labels(metric.labelnames, key, le)} {count}")
+                lines.append(f"{metric.name}_sum{_labels(metric.labelnames, key)} {_number(float(total))}")
+                lines.append(f"{metric.name}_count{_labels(metric.labelnames, key)} {cumulative[-1]}")
+        for collect in collectors:
+            for name, kind, documentation, samples in collect():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(labels.keys(), labels.values())} {_number(float(value))}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_LATENCY = Histogram(
+    "calcular_http_request_duration_seconds", "Duración de los requests HTTP por ruta.",
+    ("method", "route", "status"),
+)
+REQUEST_ERRORS = Counter(
+    "calcular_http_errors_total", "Respuestas con status >= 400 (422 = validación o predicción inválida).",
+    ("method", "route", "status"),
+)
+PREDICT_STAGE_LATENCY = Histogram(
+    "calcular_predict_stage_duration_seconds",
+    "Duración de cada etapa de /v1/predict (validation, encoding, inference, serialization).",
+    ("route", "stage"),
+)
+PREDICTION_FAILURES = Counter(
+    "calcular_prediction_failures_total", "Predicciones que fallaron dentro del modelo (respondidas con 422).",
+    ("route",),
+)
+PREDICTIONS_OUT_OF_RANGE = Counter(
+    "calcular_predictions_out_of_range_total", "Predicciones descartadas por el chequeo de rango.",
+    ("route",),
+)
+MODEL_LOADS = Counter(
+    "calcular_model_loads_total", "Cargas del modelo (inicio y recargas) por resultado.", ("result",),
+)
+
+register_collector = REGISTRY.register_collector
+
+
+# --- Medición por request ---
+
+# estado del request en curso (lo crea MetricsMiddleware; los endpoints sync lo ven desde el threadpool)
+_request = ContextVar("metrics_request", default=None)
+
+
+def route_label(scope: dict) -> str:
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+def _current_route() -> str:
+    state = _request.get()
+    return route_label(state["scope"]) if state is not None else NO_ROUTE
+
+
+def mark_handler_start():
+    """Al entrar al endpoint: cierra la etapa validation (lectura del body + validación de Pydantic)."""
+    state = _request.get()
+    if state is None:
+        return
+    PREDICT_STAGE_LATENCY.labels(route_label(state["scope"]), "validation").observe(
+        time.perf_counter() - state["start"]
+    )
+
+
+def mark_handler_end():
+    """Al terminar el endpoint: desde acá hasta el inicio de la respuesta es la etapa serialization."""
+    state = _request.get()
+    if state is not None:
+        state["handler_end"] = time.perf_counter()
+
+
+@contextmanager
+def handler_span():
+    """
+    with handler_span(): cuerpo del endpoint. Marca el inicio y el fin aunque el endpoint
+    termine en HTTPException (422 / 409 / 503): la serialización del error también se mide.
+    """
+    mark_handler_start()
+    try:
+        yield
+    finally:
+        mark_handler_end()
+
+
+@contextmanager
+def stage(name: str):
+    """with stage("encoding"): ... suma la duración al histograma de etapas de la ruta en curso."""
+    if not METRICS_ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        PREDICT_STAGE_LATENCY.labels(_current_route(), name).observe(time.perf_counter() - start)
+
+
+def route_summary(method: str, route: str) -> dict:
+    """Resumen de latencia de una ruta en ms (para /v1/health/): cantidad, promedio y p50 / p95 / p99."""
+    cumulative, total = [0] * (len(REQUEST_LATENCY.buckets) + 1), 0.0
+    for (m, r, status), child in REQUEST_LATENCY.children():
+        if m == method and r == route and status.startswith("2"):
+            counts, child_total = child.snapshot()
+            cumulative = [a + b for a, b in zip(cumulative, counts)]
+            total += child_total
+    count = cumulative[-1]
+    if not count:
+        return {"count": 0, "avg_ms": None, "p50_ms": None, "p95_ms": None, "p99_ms": None}
+    summary = {"count": count, "avg_ms": round(total / count * 1000, 3)}
+    for q in (0.5, 0.95, 0.99):
+        summary[f"p{round(q * 100)}_ms"] = round(_quantile(REQUEST_LATENCY.buckets, cumulative, q) * 1000, 3)
+    return summary
+
+
+class MetricsMiddleware:
+    """Middleware ASGI: duración y status de cada request, con la ruta resuelta por el router."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        state = {"scope": scope, "start": time.perf_counter(), "status": 500}
+        token = _request.set(state)
+
+        async def send_with_metrics(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                handler_end = state.get("handler_end")
+                if handler_end is not None:
+                    PREDICT_STAGE_LATENCY.labels(route_label(scope), "serialization").observe(
+                        time.perf_counter() - handler_end
+                    )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            _request.reset(token)
+            labels = (scope["method"], route_label(scope), state["status"])
+            REQUEST_LATENCY.labels(*labels).observe(time.perf_counter() - state["start"])
+            if state["status"] >= 400:
+                REQUEST_ERRORS.labels(*labels).inc()
@@ -0,0 +1,151 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+from app.utils.config import MICRO_BATCH_MAX_WAIT_MS, MICRO_BATCH_MAX_SIZE, MICRO_BATCH_TIMEOUT_S
+from app.utils.inference import predict_samples
+from app.utils.log_config import logger
+
+'''
+MICRO-BATCHING: junta las predicciones individuales que llegan dentro de una
+ventana (max_wait_ms / max_batch_size) y las resuelve con un solo predict vectorizado.
+Cada request espera su Future y recibe solo su fila. Las filas se predicen con la
+versión del modelo que tomó cada request: si una recarga cae en medio de la ventana,
+el lote se parte por versión.
+Si la fila no vuelve en MICRO_BATCH_TIMEOUT_S (hilo caído o colgado), submit lanza BatcherTimeout.
+'''
+
+# ventana de las métricas de stats() (tamaños de lote y esperas en la cola)
+METRICS_WINDOW = 500
+
+
+class BatcherTimeout(Exception):
+    """La fila no se resolvió a tiempo (el endpoint responde 503)."""
+
+
+class MicroBatcher:
+    def __init__(self, predict_fn, max_wait_ms: float, max_batch_size: int, timeout_s: float = MICRO_BATCH_TIMEOUT_S):
+        self.predict_fn = predict_fn
+        self.max_wait_s = max_wait_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.timeout_s = timeout_s
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        # métricas para ajustar la ventana
+        self.batches = 0
+        self.batch_sizes = deque(maxlen=METRICS_WINDOW)
+        self.queue_waits_ms = deque(maxlen=METRICS_WINDOW)
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+                self._thread.start()
+                logger.info(
+                    f"Micro-batcher iniciado (max_wait={self.max_wait_s * 1000:.1f} ms, max_batch={self.max_batch_size})"
+                )
+
+    def submit(self, sample, version=None):
+        """
+        Encola un Sample y bloquea hasta que su lote se procese. Devuelve la predicción de esa fila.
+        version: versión del modelo tomada por el request (None = la activa al procesar el lote).
+        """
+        self._ensure_started()
+        future = Future()
+        self._queue.put((sample, version, time.perf_counter(), future))
+        try:
+            return future.result(timeout=self.timeout_s)
+        except TimeoutError:
+            # si todavía no la tomó el hilo, la fila se descarta del lote
+            future.cancel()
+            alive = self._thread is not None and self._thread.is_alive()
+            logger.error(f"Micro-batcher sin respuesta en {self.timeout_s:.1f} s (hilo vivo: {alive}).")
+            raise BatcherTimeout(f"El micro-batcher no respondió en {self.timeout_s:.1f} s.")
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            batch = [first]
+            # la ventana se abre con la primera fila del lote
+            deadline = first[2] + self.max_wait_s
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                try:
+                    # vencida la ventana, igual se suman las filas que ya estaban en cola
+                    item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(item)
+            self._process(batch)
+
+    def _process(self, batch):
+        # se descartan las filas cuyo request ya se fue por timeout
+        batch = [item for item in batch if item[3].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        started = time.perf_counter()
+        self.batches += 1
+        self.batch_sizes.append(len(batch))
+        for _, _, enqueued_at, _ in batch:
+            self.queue_waits_ms.append((started - enqueued_at) * 1000)
+
+        by_version = {}
+        for sample, version, _, future in batch:
+            by_version.setdefault(id(version), (version, []))[1].append((sample, future))
+        for version, items in by_version.values():
+            self._predict_group(version, items)
+
+    def _predict_group(self, version, items):
+        samples = [sample for sample, _ in items]
+        try:
+            predictions = self.predict_fn(samples, version)
+            for (_, future), prediction in zip(items, predictions):
+                future.set_result(prediction)
+        except Exception as e:
+            if len(items) == 1:
+                items[0][1].set_exception(e)
+                return
+            # si falla el lote, se reintenta fila por fila para que una fila mala no tire al resto
+            logger.warning(f"Micro-batch de {len(items)} filas falló ({e}). Reintentando fila por fila.")
+            for sample, future in items:
+                try:
+                    future.set_result(self.predict_fn([sample], version)[0])
+                except Exception as row_error:
+                    future.set_exception(row_error)
+
+    def stats(self):
+        """Métricas de tamaño de lote y espera en cola sobre la ventana reciente."""
+        sizes = list(self.batch_sizes)
+        waits = list(self.queue_waits_ms)
+        return {
+            "enabled": True,
+            "batches": self.batches,
+            "avg_batch_size": float(np.mean(sizes)) if sizes else None,
+            "max_batch_size": int(max(sizes)) if sizes else None,
+            "avg_queue_wait_ms": float(np.mean(waits)) if waits else None,
+            "p99_queue_wait_ms": float(np.percentile(waits, 99)) if waits else None,
+        }
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+def get_batcher():
+    """Devuelve el micro-batcher del proceso (lo crea la primera vez)."""
+    global _batcher
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                _batcher = MicroBatcher(
+                    predict_fn=predict_samples,
+                    max_wait_ms=MICRO_BATCH_MAX_WAIT_MS,
+                    max_batch_size=MICRO_BATCH_MAX_SIZE,
+                )
+    return _batcher
@@ -1,36 +1,493 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
 import joblib
-from app.utils.config import MODEL_PATH
+import numpy as np
+from app.models.schemas import Sample
+from app.utils.config import (
+    MODEL_PATH, MODEL_LEGACY_PATH, MANIFEST_PATH, MODEL_FORMAT, MODEL_FLAT_DIR, MODEL_LEGACY_FLAT_DIR, FAST_ENCODER_ENABLED,
+    INFERENCE_ENGINE, NATIVE_MAX_ROWS, MODEL_WARMUP_ROWS,
+    SEGMENT_MODELS_ENABLED, SEGMENT_CACHE_SIZE, SEGMENTS_INDEX_PATH, COMPARABLES_ENABLED, COMPARABLES_INDEX_PATH,
+    PREDICTION_INTERVALS_ENABLED,
+)
+from sklearn.pipeline import Pipeline
+from app.utils.flat_forest import load_flat_forest, to_native, probe_matrix, forest_for_intervals
+from app.utils.encoding import build_fast_encoder, verify_parity, samples_to_frame, _probe_samples
+from app.utils.prediction_cache import invalidate_prediction_cache
+from app.utils.metrics import MODEL_LOADS, register_collector
 from app.utils.log_config import logger
 
-# Variable global para mantener el modelo en caché
-_model = None
+'''
+REGISTRO DE VERSIONES DEL MODELO
+Cada carga arma una ModelVersion nueva (modelo + codificador), la precalienta con
+predicciones de prueba (si el precalentamiento falla se activa igual) y recién ahí
+reemplaza la referencia activa (asignación atómica).
+Los requests toman la versión una sola vez al empezar y la usan hasta terminar,
+así una recarga nunca cambia el modelo a mitad de una predicción.
+'''
+
+class ModelVersion:
+    """Versión cargada e inmutable del modelo. Una recarga crea otra instancia."""
+
+    def __init__(
+        self, version_id: int, model, encoder, source: str, load_ms: float, segments=None, comparables=None,
+        interval=None,
+    ):
+        self.version_id = version_id
+        self.model = model
+        # codificador compilado (None si se debe usar el Pipeline)
+        self.encoder = encoder
+        self.source = source
+        self.load_ms = load_ms
+        self.loaded_at = datetime.now(timezone.utc).isoformat()
+        # modelos por segmento de esta versión (None si no hay índice de segmentos)
+        self.segments = segments
+        # índice de comparables del entrenamiento (None si no hay)
+        self.comparables = comparables
+        # RandomForest nativo para ?interval=true (None si no hay)
+        self.interval = interval
+
+    def info(self):
+        return {
+            "version": self.version_id,
+            "source": self.source,
+            "loaded_at": self.loaded_at,
+            "load_ms": round(self.load_ms, 1),
+            "segments": self.segments.stats() if self.segments is not None else None,
+            "comparables": self.comparables.stats() if self.comparables is not None else None,
+            "interval": self.interval.info() if self.interval is not None else None,
+        }
+
+
+class IntervalModel:
+    """
+    RandomForest (motor nativo) que da las bandas de predicción.
+    same_pass: es el mismo modelo que la predicción puntual, y las dos salen del mismo recorrido.
+    """
+
+    def __init__(self, model, encoder, forest, same_pass: bool, source: str):
+        self.model = model
+        self.encoder = encoder
+        self.forest = forest
+        self.same_pass = same_pass
+        self.source = source
+
+    def encode(self, samples: list[Sample]) -> np.ndarray:
+        if self.encoder is not None:
+            return self.encoder.encode(samples)
+        return self.model[:-1].transform(samples_to_frame(samples))
+
+    def info(self):
+        return {"source": self.source, "same_pass": self.same_pass, "n_trees": self.forest.n_trees}
+
+
+class SegmentModel:
+    """Modelo de un segmento ya cargado (Pipeline o formato plano + codificador compilado)."""
+
+    def __init__(self, model, encoder, source: str, interval=None):
+        self.model = model
+        self.encoder = encoder
+        self.source = source
+        self.interval = interval
+
+
+class SegmentModels:
+    """
+    Modelos por segmento de una versión (índice de SEGMENTS_INDEX_PATH).
+    Cada modelo se lee del disco al primer Sample de su segmento y queda en un LRU de max_models:
+    con muchos segmentos solo los más usados ocupan memoria. Si un modelo no se puede cargar,
+    su segmento pasa a servirse con el modelo promovido.
+    """
+
+    def __init__(self, index: dict, max_models: int):
+        self.segment_by = list(index["segment_by"])
+        self._entries = {tuple(e["key"][c] for c in self.segment_by): e for e in index["segments"]}
+        self.max_models = max(1, max_models)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        # un lock por segmento: dos requests del mismo segmento no lo cargan dos veces
+        self._loading = {}
+        self._failed = set()
+        self.loads = 0
+        self.evictions = 0
+
+    def key(self, sample) -> tuple:
+        return tuple(getattr(sample, c) for c in self.segment_by)
+
+    def get(self, key: tuple) -> SegmentModel | None:
+        """Modelo del segmento (lo carga si hace falta); None si el segmento no tiene modelo."""
+        entry = self._entries.get(key)
+        if entry is None or key in self._failed:
+            return None
+        with self._lock:
+            loaded = self._cache.get(key)
+            if loaded is not None:
+                self._cache.move_to_end(key)
+                return loaded
+            key_lock = self._loading.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                loaded = self._cache.get(key)
+            if loaded is not None:
+                return loaded
+            try:
+                start = time.perf_counter()
+                loaded = _load_segment(entry)
+                logger.info(f"Modelo del segmento {key} cargado en {(time.perf_counter() - start) * 1000:.0f} ms")
+            except Exception as e:
+                logger.error(f"No se pudo cargar el modelo del segmento {key}: {e}. Se usa el modelo promovido.")
+                self._failed.add(key)
+                return None
+            with self._lock:
+                self._cache[key] = loaded
+                self.loads += 1
+                while len(self._cache) > self.max_models:
+                    evicted, _ = self._cache.popitem(last=False)
+                    self.evictions += 1
+                    logger.info(f"Modelo del segmento {evicted} liberado (LRU de {self.max_models}).")
+            return loaded
+
+    def stats(self):
+        with self._lock:
+            loaded = [list(k) for k in self._cache]
+        return {
+            "segment_by": self.segment_by,
+            "available": len(self._entries),
+            "loaded": loaded,
+            "max_loaded": self.max_models,
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "failed": [list(k) for k in self._failed],
+        }
+
+
+def _load_segment(entry: dict) -> SegmentModel:
+    """Lee el modelo de un segmento con el mismo criterio que el modelo promovido (MODEL_FORMAT)."""
+    flat_dir = entry.get("flat_path")
+    if MODEL_FORMAT == "flat" and flat_dir and os.path.isdir(flat_dir):
+        model, source = load_flat_forest(flat_dir, mmap=True), flat_dir
+    else:
+        model, source = _select_engine(joblib.load(entry["path"])), entry["path"]
+    encoder = _compile_encoder(model)
+    return SegmentModel(model, encoder, source, _build_interval(model, encoder, source, fallback=False))
+
+
+def _promotion_id() -> str | None:
+    """promotion_id del modelo promovido (manifest.json de trainer.py)."""
+    if not os.path.exists(MANIFEST_PATH):
+        return None
+    with open(MANIFEST_PATH, "r") as f:
+        return json.load(f).get("promoted", {}).get("promotion_id")
+
+
+def _read_segments() -> SegmentModels | None:
+    """
+    Índice de modelos por segmento (None si no hay, están desactivados o el índice es de
+    una promoción anterior: después de un entrenamiento normal los segmentos viejos no se usan).
+    """
+    if not SEGMENT_MODELS_ENABLED or not os.path.exists(SEGMENTS_INDEX_PATH):
+        return None
+    with open(SEGMENTS_INDEX_PATH, "r") as f:
+        index = json.load(f)
+    if not index.get("segments"):
+        return None
+    promotion_id = _promotion_id()
+    if index.get("promotion_id") != promotion_id:
+        logger.info(
+            f"Índice de segmentos de otra promoción ({index.get('promotion_id')} != {promotion_id}): "
+            "se sirve solo el modelo promovido."
+        )
+        return None
+    logger.info(f"Modelos por segmento ({' x '.join(index['segment_by'])}): {len(index['segments'])} disponibles.")
+    return SegmentModels(index, SEGMENT_CACHE_SIZE)
+
+
+def _read_comparables():
+    """Índice de comparables del último entrenamiento (None si no hay o están desactivados)."""
+    if not COMPARABLES_ENABLED or not os.path.exists(COMPARABLES_INDEX_PATH):
+        return None
+    index = joblib.load(COMPARABLES_INDEX_PATH)
+    logger.info(f"Índice de comparables: {index.n_indexed_} avisos en {len(index.groups_)} grupos.")
+    return index
+
+
+# Versión activa (None si no hay modelo cargado)
+_active: ModelVersion | None = None
+_version_counter = 0
+# serializa las cargas; los requests no lo toman, leen _active directamente
+_load_lock = threading.Lock()
+# recarga en segundo plano: una sola a la vez
+_reload_lock = threading.Lock()
+_reload_state = {"status": "idle", "error": None, "started_at": None, "finished_at": None}
+
+def _compile_encoder(model):
+    """
+    Compila el camino rápido de inferencia y lo valida bit a bit contra el Pipeline.
+    Si la estructura no es soportada o la validación falla, se sigue usando el Pipeline.
+    """
+    if not FAST_ENCODER_ENABLED:
+        return None
+    try:
+        encoder = build_fast_encoder(model)
+        if encoder is None:
+            logger.info("FastEncoder no disponible para este modelo. Se usa el Pipeline completo.")
+            return None
+        if not verify_parity(model, encoder):
+            logger.warning("FastEncoder no coincide con el Pipeline. Se desactiva el camino rápido.")
+            return None
+        logger.info(f"FastEncoder compilado ({encoder.n_features} features).")
+        return encoder
+    except Exception as e:
+        logger.warning(f"No se pudo compilar el FastEncoder: {e}")
+        return None
+
+def _read_model():
+    """
+    Lee el artefacto según MODEL_FORMAT. El formato plano se abre con mmap de solo lectura.
+    Si todavía no hay modelo promovido se usan los artefactos del RandomForest.
+    Devuelve (modelo, ruta de origen).
+    """
+    if MODEL_FORMAT == "flat":
+        # el plano del RandomForest solo si todavía no hay modelo promovido (un promovido sin plano se sirve del .joblib)
+        promoted = os.path.isdir(MODEL_FLAT_DIR) or os.path.exists(MODEL_PATH)
+        flat_dir = MODEL_FLAT_DIR if promoted else MODEL_LEGACY_FLAT_DIR
+        if os.path.isdir(flat_dir):
+            logger.info(f"Cargando modelo (formato plano, mmap) desde: {flat_dir}...")
+            return load_flat_forest(flat_dir, mmap=True), flat_dir
+        logger.warning(f"No existe {MODEL_FLAT_DIR}. Se usa el .joblib.")
+    path = MODEL_PATH if os.path.exists(MODEL_PATH) else MODEL_LEGACY_PATH
+    logger.info(f"Cargando modelo desde: {path}...")
+    return _select_engine(joblib.load(path)), path
+
+def _select_engine(model):
+    """
+    Aplica INFERENCE_ENGINE al Pipeline de sklearn. Si el modelo no se puede aplanar
+    o el motor nativo no coincide con sklearn, se sigue sirviendo con sklearn.
+    """
+    if INFERENCE_ENGINE not in ("native", "auto"):
+        return model
+    try:
+        native = to_native(model, hybrid_max_rows=NATIVE_MAX_ROWS if INFERENCE_ENGINE == "auto" else None)
+        native_est = native.steps[-1][1]
+        # en "auto" se compara el motor nativo en sí: el híbrido mandaría la matriz entera a sklearn
+        engine = native_est.native if INFERENCE_ENGINE == "auto" else native_est
+        X = probe_matrix(engine)
+        if not np.allclose(engine.predict(X), model.steps[-1][1].predict(X), rtol=1e-9, atol=0):
+            logger.warning("El motor nativo no coincide con sklearn. Se usa sklearn.")
+            return model
+        if INFERENCE_ENGINE == "auto":
+            native_est.calibrate(X)
+        logger.info(f"Motor de inferencia: {INFERENCE_ENGINE} ({native_est!r})")
+        return native
+    except Exception as e:
+        logger.warning(f"Motor nativo no disponible ({e}). Se usa sklearn.")
+        return model
+
+def _build_interval(model, encoder, source: str, fallback: bool = True) -> IntervalModel | None:
+    """
+    Modelo de intervalos de una versión: el propio RandomForest servido (mismo recorrido) o,
+    si el servido no es un RandomForest y fallback=True, random_forest.joblib en motor nativo.
+    """
+    if not PREDICTION_INTERVALS_ENABLED:
+        return None
+    try:
+        served = model.steps[-1][1]
+        forest = forest_for_intervals(model)
+        if forest is not None:
+            same_pass = True
+            if forest is not served and getattr(served, "native", None) is not forest:
+                # copia nativa de un bosque de sklearn: tiene que dar la misma predicción puntual
+                X = probe_matrix(forest)
+                same_pass = np.allclose(forest.predict(X), served.predict(X), rtol=1e-9, atol=0)
+            if same_pass:
+                return IntervalModel(model, encoder, forest, True, source)
+            logger.warning("El bosque nativo no coincide con el modelo servido: las bandas van en un recorrido aparte.")
+            return IntervalModel(model, encoder, forest, False, source)
+        if not fallback or not os.path.exists(MODEL_LEGACY_PATH):
+            logger.info("Intervalos de predicción no disponibles: el modelo servido no es un RandomForest.")
+            return None
+        rf_model = joblib.load(MODEL_LEGACY_PATH)
+        forest = forest_for_intervals(rf_model)
+        if forest is None:
+            return None
+        # solo el preprocesamiento + el bosque nativo: los árboles de sklearn se liberan
+        rf_native = Pipeline([("preproc", rf_model.steps[0][1]), ("est", forest)])
+        del rf_model
+        return IntervalModel(rf_native, _compile_encoder(rf_native), forest, False, MODEL_LEGACY_PATH)
+    except Exception as e:
+        logger.warning(f"Intervalos de predicción no disponibles ({e}).")
+        return None
+
+def _warm_up_samples(model, encoder) -> list[Sample] | None:
+    """
+    Filas de prueba con valores del propio modelo (medianas, categorías vistas en el train):
+    las arma el codificador compilado o, si no hay, uno armado solo para leerlas.
+    None si la estructura del Pipeline no se puede leer.
+    """
+    probe = encoder or build_fast_encoder(model)
+    if probe is None:
+        return None
+    return _probe_samples(probe, n=MODEL_WARMUP_ROWS)
+
+def _warm_up(model, encoder):
+    """
+    Predicciones de prueba antes de activar la versión: fuerzan las asignaciones
+    perezosas (páginas del mmap, buffers de NumPy/sklearn) fuera del camino de los requests.
+    """
+    if MODEL_WARMUP_ROWS <= 0:
+        return
+    samples = _warm_up_samples(model, encoder)
+    if samples is None:
+        logger.info("No hay filas de prueba para este modelo. Se omite el precalentamiento.")
+        return
+    if encoder is not None:
+        encoder.predict(samples[:1])
+        encoder.predict(samples)
+    else:
+        model.predict(samples_to_frame(samples[:1]))
+        model.predict(samples_to_frame(samples))
+
+def _build_version() -> ModelVersion:
+    """Lee, compila y precalienta una versión nueva sin tocar la activa."""
+    global _version_counter
+    start = time.perf_counter()
+    model, source = _read_model()
+    encoder = _compile_encoder(model)
+    try:
+        _warm_up(model, encoder)
+    except Exception as e:
+        # el precalentamiento es solo una optimización: la versión se activa igual
+        logger.warning(f"Falló el precalentamiento del modelo ({e}). Se activa sin precalentar.")
+    try:
+        segments = _read_segments()
+    except Exception as e:
+        logger.warning(f"No se pudo leer el índice de segmentos ({e}). Se sirve solo el modelo promovido.")
+        segments = None
+    try:
+        comparables = _read_comparables()
+    except Exception as e:
+        logger.warning(f"No se pudo leer el índice de comparables ({e}). /v1/comparables no disponible.")
+        comparables = None
+    interval = _build_interval(model, encoder, source)
+    _version_counter += 1
+    return ModelVersion(
+        _version_counter, model, encoder, source, (time.perf_counter() - start) * 1000, segments, comparables,
+        interval,
+    )
 
 def load_model(force_reload: bool = False):
     """
-    Carga el modelo desde el archivo .joblib apuntado en config.py
+    Carga el modelo desde el artefacto apuntado en config.py (.joblib o formato plano)
     Si force_reload=True, vuelve a cargarlo del disco.
+    Si la carga falla y había una versión activa, esa versión se sigue sirviendo.
     """
-    global _model
-    
-    if _model is not None and not force_reload:
+    global _active
+
+    if _active is not None and not force_reload:
         logger.info("Retornando modelo desde caché.")
-        return _model
+        return _active.model
+
+    with _load_lock:
+        if _active is not None and not force_reload:
+            return _active.model
+        try:
+            version = _build_version()
+        except Exception as e:
+            MODEL_LOADS.labels("error").inc()
+            logger.error(f"Error cargando el modelo: {e}")
+            if _active is not None:
+                logger.warning(f"Se mantiene la versión activa {_active.version_id}.")
+            raise RuntimeError(f"Error cargando el modelo: {e}")
+
+        # swap atómico: los requests en curso conservan su referencia a la versión anterior
+        previous = _active
+        _active = version
+        MODEL_LOADS.labels("ok").inc()
+        # las predicciones cacheadas eran del modelo anterior
+        invalidate_prediction_cache()
+        logger.info(
+            f"Modelo cargado: versión {version.version_id} en {version.load_ms:.0f} ms"
+            + (f" (reemplaza a la versión {previous.version_id})" if previous else "")
+        )
+        return version.model
 
+def _reload_worker():
     try:
-        logger.info(f"Cargando modelo desde: {MODEL_PATH}...")
-        _model = joblib.load(MODEL_PATH)
-        logger.info("Modelo cargado")
-        return _model
+        load_model(force_reload=True)
+        _reload_state.update(status="ok", error=None)
     except Exception as e:
-        logger.error(f"Error cargando el modelo: {e}")
-        _model = None #  el modelo es None si falla la carga
-        raise RuntimeError(f"Error cargando el modelo: {e}")
+        _reload_state.update(status="error", error=str(e))
+    finally:
+        _reload_state["finished_at"] = datetime.now(timezone.utc).isoformat()
+        _reload_lock.release()
+
+def reload_model_async() -> bool:
+    """
+    Recarga el modelo en un hilo de fondo (carga + warm-up + swap).
+    Devuelve False si ya hay una recarga en curso.
+    """
+    if not _reload_lock.acquire(blocking=False):
+        return False
+    _reload_state.update(
+        status="running", error=None,
+        started_at=datetime.now(timezone.utc).isoformat(), finished_at=None,
+    )
+    threading.Thread(target=_reload_worker, name="model-reload", daemon=True).start()
+    return True
+
+def reload_after_training(result: dict):
+    """Callback del pool de tareas: si el entrenamiento terminó bien, recarga el modelo en segundo plano."""
+    if result.get("status") != "ok":
+        logger.warning(f"Entrenamiento sin éxito, no se recarga el modelo: {result.get('message')}")
+        return
+    if not reload_model_async():
+        logger.warning("Ya había una recarga del modelo en curso.")
+
+def reload_status():
+    """Estado de la última recarga en segundo plano."""
+    return dict(_reload_state)
+
+def get_active_version() -> ModelVersion | None:
+    """
+    Versión activa del modelo (la carga si todavía no hay ninguna).
+    Los endpoints la toman una vez por request y la usan hasta responder.
+    """
+    version = _active
+    if version is None:
+        load_model()
+        version = _active
+    return version
 
 def get_model():
     """
     Obtiene el modelo cargado (lo carga si no está en caché).
-    Esta es la función que deben usar los endpoints de predicción.
     """
-    if _model is None:
-        return load_model()
-    return _model
\ No newline at end of file
+    return get_active_version().model
+
+def _model_metrics():
+    """Gauges de /metrics de la versión activa (se leen en cada scrape, sin cargar el modelo)."""
+    version = _active
+    metrics = [("calcular_model_loaded", "gauge", "1 si hay un modelo cargado.", [({}, int(version is not None))])]
+    if version is None:
+        return metrics
+    estimator = type(version.model.steps[-1][1]).__name__
+    loaded_at = datetime.fromisoformat(version.loaded_at).timestamp()
+    return metrics + [
+        ("calcular_model_info", "gauge", "Versión activa del modelo (siempre 1; los datos van en los labels).",
+         [({"version": str(version.version_id), "source": version.source, "estimator": estimator}, 1)]),
+        ("calcular_model_version", "gauge", "Número de versión del modelo activo (cambia con cada recarga).",
+         [({}, version.version_id)]),
+        ("calcular_model_load_seconds", "gauge", "Tiempo de carga + compilación + warm-up de la versión activa.",
+         [({}, version.load_ms / 1000)]),
+        ("calcular_model_loaded_timestamp_seconds", "gauge", "Momento de carga de la versión activa (epoch).",
+         [({}, loaded_at)]),
+    ]
+
+register_collector(_model_metrics)
+
+def get_encoder():
+    """Codificador compilado del modelo en caché (None si se debe usar el Pipeline)."""
+    return get_active_version().encoder
@@ -0,0 +1,81 @@
+import threading
+import time
+from collections import OrderedDict
+from app.models.schemas import Sample
+from app.utils.config import PREDICTION_CACHE_MAX_ENTRIES, PREDICTION_CACHE_TTL_S
+
+'''
+CACHE DE PREDICCIONES: LRU acotado (y TTL opcional) con clave = features normalizadas del Sample.
+Guarda la predicción cruda del modelo (antes del chequeo de rango).
+model_loader lo vacía cada vez que se carga un modelo nuevo.
+'''
+
+def sample_key(sample: Sample) -> tuple:
+    """Clave canónica del Sample: pares (campo, valor) ordenados por nombre."""
+    return tuple(sorted(sample.model_dump().items()))
+
+
+class PredictionCache:
+    def __init__(self, max_entries: int, ttl_s: float | None = None):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # se incrementa en cada clear: evita guardar predicciones de un modelo ya reemplazado
+        self.generation = 0
+
+    def get(self, key):
+        """Devuelve la predicción cacheada o None (miss o entrada vencida)."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value, generation: int | None = None):
+        """Guarda una predicción. Si se pasa generation y el cache se vació desde entonces, se descarta."""
+        expires_at = time.monotonic() + self.ttl_s if self.ttl_s else None
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.generation += 1
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "enabled": True,
+            "size": len(self._data),
+            "max_entries": self.max_entries,
+            "ttl_s": self.ttl_s,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else None,
+        }
+
+
+# cache del proceso (None si está desactivado)
+PREDICTION_CACHE = (
+    PredictionCache(PREDICTION_CACHE_MAX_ENTRIES, PREDICTION_CACHE_TTL_S)
+    if PREDICTION_CACHE_MAX_ENTRIES > 0 else None
+)
+
+def invalidate_prediction_cache():
+    """Vacía el cache (se llama al cambiar el modelo)."""
+    if PREDICTION_CACHE is not None:
+        PREDICTION_CACHE.clear()
@@ -0,0 +1,158 @@
+import numpy as np
+from scipy.spatial import cKDTree
+from sklearn.base import BaseEstimator, TransformerMixin
+
+'''
+FEATURES ESPACIALES (lat/lon -> precio por m² del entorno)
+El RandomForest con lat/lon crudos gasta muchos splits en aproximar la ubicación. Este bloque
+le pasa el entorno ya resumido, a partir de un índice de los avisos del train:
+- geo_knn_ppm2: mediana del precio por m² de los k avisos más cercanos (KD-tree sobre la esfera unitaria:
+  la distancia de cuerda ordena igual que la del arco, que es la que se informa)
+- geo_knn_dist_km: distancia al k-ésimo vecino (densidad de avisos)
+- geo_cell_ppm2: media geométrica del precio por m² de la celda de la grilla (cell_deg grados);
+  con menos de min_cell_count avisos en la celda se usa geo_knn_ppm2
+fit_transform es leave-one-out (cada aviso del train no se ve a sí mismo, como TargetEncoder),
+transform usa el índice completo. Sin lat/lon se devuelven valores globales del train.
+El índice viaja dentro del Pipeline (.joblib / formato plano); el FastEncoder llama a lookup directo.
+'''
+
+EARTH_RADIUS_KM = 6371.0088
+GEO_COLUMNS = ["lat", "lon"]
+GEO_FEATURES = ["geo_knn_ppm2", "geo_knn_dist_km", "geo_cell_ppm2"]
+
+
+class SpatialFeatures(BaseEstimator, TransformerMixin):
+    """
+    Features de entorno a partir de [lat, lon].
+    fit(X, y): X = columnas lat, lon; y = precio por m² (las filas no finitas o <= 0 no entran al índice).
+    """
+
+    def __init__(self, k: int = 10, cell_deg: float = 0.005, min_cell_count: int = 5):
+        self.k = k
+        self.cell_deg = cell_deg
+        self.min_cell_count = min_cell_count
+
+    def fit(self, X, y):
+        self._fit_index(X, y)
+        return self
+
+    def fit_transform(self, X, y):
+        """Features leave-one-out del train (el propio aviso no cuenta para sus vecinos ni su celda)."""
+        keep = self._fit_index(X, y)
+        lat, lon = _coords(X)
+        out = self.lookup(lat, lon)
+        out[keep] = self._lookup_loo()
+        return out
+
+    def transform(self, X):
+        return self.lookup(*_coords(X))
+
+    def get_feature_names_out(self, input_features=None):
+        return np.asarray(GEO_FEATURES, dtype=object)
+
+    def _fit_index(self, X, y) -> np.ndarray:
+        lat, lon = _coords(X)
+        ppm2 = np.asarray(y, dtype=np.float64)
+        keep = np.isfinite(lat) & np.isfinite(lon) & np.isfinite(ppm2) & (ppm2 > 0)
+        if keep.sum() <= self.k:
+            raise ValueError(f"Muy pocos avisos con lat/lon y precio por m² para el índice espacial: {keep.sum()}")
+        self.n_indexed_ = int(keep.sum())
+        self.log_ppm2_ = np.log(ppm2[keep])
+        self.tree_ = cKDTree(_unit_xyz(lat[keep], lon[keep]))
+
+        # grilla: claves de celda ordenadas + suma y cantidad de log(precio/m²) por celda
+        cells = self._cell_keys(lat[keep], lon[keep])
+        self.cell_keys_, inverse, self.cell_counts_ = np.unique(cells, return_inverse=True, return_counts=True)
+        self.cell_sums_ = np.bincount(inverse, weights=self.log_ppm2_)
+        self._row_cell = inverse
+
+        # valores para filas sin coordenadas
+        dist, _ = self.tree_.query(self.tree_.data, k=self.k + 1)
+        self.fill_ = np.array([
+            np.exp(np.median(self.log_ppm2_)), float(np.median(_arc_km(dist[:, -1]))),
+            np.exp(np.mean(self.log_ppm2_)),
+        ])
+        return keep
+
+    def _cell_keys(self, lat, lon) -> np.ndarray:
+        iy = np.floor(lat / self.cell_deg).astype(np.int64)
+        ix = np.floor(lon / self.cell_deg).astype(np.int64)
+        return iy * 1_000_003 + ix
+
+    def lookup(self, lat, lon) -> np.ndarray:
+        """Features para coordenadas (arrays float; NaN = sin ubicación). Devuelve (n, 3)."""
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        ok = np.isfinite(lat) & np.isfinite(lon)
+        if not ok.all():
+            out = np.tile(self.fill_, (lat.shape[0], 1))
+            if ok.any():
+                out[ok] = self.lookup(lat[ok], lon[ok])
+            return out
+        dist, ind = self.tree_.query(_unit_xyz(lat, lon), k=self.k)
+        knn = np.exp(_row_median(self.log_ppm2_[ind]))
+        cells = self._cell_keys(lat, lon)
+        pos = np.minimum(np.searchsorted(self.cell_keys_, cells), self.cell_keys_.shape[0] - 1)
+        found = (self.cell_keys_[pos] == cells) & (self.cell_counts_[pos] >= self.min_cell_count)
+        out = np.empty((lat.shape[0], 3))
+        out[:, 0] = knn
+        out[:, 1] = _arc_km(dist[:, -1])
+        out[:, 2] = np.where(found, np.exp(self.cell_sums_[pos] / np.maximum(self.cell_counts_[pos], 1)), knn)
+        return out
+
+    def _lookup_loo(self) -> np.ndarray:
+        """Features de los avisos indexados sin contarse a sí mismos (k+1 vecinos menos el propio)."""
+        dist, ind = self.tree_.query(self.tree_.data, k=self.k + 1)
+        own = ind == np.arange(ind.shape[0])[:, None]
+        # con coordenadas repetidas el propio aviso puede quedar fuera de los k+1: se descarta el último
+        own[~own.any(axis=1), -1] = True
+        ind = ind[~own].reshape(ind.shape[0], self.k)
+        dist = dist[~own].reshape(dist.shape[0], self.k)
+        knn = np.exp(_row_median(self.log_ppm2_[ind]))
+
+        counts = self.cell_counts_[self._row_cell] - 1
+        sums = self.cell_sums_[self._row_cell] - self.log_ppm2_
+        cell = np.where(counts >= self.min_cell_count, np.exp(sums / np.maximum(counts, 1)), knn)
+        return np.c_[knn, _arc_km(dist[:, -1]), cell]
+
+    def __getstate__(self):
+        # el mapeo fila -> celda solo sirve para el fit_transform
+        state = dict(self.__dict__)
+        state.pop("_row_cell", None)
+        return state
+
+
+def _unit_xyz(lat, lon) -> np.ndarray:
+    """Coordenadas en la esfera unitaria (n, 3)."""
+    lat, lon = np.radians(lat), np.radians(lon)
+    cos_lat = np.cos(lat)
+    xyz = np.empty((lat.shape[0], 3))
+    xyz[:, 0] = cos_lat * np.cos(lon)
+    xyz[:, 1] = cos_lat * np.sin(lon)
+    xyz[:, 2] = np.sin(lat)
+    return xyz
+
+
+def _row_median(values: np.ndarray) -> np.ndarray:
+    """Mediana por fila (como np.median, sin su costo fijo: importa en el lookup de una fila)."""
+    values = np.sort(values, axis=1)
+    mid = values.shape[1] // 2
+    if values.shape[1] % 2:
+        return values[:, mid]
+    return (values[:, mid - 1] + values[:, mid]) / 2
+
+
+def _arc_km(chord) -> np.ndarray:
+    """Distancia de cuerda en la esfera unitaria -> distancia sobre la superficie en km."""
+    return 2 * np.arcsin(np.minimum(np.asarray(chord) / 2, 1.0)) * EARTH_RADIUS_KM
+
+
+def _coords(X):
+    """(lat, lon) como float64 desde un DataFrame con GEO_COLUMNS o un array (n, 2)."""
+    if hasattr(X, "columns"):
+        return (
+            np.asarray(X[GEO_COLUMNS[0]], dtype=np.float64),
+            np.asarray(X[GEO_COLUMNS[1]], dtype=np.float64),
+        )
+    X = np.asarray(X, dtype=np.float64)
+    return X[:, 0], X[:, 1]
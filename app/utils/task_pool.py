@@ -0,0 +1,116 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from app.utils.config import TASK_POOL_MAX_WORKERS, TASK_POOL_NICE
+from app.utils.log_config import logger
+
+'''
+POOL DE PROCESOS PARA TAREAS PESADAS (ingesta / entrenamiento / pipeline completo)
+Las tareas corren en procesos aparte (spawn), así DuckDB, pandas y los fit de sklearn
+no ocupan el event loop ni el GIL del proceso que sirve predicciones.
+- TASK_POOL_MAX_WORKERS: cantidad de tareas que pueden correr a la vez
+- dos tareas que usan el mismo recurso no se superponen (TaskAlreadyRunning -> 409)
+- los procesos hijos bajan su prioridad (TASK_POOL_NICE) para no competir con la API
+'''
+
+class TaskAlreadyRunning(Exception):
+    """Ya hay una tarea en curso que usa alguno de los mismos recursos."""
+
+
+# recursos que toma cada tarea: la ingesta escribe entrenamiento.duckdb y el entrenamiento su propia base
+# (entrenamiento_clean.duckdb, leyendo el lago del snapshot), así que una ingesta puede correr junto a un entrenamiento
+TASK_RESOURCES = {
+    "ingest": {"duckdb"},
+    "train": {"training_db", "modelos"},
+    "train_ooc": {"training_db", "modelos"},
+    "train_segments": {"training_db", "modelos"},
+    "pipeline": {"duckdb", "training_db", "modelos"},
+}
+
+_executor = None
+_lock = threading.Lock()
+# nombre de la tarea -> Future
+_running = {}
+
+
+def _init_worker(nice: int):
+    """Inicializador de cada proceso del pool."""
+    if nice:
+        try:
+            os.nice(nice)
+        except OSError as e:
+            logger.warning(f"No se pudo bajar la prioridad del proceso de tareas: {e}")
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=TASK_POOL_MAX_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(TASK_POOL_NICE,),
+        )
+        logger.info(f"Pool de tareas iniciado ({TASK_POOL_MAX_WORKERS} procesos, nice={TASK_POOL_NICE})")
+    return _executor
+
+
+def submit_task(name: str, fn, *args, on_done=None):
+    """
+    Envía fn(*args) al pool de procesos. fn debe ser una función de módulo (se importa en el hijo).
+    on_done(result) se llama en el proceso de la API cuando la tarea termina.
+    Lanza TaskAlreadyRunning si hay otra tarea en curso con un recurso en común.
+    """
+    global _executor
+    resources = TASK_RESOURCES.get(name, {name})
+    with _lock:
+        busy = sorted(other for other in _running if TASK_RESOURCES.get(other, {other}) & resources)
+        if busy:
+            raise TaskAlreadyRunning(f"No se puede iniciar '{name}': en curso {', '.join(busy)}.")
+        try:
+            future = _get_executor().submit(fn, *args)
+        except BrokenProcessPool:
+            # un proceso hijo murió (ej: OOM): se arma un pool nuevo
+            logger.warning("Pool de tareas roto. Se crea uno nuevo.")
+            _executor = None
+            future = _get_executor().submit(fn, *args)
+        _running[name] = future
+
+    logger.info(f"Tarea '{name}' enviada al pool de procesos.")
+    future.add_done_callback(lambda f: _on_task_done(name, f, on_done))
+    return future
+
+
+def _on_task_done(name: str, future, on_done):
+    with _lock:
+        _running.pop(name, None)
+    try:
+        result = future.result()
+    except Exception as e:
+        logger.error(f"Tarea '{name}' falló en el pool de procesos: {e}")
+        result = {"status": "error", "message": str(e)}
+    if not isinstance(result, dict):
+        result = {"status": "ok", "result": result}
+    logger.info(f"Tarea '{name}' finalizada: {result.get('status')}")
+    if on_done is not None:
+        try:
+            on_done(result)
+        except Exception as e:
+            logger.error(f"Error en el callback de la tarea '{name}': {e}")
+
+
+def running_tasks() -> list[str]:
+    """Tareas en curso (o en cola del pool)."""
+    with _lock:
+        return sorted(_running)
+
+
+def shutdown_pool():
+    """Cierra el pool al apagar la API (cancela lo que esté en cola)."""
+    global _executor
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
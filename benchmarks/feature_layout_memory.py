@@ -0,0 +1,120 @@
+"""
+Benchmark de memoria de FEATURE_LAYOUT (dense vs compact, app/processing/preprocessing.py).
+
+Cada combinación (layout, modelo) corre en un proceso aparte para que el pico de RSS
+(ru_maxrss) sea solo suyo: carga datos_clean (repetido --reps veces para simular un
+dataset más grande), arma la matriz compartida, entrena y reporta el tamaño de la matriz,
+el RSS antes del fit, el pico de RSS, el tiempo de fit y si las predicciones coinciden con dense.
+
+Con kind="ordinal" (HistGradientBoosting) los códigos int16 solo achican la caché y las partes
+compartidas: SharedFeatures.matrix los entrega en float64 y la matriz del fit es igual a la de dense.
+
+Uso (desde la raíz del repo, con datos_clean ya armado por un entrenamiento):
+    python -m benchmarks.feature_layout_memory [--reps 10] [--trees 50] [--models rf gb hgb]
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import duckdb
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.compose import TransformedTargetRegressor
+from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor, HistGradientBoostingRegressor
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import RobustScaler, StandardScaler
+from app.processing import preprocessing
+from app.processing.trainer import DB_PATH, NUMERIC_FEATURES, CATEGORICAL_FEATURES, load_feature_matrix
+
+
+def rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+
+
+def matrix_mb(X) -> float:
+    if sparse.issparse(X):
+        return (X.data.nbytes + X.indices.nbytes + X.indptr.nbytes) / 1024 ** 2
+    return X.nbytes / 1024 ** 2
+
+
+def run_one(layout: str, model: str, reps: int, trees: int, out_path: str):
+    # sin caché: se mide el preprocesamiento y el fit, no la lectura de un .joblib
+    preprocessing.PREPROC_CACHE_ENABLED = False
+    with duckdb.connect(DB_PATH, read_only=True) as con:
+        X, y = load_feature_matrix(con, NUMERIC_FEATURES + CATEGORICAL_FEATURES)
+    X = pd.concat([X] * reps, ignore_index=True)
+    y = np.tile(y, reps)
+    X_train, X_test, y_train, _ = train_test_split(X, y, test_size=0.2, random_state=42)
+    del X, y
+
+    kind = "ordinal" if model == "hgb" else "onehot"
+    shared = preprocessing.shared_features(
+        X_train, X_test, NUMERIC_FEATURES, CATEGORICAL_FEATURES, kind=kind, layout=layout,
+    )
+    if model == "rf":
+        _, A, A_test = preprocessing.scale_features(shared, RobustScaler())
+        est = TransformedTargetRegressor(
+            regressor=RandomForestRegressor(n_estimators=trees, min_samples_split=4, n_jobs=-1, random_state=42),
+            func=np.log1p, inverse_func=np.expm1,
+        )
+    elif model == "gb":
+        _, A, A_test = preprocessing.scale_features(shared, StandardScaler(), accept_sparse=True)
+        est = GradientBoostingRegressor(
+            n_estimators=trees, learning_rate=0.05, max_depth=3, subsample=0.8, random_state=42,
+        )
+    else:
+        A, A_test = shared.matrix("train"), shared.matrix("test")
+        est = HistGradientBoostingRegressor(
+            max_iter=trees, categorical_features=shared.categorical_mask, random_state=42,
+        )
+    del X_train
+
+    before = rss_mb()
+    start = time.perf_counter()
+    est.fit(A, y_train)
+    fit_s = time.perf_counter() - start
+    # ru_maxrss viene en KB en Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    np.save(out_path, est.predict(A_test))
+    kind_label = f"{type(A).__name__}/{A.dtype}"
+    print(
+        f"{layout:8s} {model:3s} filas={A.shape[0] + A_test.shape[0]:>8d} partes={shared.nbytes() / 1024 ** 2:6.0f} MB "
+        f"matriz={matrix_mb(A):6.0f} MB ({kind_label}) rss_antes_fit={before:6.0f} MB pico={peak:6.0f} MB fit={fit_s:6.1f} s",
+        flush=True,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reps", type=int, default=1, help="veces que se repite datos_clean")
+    parser.add_argument("--trees", type=int, default=50)
+    parser.add_argument("--models", nargs="+", default=["rf", "gb", "hgb"])
+    parser.add_argument("--run", nargs=3, metavar=("LAYOUT", "MODEL", "OUT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        layout, model, out_path = args.run
+        run_one(layout, model, args.reps, args.trees, out_path)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for model in args.models:
+            preds = {}
+            for layout in ("dense", "compact"):
+                out_path = os.path.join(tmp, f"{model}_{layout}.npy")
+                subprocess.run(
+                    [sys.executable, "-m", "benchmarks.feature_layout_memory", "--reps", str(args.reps),
+                     "--trees", str(args.trees), "--run", layout, model, out_path],
+                    check=True,
+                )
+                preds[layout] = np.load(out_path)
+            print(f"{model}: predicciones dense == compact: {np.array_equal(preds['dense'], preds['compact'])}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Benchmark del modelo B (MODEL_B): GradientBoosting (one-hot) vs HistGradientBoosting (ordinal nativo).
+
+Entrena los dos con los parámetros por defecto de run_training_pipeline sobre el mismo split de
+datos_clean (sin features espaciales, para comparar solo el estimador y su preprocesamiento) y reporta:
+tiempo de fit, RMSE / MAE / R2 en test y latencia de predicción del Pipeline servible
+(1 fila con pandas, 1 fila con FastEncoder y un lote de --batch filas).
+
+Uso (desde la raíz del repo, con datos_clean ya armado por un entrenamiento):
+    python -m benchmarks.model_b [--batch 10000]
+"""
+import argparse
+import time
+import duckdb
+from sklearn.ensemble import GradientBoostingRegressor, HistGradientBoostingRegressor
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import StandardScaler
+from app.processing import preprocessing
+from app.processing.preprocessing import shared_features, scale_features, compose_pipeline
+from app.processing.trainer import DB_PATH, NUMERIC_FEATURES, CATEGORICAL_FEATURES, load_feature_matrix, evaluate
+from app.utils.encoding import build_fast_encoder, verify_parity, _probe_samples
+
+
+def build(model_b: str, X_train, X_test):
+    """(estimador sin ajustar, shared, scaler, Xt_train, Xt_test) como en run_training_pipeline."""
+    if model_b == "hgb":
+        shared = shared_features(X_train, X_test, NUMERIC_FEATURES, CATEGORICAL_FEATURES, kind="ordinal")
+        estimator = HistGradientBoostingRegressor(
+            max_iter=500, learning_rate=0.1, max_leaf_nodes=31, categorical_features=shared.categorical_mask,
+            early_stopping=True, validation_fraction=0.1, n_iter_no_change=20, random_state=42,
+        )
+        return estimator, shared, None, shared.matrix("train"), shared.matrix("test")
+    shared = shared_features(X_train, X_test, NUMERIC_FEATURES, CATEGORICAL_FEATURES)
+    scaler, Xt_train, Xt_test = scale_features(shared, StandardScaler(), accept_sparse=True)
+    estimator = GradientBoostingRegressor(
+        n_estimators=200, learning_rate=0.05, max_depth=3, subsample=0.8, random_state=42,
+    )
+    return estimator, shared, scaler, Xt_train, Xt_test
+
+
+def per_call_ms(fn, repeats: int) -> float:
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch", type=int, default=10000)
+    args = parser.parse_args()
+
+    # sin caché: el preprocesamiento de cada modelo se ajusta acá
+    preprocessing.PREPROC_CACHE_ENABLED = False
+    with duckdb.connect(DB_PATH, read_only=True) as con:
+        X, y = load_feature_matrix(con, NUMERIC_FEATURES + CATEGORICAL_FEATURES)
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    print(f"train {len(X_train)} filas, test {len(X_test)} filas\n")
+
+    rows = []
+    for model_b, label in (("gb", "GradientBoosting"), ("hgb", "HistGradientBoosting")):
+        estimator, shared, scaler, Xt_train, Xt_test = build(model_b, X_train, X_test)
+        start = time.perf_counter()
+        estimator.fit(Xt_train, y_train)
+        fit_s = time.perf_counter() - start
+        metrics = evaluate(estimator, Xt_test, y_test, name=label)
+
+        model = compose_pipeline(shared, estimator, X_train.iloc[:2], scaler=scaler)
+        encoder = build_fast_encoder(model)
+        one = X_test.iloc[:1]
+        batch = X_test.iloc[:args.batch]
+        pipeline_ms = per_call_ms(lambda: model.predict(one), 200)
+        encoder_ms = None
+        if encoder is not None and verify_parity(model, encoder):
+            sample = _probe_samples(encoder, n=1)
+            encoder_ms = per_call_ms(lambda: encoder.predict(sample), 2000)
+        batch_ms = per_call_ms(lambda: model.predict(batch), 5)
+        iterations = estimator.n_iter_ if model_b == "hgb" else estimator.n_estimators_
+        rows.append((label, f"{Xt_train.shape[1]} cols", fit_s, iterations, metrics, pipeline_ms, encoder_ms, batch_ms))
+
+    print(f"{'modelo':22s} {'matriz':>8s} {'fit s':>7s} {'iter':>5s} {'rmse':>10s} {'mae':>10s} {'r2':>7s} "
+          f"{'1 fila ms':>10s} {'encoder ms':>10s} {f'{len(batch)} filas ms':>14s}")
+    for label, width, fit_s, iterations, m, pipeline_ms, encoder_ms, batch_ms in rows:
+        encoder_txt = f"{encoder_ms:10.3f}" if encoder_ms is not None else f"{'-':>10s}"
+        print(f"{label:22s} {width:>8s} {fit_s:7.1f} {iterations:5d} {m['rmse']:10.1f} {m['mae']:10.1f} {m['r2']:7.4f} "
+              f"{pipeline_ms:10.3f} {encoder_txt} {batch_ms:14.1f}")
+
+
+if __name__ == "__main__":
+    main()
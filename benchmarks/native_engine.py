@@ -0,0 +1,71 @@
+"""
+Benchmark del motor de inferencia nativo (app/utils/flat_forest.py) contra sklearn.
+
+Para cada modelo entrenado (random_forest.joblib, gradient_boosting.joblib) compara
+el estimador final de sklearn, el motor nativo y el híbrido de INFERENCE_ENGINE=auto
+(con el corte calibrado) por tamaño de lote: mediana en ms y filas por segundo.
+Antes de medir verifica que el nativo dé exactamente lo mismo que sklearn.
+
+Uso (desde la raíz del repo, con los modelos ya entrenados):
+    python -m benchmarks.native_engine [--sizes 1 10 100 1000 5000] [--models random_forest]
+"""
+import argparse
+import os
+import time
+import joblib
+import numpy as np
+from app.utils.config import NATIVE_MAX_ROWS
+from app.utils.encoding import build_fast_encoder, samples_to_frame, _probe_samples
+from app.utils.flat_forest import to_native, probe_matrix
+
+MODELS_DIR = "app/data/artifacts/housing_models"
+
+
+def median_ms(predict, X, repeats: int) -> float:
+    predict(X)
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        predict(X)
+        times.append(time.perf_counter() - start)
+    return float(np.median(times)) * 1000
+
+
+def run(name: str, sizes: list[int]):
+    path = os.path.join(MODELS_DIR, f"{name}.joblib")
+    if not os.path.exists(path):
+        print(f"{name}: no existe {path}, se saltea.")
+        return
+    model = joblib.load(path)
+    sklearn_est = model.steps[-1][1]
+    native = to_native(model).steps[-1][1]
+    hybrid = to_native(model, hybrid_max_rows=NATIVE_MAX_ROWS).steps[-1][1]
+
+    # filas codificadas como las de la API (muestras sintéticas sobre las categorías del modelo)
+    samples = _probe_samples(build_fast_encoder(model), n=max(sizes), seed=1)
+    X = model.steps[0][1].transform(samples_to_frame(samples))
+    probes = probe_matrix(native, n=2000)
+    for label, M in (("filas codificadas", X), ("umbrales", probes)):
+        exact = np.array_equal(native.predict(M), sklearn_est.predict(M))
+        print(f"{name}: paridad exacta con sklearn en {len(M)} {label}: {exact}")
+    cutoff = hybrid.calibrate(probes)
+    print(f"{name}: {native!r}, corte de auto = {cutoff} filas")
+
+    print(f"{'filas':>6} | {'sklearn ms':>10} | {'nativo ms':>10} | {'auto ms':>10} | {'sklearn filas/s':>15} | {'auto filas/s':>13}")
+    for n in sizes:
+        Xn = X[:n]
+        repeats = 30 if n <= 100 else 5
+        s_ms = median_ms(sklearn_est.predict, Xn, repeats)
+        n_ms = median_ms(native.predict, Xn, repeats)
+        a_ms = median_ms(hybrid.predict, Xn, repeats)
+        print(f"{n:>6} | {s_ms:>10.2f} | {n_ms:>10.2f} | {a_ms:>10.2f} | {n / s_ms * 1000:>15.0f} | {n / a_ms * 1000:>13.0f}")
+    print()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 64, 100, 1000, 5000])
+    parser.add_argument("--models", nargs="+", default=["random_forest", "gradient_boosting"])
+    args = parser.parse_args()
+    for model_name in args.models:
+        run(model_name, args.sizes)
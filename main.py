@@ -6,9 +6,14 @@ import os
 
 
 # Importar todos los routers
-from app.routers import health, predict, ingestion, training, pipeline
+from app.routers import health, predict, comparables, ingestion, training, pipeline, jobs, metrics
 from app.utils.log_config import logger
 from app.utils.model_loader import load_model
+from app.utils.task_pool import shutdown_pool
+from app.utils.jobs import shutdown_jobs
+from app.utils.db import shutdown_db
+from app.utils.metrics import MetricsMiddleware
+from app.utils.config import METRICS_ENABLED
 from app.exception_handlers import register_exception_handlers# Importar manejo de  excepciones
 
 load_dotenv()
@@ -34,9 +39,21 @@ def startup_event():
         logger.warning("La API se iniciará sin un modelo cargado. Ejecute el endpoint de entrenamiento/pipeline.")
 
 
+@app.on_event("shutdown")
+def shutdown_event():
+    """Cierra el pool de procesos de ingesta/entrenamiento, el Manager de jobs y el executor de DuckDB."""
+    shutdown_pool()
+    shutdown_jobs()
+    shutdown_db()
+
+
 # Registra los manejadores personalizados (de exception_handlers.py)
 register_exception_handlers(app)
 
+# latencia / status por ruta para /metrics
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
 
 # Routers 
 logger.info("Incluyendo routers...")
@@ -44,9 +61,13 @@ app.include_router(health.router)
 #  fusiona ingesta y entrenamiento
 app.include_router(pipeline.router)
 app.include_router(predict.router)
+app.include_router(comparables.router)
 #endpoints de ingesta y entrenamiento separados
 app.include_router(ingestion.router)
 app.include_router(training.router)
+app.include_router(jobs.router)
+if METRICS_ENABLED:
+    app.include_router(metrics.router)
 
 
 if __name__ == "__main__":
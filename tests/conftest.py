@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.compose import TransformedTargetRegressor
+from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor, HistGradientBoostingRegressor
+from sklearn.preprocessing import RobustScaler, StandardScaler
+from app.processing import preprocessing
+from app.processing.preprocessing import shared_features, scale_features, compose_pipeline, append_columns
+from app.processing.trainer import NUMERIC_FEATURES, CATEGORICAL_FEATURES
+from app.utils.spatial import SpatialFeatures, GEO_COLUMNS
+
+'''
+FIXTURES COMPARTIDAS: un dataset sintético con la forma de datos_clean (mismas features que el trainer,
+faltantes incluidos), Pipelines servibles armados como en trainer.py y la caché de
+preprocesamiento apagada para no escribir en app/data.
+'''
+
+BARRIOS = ["Palermo", "Almagro", "Caballito", "Belgrano", "Recoleta", "Flores"]
+
+
+def make_listings(n: int = 600, seed: int = 0) -> tuple[pd.DataFrame, np.ndarray]:
+    """(X con NUMERIC_FEATURES + CATEGORICAL_FEATURES, precio) con ~10% de faltantes por columna."""
+    rng = np.random.default_rng(seed)
+    surface = rng.uniform(30, 250, n)
+    X = pd.DataFrame({
+        "lon": rng.normal(-58.43, 0.03, n),
+        "lat": rng.normal(-34.60, 0.03, n),
+        "rooms": rng.integers(1, 6, n).astype(float),
+        "bedrooms": rng.integers(0, 4, n).astype(float),
+        "bathrooms": rng.integers(1, 3, n).astype(float),
+        "surface_total": surface,
+        "surface_covered": surface * rng.uniform(0.6, 1.0, n),
+        "days_active": rng.uniform(0, 300, n),
+        "created_age_days": rng.uniform(0, 900, n),
+        "l3": rng.choice(BARRIOS, n),
+        "currency": rng.choice(["USD", "ARS"], n, p=[0.9, 0.1]),
+        "price_period": rng.choice(["Mensual", None], n),
+        "property_type": rng.choice(["Departamento", "PH", "Casa"], n),
+        "operation_type": rng.choice(["Venta", "Alquiler"], n),
+    })
+    for column in ["rooms", "bedrooms", "bathrooms", "surface_covered", "lat", "lon", "l3"]:
+        X.loc[rng.random(n) < 0.1, column] = np.nan if X[column].dtype.kind == "f" else None
+    y = surface * rng.uniform(1500, 3500, n) * np.where(X["operation_type"] == "Venta", 1.0, 0.005)
+    return X[NUMERIC_FEATURES + CATEGORICAL_FEATURES], y
+
+
+def fit_model(listings, model="rf", layout="dense", spatial=False):
+    """Pipeline servible armado como en trainer.py (bloques compartidos congelados + estimador)."""
+    X, y = listings
+    X_train, X_test = X.iloc[:500], X.iloc[500:]
+    y_train = y[:500]
+    kind = "ordinal" if model == "hgb" else "onehot"
+    shared = shared_features(X_train, X_test, NUMERIC_FEATURES, CATEGORICAL_FEATURES, kind=kind, layout=layout)
+    if model == "hgb":
+        scaler, Xt = None, shared.matrix("train")
+        mask = shared.categorical_mask
+    else:
+        scaler, Xt, _ = scale_features(shared, RobustScaler() if model == "rf" else StandardScaler())
+    extra = ()
+    if spatial:
+        geo = SpatialFeatures(k=5, cell_deg=0.01, min_cell_count=3)
+        Xt = append_columns(Xt, geo.fit_transform(X_train[GEO_COLUMNS], y_train / X_train["surface_total"].to_numpy()))
+        extra = [("geo", geo, GEO_COLUMNS)]
+        if model == "hgb":
+            mask = np.r_[mask, np.zeros(3, dtype=bool)]
+
+    if model == "rf":
+        estimator = TransformedTargetRegressor(
+            regressor=RandomForestRegressor(n_estimators=8, min_samples_split=4, random_state=0),
+            func=np.log1p, inverse_func=np.expm1,
+        )
+    elif model == "gb":
+        estimator = GradientBoostingRegressor(n_estimators=20, max_depth=3, random_state=0)
+    else:
+        estimator = HistGradientBoostingRegressor(max_iter=20, categorical_features=mask, random_state=0)
+    estimator.fit(Xt, y_train)
+    return compose_pipeline(shared, estimator, X_train.iloc[:2], scaler=scaler, extra=extra)
+
+
+@pytest.fixture
+def listings():
+    return make_listings()
+
+
+@pytest.fixture
+def build_model(listings):
+    """build_model("rf" | "gb" | "hgb", layout, spatial) sobre el dataset de listings."""
+    return lambda model="rf", layout="dense", spatial=False: fit_model(listings, model, layout, spatial)
+
+
+@pytest.fixture(autouse=True)
+def no_preproc_cache(monkeypatch):
+    monkeypatch.setattr(preprocessing, "PREPROC_CACHE_ENABLED", False)
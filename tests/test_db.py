@@ -0,0 +1,158 @@
+import glob
+import multiprocessing
+import os
+import re
+import numpy as np
+import pandas as pd
+import pytest
+from app.processing import ingestor, trainer
+from app.utils import db
+from app.utils.db import connection, get_pool, snapshot_lake_files
+
+'''
+ACCESO A DUCKDB: el pool deja una instancia abierta por archivo (y la suelta si otro proceso la pide),
+y la ingesta publica como snapshot la lista de archivos del lago que lee el entrenamiento.
+'''
+
+REGIONS = ["Capital Federal", "Córdoba", "Bs.As. G.B.A. Zona Norte"]
+
+
+def write_listings_csv(path, n: int = 600, changed_region: str | None = None):
+    """CSV con el esquema de Properati; changed_region sube el precio de los avisos de esa región."""
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        "id": np.arange(1, n + 1),
+        "ad_type": "Propiedad",
+        "start_date": "2020-01-01",
+        "end_date": "2020-03-01",
+        "created_on": "2020-01-01",
+        "lat": rng.normal(-34.6, 0.05, n),
+        "lon": rng.normal(-58.4, 0.05, n),
+        "l1": "Argentina",
+        "l2": rng.choice(REGIONS, n),
+        "l3": rng.choice(["Palermo", "Nueva Córdoba", "Tigre"], n),
+        "l4": None, "l5": None, "l6": None,
+        "rooms": rng.integers(1, 6, n).astype(float),
+        "bedrooms": rng.integers(0, 4, n).astype(float),
+        "bathrooms": rng.integers(1, 3, n).astype(float),
+        "surface_total": rng.uniform(30, 250, n),
+        "surface_covered": rng.uniform(30, 200, n),
+        "currency": "USD",
+        "price_period": None,
+        "title": "Depto",
+        "description": "Luminoso",
+        "property_type": rng.choice(["Departamento", "Casa"], n),
+        "operation_type": rng.choice(["Venta", "Alquiler"], n),
+        "price": rng.uniform(50_000, 500_000, n).round(),
+    })
+    if changed_region:
+        df.loc[df["l2"] == changed_region, "price"] += 1000
+    df[list(ingestor.PROPERATI_SCHEMA)].to_csv(path, index=False)
+    return str(path)
+
+
+@pytest.fixture
+def lake(tmp_path, monkeypatch):
+    """Ingesta y entrenamiento apuntados a una base, un lago y un snapshot temporales."""
+    db_path = str(tmp_path / "entrenamiento.duckdb")
+    lake_dir = str(tmp_path / "lake")
+    monkeypatch.setattr(ingestor, "DB_PATH", db_path)
+    monkeypatch.setattr(ingestor, "LAKE_DIR", lake_dir)
+    monkeypatch.setattr(trainer, "LAKE_DIR", lake_dir)
+    monkeypatch.setattr(db, "DB_SNAPSHOT_PATH", str(tmp_path / "snapshot.duckdb"))
+    yield db_path, lake_dir
+    get_pool(db_path).close()
+
+
+def published(db_path) -> list[str]:
+    with connection(db_path) as con:
+        return sorted(snapshot_lake_files(con))
+
+
+def on_disk(lake_dir) -> list[str]:
+    return sorted(os.path.normpath(p) for p in glob.glob(os.path.join(lake_dir, "**", "*.parquet"), recursive=True))
+
+
+def test_ingest_publishes_the_lake_files_instead_of_a_copy(lake, tmp_path):
+    db_path, lake_dir = lake
+    ingestor.run_duckdb_pipeline(write_listings_csv(tmp_path / "v1.csv"), mode="full")
+    v1 = published(db_path)
+    assert v1 == on_disk(lake_dir)
+    with connection(db_path) as con:
+        con.execute(f"ATTACH '{db.DB_SNAPSHOT_PATH}' AS s (READ_ONLY)")
+        tables = {row[0] for row in con.execute("SELECT table_name FROM duckdb_tables() WHERE database_name = 's'").fetchall()}
+        con.execute("DETACH s")
+    assert tables == {"lake_files", "ingest_versions"}
+
+    # incremental: solo se reemplazan los archivos de las particiones de la región que cambió
+    result = ingestor.run_duckdb_pipeline(write_listings_csv(tmp_path / "v2.csv", changed_region="Córdoba"))
+    assert result["mode"] == "incremental" and result["updated"] > 0
+    v2 = published(db_path)
+    replaced = set(v1) - set(v2)
+    assert replaced and all("C%C3%B3rdoba" in path for path in replaced)
+    # los archivos retirados siguen en disco para quien leyó el snapshot anterior
+    assert on_disk(lake_dir) == sorted(set(v1) | set(v2))
+    with connection(db_path) as con:
+        lake_rows = con.execute(f"SELECT sum(price), count(*) FROM {db.lake_source(v2)}").fetchone()
+        raw_rows = con.execute("SELECT sum(price), count(*) FROM datos_raw").fetchone()
+    assert lake_rows == raw_rows
+
+    # la versión siguiente borra los retirados de la anterior
+    ingestor.run_duckdb_pipeline(write_listings_csv(tmp_path / "v3.csv"))
+    v3 = published(db_path)
+    assert on_disk(lake_dir) == sorted(set(v2) | set(v3))
+
+
+def test_training_reads_the_lake_with_partition_pruning(lake, tmp_path):
+    db_path, _ = lake
+    ingestor.run_duckdb_pipeline(write_listings_csv(tmp_path / "v1.csv"), mode="full")
+    with connection(str(tmp_path / "clean.duckdb")) as con:
+        source = trainer.training_source(con)
+        assert source.startswith("read_parquet([") and "hive_partitioning = true" in source
+        plan = con.execute(f"EXPLAIN ANALYZE SELECT count(*) FROM {source} WHERE {trainer.TRAINING_FILTER}").fetchall()[0][1]
+    scanned, total = map(int, re.search(r"Scanning Files: (\d+)/(\d+)", plan).groups())
+    assert 0 < scanned < total
+    get_pool(str(tmp_path / "clean.duckdb")).close()
+
+
+def test_serial_uses_share_one_instance(tmp_path):
+    path = str(tmp_path / "pool.duckdb")
+    with connection(path) as con:
+        default_limit = con.execute("SELECT current_setting('memory_limit')").fetchone()[0]
+    for i in range(5):
+        with connection(path) as con:
+            con.execute("SET memory_limit = '123MB'")
+            con.execute(f"CREATE TEMP TABLE scratch AS SELECT {i} AS x")
+            con.execute(f"CREATE OR REPLACE TABLE t AS SELECT {i} AS x")
+    pool = get_pool(path)
+    assert pool.stats()["open"] and pool.stats()["opens"] == 1
+    with connection(path) as con:
+        # las tablas temporales y los SET de un uso no pasan al siguiente
+        assert con.execute("SELECT count(*) FROM duckdb_tables() WHERE temporary").fetchone()[0] == 0
+        assert con.execute("SELECT current_setting('memory_limit')").fetchone()[0] == default_limit
+        assert con.execute("SELECT x FROM t").fetchone()[0] == 4
+    pool.close()
+    assert not pool.stats()["open"]
+
+
+def write_from_other_process(path):
+    with connection(path) as con:
+        con.execute("INSERT INTO t VALUES (42)")
+
+
+def test_idle_instance_is_released_for_another_process(tmp_path):
+    path = str(tmp_path / "shared.duckdb")
+    with connection(path) as con:
+        con.execute("CREATE TABLE t (x INTEGER)")
+    assert get_pool(path).stats()["open"]
+
+    child = multiprocessing.get_context("spawn").Process(target=write_from_other_process, args=(path,))
+    child.start()
+    child.join(60)
+    assert child.exitcode == 0
+    # el otro proceso pidió el archivo y este soltó su instancia
+    assert not get_pool(path).stats()["open"]
+    assert not os.path.exists(f"{path}.release")
+    with connection(path) as con:
+        assert con.execute("SELECT x FROM t").fetchall() == [(42,)]
+    get_pool(path).close()
@@ -0,0 +1,227 @@
+import hashlib
+import io
+import json
+import os
+import threading
+import zipfile
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+from app.processing import downloader
+from app.processing.downloader import DatasetDownloader, DownloadError, KaggleClient
+from app.processing.ingestor import PROPERATI_SCHEMA, _validate_csv, _versioned_name
+
+'''
+GESTOR DE DESCARGAS SIN RED: un servidor HTTP local con la forma de la API de Kaggle
+(/datasets/view y /datasets/download con Range) que puede cortar la conexión a mitad
+de la descarga o ignorar Range, y el KaggleClient real apuntado a él.
+'''
+
+SLUG = "propiedades/argentina"
+FILE_NAME = "entrenamiento.csv"
+CHUNK = 16 * 1024
+
+
+def make_csv(n_rows: int = 4000, seed: int = 0, header=None) -> bytes:
+    header = header or list(PROPERATI_SCHEMA)
+    lines = [",".join(header)]
+    for i in range(n_rows):
+        lines.append(",".join(f"{seed}-{i}-{j}" for j in range(len(header))))
+    return ("\n".join(lines) + "\n").encode()
+
+
+def make_zip(csv: bytes, name: str = FILE_NAME) -> bytes:
+    # sin compresión: el tamaño del zip (y dónde cae un corte) es predecible
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED) as archive:
+        archive.writestr(name, csv)
+    return buffer.getvalue()
+
+
+class FakeKaggle:
+    """Estado del servidor: qué versión publica, qué zip sirve y cómo se porta la descarga."""
+
+    def __init__(self):
+        self.version = 1
+        self.last_updated = "2026-10-01T10:00:00.000Z"
+        self.payload = b""
+        # bytes que se mandan antes de cortar la conexión (una sola vez)
+        self.cut_after = None
+        self.ignore_range = False
+        self.downloads = []
+        self.bytes_sent = 0
+
+    def publish(self, version: int, payload: bytes, last_updated: str | None = None, **behavior):
+        self.version, self.payload = version, payload
+        self.last_updated = last_updated or f"2026-10-{version:02d}T10:00:00.000Z"
+        self.cut_after = behavior.get("cut_after")
+        self.ignore_range = behavior.get("ignore_range", False)
+
+
+def _handler(state: FakeKaggle):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.startswith("/api/v1/datasets/view/"):
+                body = json.dumps({"currentVersionNumber": state.version, "lastUpdated": state.last_updated}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+            if not self.path.startswith("/api/v1/datasets/download/"):
+                self.send_response(404)
+                self.end_headers()
+                return
+
+            data = state.payload
+            requested = self.headers.get("Range")
+            state.downloads.append(requested)
+            start = 0
+            if requested and not state.ignore_range:
+                start = int(requested.split("=")[1].split("-")[0])
+                if start >= len(data):
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{len(data)}")
+                    self.end_headers()
+                    return
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}")
+            else:
+                self.send_response(200)
+            chunk = data[start:]
+            self.send_header("Content-Length", str(len(chunk)))
+            self.end_headers()
+            if state.cut_after:
+                cut, state.cut_after = state.cut_after, None
+                self.wfile.write(chunk[:cut])
+                state.bytes_sent += cut
+                self.wfile.flush()
+                self.connection.shutdown(2)
+                return
+            self.wfile.write(chunk)
+            state.bytes_sent += len(chunk)
+
+    return Handler
+
+
+@pytest.fixture
+def kaggle():
+    """(estado del servidor, KaggleClient apuntado al servidor local)."""
+    state = FakeKaggle()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _handler(state))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    client = KaggleClient("usuario", "clave", base_url=f"http://127.0.0.1:{server.server_port}/api/v1", timeout=5)
+    yield state, client
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def sync(kaggle, tmp_path, monkeypatch):
+    """sync() con el downloader del ingestor (validación de encabezado) sobre un RAW_DIR temporal."""
+    monkeypatch.setattr(downloader, "DOWNLOAD_CHUNK_BYTES", CHUNK)
+    _, client = kaggle
+    dl = DatasetDownloader(client, str(tmp_path), validate=_validate_csv)
+    return lambda: dl.sync(SLUG, FILE_NAME, _versioned_name)
+
+
+def sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def leftovers(raw_dir) -> list[str]:
+    return sorted(p for p in os.listdir(raw_dir) if p.endswith((".part", ".tmp")))
+
+
+def test_resumes_after_a_cut_connection(kaggle, sync, tmp_path):
+    state, _ = kaggle
+    csv = make_csv()
+    payload = make_zip(csv)
+    # el corte cae en un borde de bloque: todo lo recibido llegó a disco
+    cut = (len(payload) // 3) // CHUNK * CHUNK
+    state.publish(1, payload, cut_after=cut)
+
+    result = sync()
+    assert result["changed"] and result["version"] == "1"
+    with open(result["path"], "rb") as f:
+        assert f.read() == csv
+    assert result["sha256"] == sha256(csv)
+    # segundo pedido con Range desde lo que ya estaba en disco: nada se baja dos veces
+    assert state.downloads[0] is None and state.downloads[1] == f"bytes={cut}-"
+    assert state.bytes_sent == len(payload)
+    assert leftovers(tmp_path) == []
+
+
+def test_same_version_is_a_no_op(kaggle, sync):
+    state, _ = kaggle
+    state.publish(1, make_zip(make_csv()))
+    first = sync()
+
+    second = sync()
+    assert not second["changed"]
+    assert second["path"] == first["path"] and second["sha256"] == first["sha256"]
+    assert len(state.downloads) == 1
+
+
+def test_new_version_with_the_same_content_keeps_the_file(kaggle, sync, tmp_path):
+    state, _ = kaggle
+    payload = make_zip(make_csv())
+    state.publish(1, payload)
+    first = sync()
+
+    state.publish(2, payload)
+    second = sync()
+    assert not second["changed"]
+    assert second["version"] == "2" and second["path"] == first["path"]
+    assert len(state.downloads) == 2
+    with open(tmp_path / "kaggle_state.json") as f:
+        assert json.load(f)["version"] == "2"
+    assert leftovers(tmp_path) == []
+
+
+def test_bad_crc_is_rejected_and_the_current_file_is_kept(kaggle, sync, tmp_path):
+    state, _ = kaggle
+    state.publish(1, make_zip(make_csv()))
+    first = sync()
+
+    corrupted = bytearray(make_zip(make_csv(seed=1)))
+    corrupted[len(corrupted) // 2] ^= 0xFF
+    state.publish(2, bytes(corrupted))
+    with pytest.raises(DownloadError, match="dañado"):
+        sync()
+    assert os.path.exists(first["path"])
+    assert leftovers(tmp_path) == []
+    with open(tmp_path / "kaggle_state.json") as f:
+        assert json.load(f)["version"] == "1"
+
+
+def test_wrong_header_is_rejected(kaggle, sync, tmp_path):
+    state, _ = kaggle
+    state.publish(1, make_zip(make_csv()))
+    first = sync()
+
+    state.publish(2, make_zip(make_csv(seed=1, header=["id", "precio", "barrio"])))
+    with pytest.raises(DownloadError, match="verificación"):
+        sync()
+    assert sorted(os.listdir(tmp_path)) == sorted([os.path.basename(first["path"]), "kaggle_state.json"])
+
+
+def test_server_that_ignores_range_restarts_from_zero(kaggle, sync, tmp_path):
+    state, _ = kaggle
+    csv = make_csv()
+    payload = make_zip(csv)
+    cut = (len(payload) // 2) // CHUNK * CHUNK
+    state.publish(1, payload, cut_after=cut, ignore_range=True)
+
+    result = sync()
+    assert result["changed"]
+    with open(result["path"], "rb") as f:
+        assert f.read() == csv
+    # pidió Range, recibió 200 con el archivo entero y lo reescribió desde cero
+    assert state.downloads[1] == f"bytes={cut}-"
+    assert state.bytes_sent == cut + len(payload)
+    assert leftovers(tmp_path) == []
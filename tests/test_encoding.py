@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.frozen import FrozenEstimator
+from app.models.schemas import Sample
+from app.processing.trainer import NUMERIC_FEATURES, CATEGORICAL_FEATURES
+from app.utils.encoding import FastEncoder, build_fast_encoder, verify_parity, samples_to_frame, _probe_samples
+
+
+def edge_samples() -> list[Sample]:
+    """Faltantes, categorías que el modelo nunca vio y coordenadas ausentes o lejanas."""
+    base = dict(surface_total=80, property_type="Departamento", operation_type="Venta")
+    return [
+        Sample(**base),
+        Sample(**base, currency="EUR", l3="Narnia", price_period="Semanal"),
+        Sample(**base, lat=-34.61, lon=-58.42, rooms=3, bedrooms=2, bathrooms=1, surface_covered=70, l3="Palermo"),
+        Sample(**base, lat=-34.61),
+        Sample(**base, lat=-31.4, lon=-64.2, l3="Almagro", days_active=10, created_age_days=0),
+        Sample(surface_total=0, property_type="Casa", operation_type="Alquiler", currency="ARS", rooms=0),
+    ]
+
+
+def assert_same_predictions(model, encoder: FastEncoder, samples):
+    assert np.array_equal(encoder.predict(samples), model.predict(samples_to_frame(samples)))
+    for sample in samples:
+        assert np.array_equal(encoder.predict([sample]), model.predict(samples_to_frame([sample])))
+
+
+CASES = [
+    ("rf", "dense", False),
+    ("rf", "dense", True),
+    ("rf", "compact", True),
+    ("gb", "dense", False),
+    ("gb", "compact", True),
+    ("hgb", "dense", False),
+    ("hgb", "compact", True),
+]
+
+
+@pytest.mark.parametrize("model_name, layout, spatial", CASES)
+def test_fast_encoder_matches_pipeline_bit_for_bit(listings, build_model, model_name, layout, spatial):
+    model = build_model(model_name, layout, spatial)
+    encoder = build_fast_encoder(model)
+    assert encoder is not None
+
+    X, _ = listings
+    # filas de test tal como llegarían a la API (NaN -> None)
+    samples = [Sample.model_construct(**{k: None if pd.isna(v) else v for k, v in row.items()})
+               for row in X.iloc[500:].to_dict("records")]
+    assert_same_predictions(model, encoder, samples + edge_samples() + _probe_samples(encoder, n=32, seed=1))
+    assert verify_parity(model, encoder)
+
+
+def test_encoder_reads_frozen_blocks(build_model):
+    model = build_model("rf", spatial=True)
+    preproc = model.steps[0][1]
+    assert all(isinstance(t, FrozenEstimator) for name, t, _ in preproc.transformers_ if name != "remainder")
+    encoder = build_fast_encoder(model)
+    # numéricas, one-hot de cada categoría y las tres features espaciales
+    assert len(encoder._numeric) == len(NUMERIC_FEATURES)
+    assert [name for name, _, _ in encoder._categorical] == CATEGORICAL_FEATURES
+    assert len(encoder._spatial) == 1
+
+
+def test_ordinal_unknown_and_missing_codes(build_model):
+    model = build_model("hgb")
+    encoder = build_fast_encoder(model)
+    expected = model.steps[0][1].transform(samples_to_frame(edge_samples()))
+    assert np.array_equal(encoder.encode(edge_samples()), expected, equal_nan=True)
+    # categoría desconocida -> código de desconocidas del OrdinalEncoder
+    l3_col = next(col for name, col, *_ in encoder._ordinal if name == "l3")
+    assert encoder.encode(edge_samples()[1:2])[0, l3_col] == -1
+
+
+def test_unsupported_pipeline_falls_back_to_pandas(build_model):
+    model = build_model("rf")
+    assert build_fast_encoder(model.steps[-1][1]) is None
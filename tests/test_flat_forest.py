@@ -0,0 +1,104 @@
+import json
+import os
+import time
+import numpy as np
+import pytest
+from sklearn.compose import TransformedTargetRegressor
+from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import FunctionTransformer
+from app.utils import model_loader
+from app.utils.flat_forest import (
+    FlatForestRegressor, HybridRegressor, to_native, probe_matrix, export_flat_forest, load_flat_forest,
+)
+
+
+def fitted(model: str, missing: bool = False, n: int = 800, seed: int = 0) -> tuple[Pipeline, np.ndarray]:
+    """Pipeline(preproc, estimador) como los de trainer.py sobre una matriz sintética, y filas de test."""
+    rng = np.random.default_rng(seed)
+    X = rng.normal(0, 1, size=(n, 6))
+    y = np.exp(10 + X[:, 0] + 0.5 * X[:, 1] * X[:, 2] + rng.normal(0, 0.1, n))
+    if missing:
+        X[rng.random(X.shape) < 0.1] = np.nan
+    if model == "rf":
+        est = TransformedTargetRegressor(
+            regressor=RandomForestRegressor(n_estimators=12, min_samples_split=4, random_state=0),
+            func=np.log1p, inverse_func=np.expm1,
+        )
+    else:
+        est = GradientBoostingRegressor(n_estimators=40, max_depth=3, random_state=0)
+    pipe = Pipeline([("preproc", FunctionTransformer()), ("est", est)])
+    pipe.fit(X[:600], y[:600])
+    return pipe, X[600:]
+
+
+@pytest.mark.parametrize("model_name, missing", [("rf", False), ("rf", True), ("gb", False)])
+def test_native_matches_sklearn(model_name, missing):
+    model, X_test = fitted(model_name, missing)
+    native = to_native(model).steps[-1][1]
+    sklearn_est = model.steps[-1][1]
+    assert isinstance(native, FlatForestRegressor)
+    # filas reales y empates exactos contra los umbrales (float32 vs float64)
+    for X in (X_test, probe_matrix(native, n=512)):
+        assert np.array_equal(native.predict(X), sklearn_est.predict(X))
+    # lotes que cruzan el tamaño de bloque
+    native.chunk_rows = 64
+    assert np.array_equal(native.predict(X_test), sklearn_est.predict(X_test))
+
+
+def test_flat_format_roundtrip_and_other_versions(tmp_path):
+    model, X_test = fitted("rf", missing=True)
+    expected = model.predict(X_test)
+    out_dir = str(tmp_path / "flat")
+    export_flat_forest(model, out_dir)
+    assert np.array_equal(load_flat_forest(out_dir, mmap=True).predict(X_test), expected)
+
+    # cualquier otra versión del formato falla al cargar, sin intentar leer los arrays
+    with open(os.path.join(out_dir, "meta.json")) as f:
+        meta = json.load(f)
+    with open(os.path.join(out_dir, "meta.json"), "w") as f:
+        json.dump({**meta, "format_version": 1}, f)
+    with pytest.raises(ValueError, match="v1 no soportado"):
+        load_flat_forest(out_dir)
+
+
+def test_hybrid_routes_by_batch_size():
+    model, X_test = fitted("gb")
+    hybrid = to_native(model, hybrid_max_rows=16).steps[-1][1]
+    assert isinstance(hybrid, HybridRegressor)
+    calls = []
+    hybrid.native.predict = lambda X: calls.append(X.shape[0]) or np.zeros(X.shape[0])
+    hybrid.predict(X_test[:16])
+    hybrid.predict(X_test[:17])
+    assert calls == [16]
+    with pytest.raises(TypeError):
+        hybrid.fit(X_test)
+
+
+def test_calibrate_keeps_native_only_while_faster():
+    model, X_test = fitted("gb")
+    hybrid = to_native(model, hybrid_max_rows=128).steps[-1][1]
+    native_predict = hybrid.native.predict
+
+    def slow_native(X):
+        # nativo "lento" a partir de 8 filas
+        if X.shape[0] >= 8:
+            time.sleep(0.01)
+        return native_predict(X)
+
+    hybrid.native.predict = slow_native
+    assert hybrid.calibrate(X_test, repeats=1) == 4
+    assert hybrid.max_native_rows == 4
+
+
+@pytest.mark.parametrize("engine", ["native", "auto"])
+def test_select_engine_checks_the_native_engine(monkeypatch, engine):
+    model, X_test = fitted("rf")
+    monkeypatch.setattr(model_loader, "INFERENCE_ENGINE", engine)
+    selected = model_loader._select_engine(model)
+    assert selected is not model
+    assert np.array_equal(selected.predict(X_test), model.predict(X_test))
+
+    # un motor nativo que no coincide con sklearn se descarta también en "auto"
+    monkeypatch.setattr(FlatForestRegressor, "_aggregate", lambda self, leaves: np.zeros(leaves.shape[1]))
+    assert model_loader._select_engine(model) is model
@@ -0,0 +1,23 @@
+import os
+import numpy as np
+import pytest
+from app.utils.jobs import JobContext
+
+'''
+ETAPAS DE UN JOB: el pico de RSS se mide por etapa, no arrastra el de etapas (o jobs) anteriores
+del mismo proceso del pool.
+'''
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/clear_refs"), reason="sin /proc/self/clear_refs")
+def test_stage_peak_rss_is_measured_per_stage():
+    job = JobContext.local("train")
+    with job.stage("fit_rf"):
+        block = np.ones(300 * 1024 ** 2 // 8)
+        del block
+    with job.stage("fit_gb"):
+        np.ones(1024)
+
+    big, small = job._state["stages"]
+    assert big["peak_rss_mb"] - small["peak_rss_mb"] > 250
+    assert big["python_peak_mb"] is None
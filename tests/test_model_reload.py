@@ -0,0 +1,50 @@
+import pytest
+from app.utils import model_loader
+
+'''
+RECARGA DEL MODELO: el precalentamiento usa filas con valores del modelo y, si falla,
+la versión nueva se activa igual (es solo una optimización).
+'''
+
+
+@pytest.fixture
+def reload(monkeypatch, build_model):
+    """load_model(force_reload=True) sobre un Pipeline en memoria, sin FastEncoder ni índices."""
+    model = build_model("rf")
+    monkeypatch.setattr(model_loader, "_read_model", lambda: (model, "test.joblib"))
+    monkeypatch.setattr(model_loader, "FAST_ENCODER_ENABLED", False)
+    monkeypatch.setattr(model_loader, "PREDICTION_INTERVALS_ENABLED", False)
+    monkeypatch.setattr(model_loader, "SEGMENT_MODELS_ENABLED", False)
+    monkeypatch.setattr(model_loader, "COMPARABLES_ENABLED", False)
+    monkeypatch.setattr(model_loader, "_active", None)
+
+    def load():
+        model_loader.load_model(force_reload=True)
+        return model_loader.get_active_version()
+    return model, load
+
+
+def test_reload_without_encoder_warms_up_with_model_values(reload, listings, monkeypatch):
+    model, load = reload
+    frames = []
+    predict = model.predict
+    monkeypatch.setattr(model, "predict", lambda X: frames.append(X) or predict(X))
+
+    version = load()
+    assert version.encoder is None and version.model is model
+    assert [len(X) for X in frames] == [1, model_loader.MODEL_WARMUP_ROWS]
+    warm = frames[1]
+    # filas con medianas y categorías del train, no filas enteras de None
+    assert warm["surface_total"].notna().any()
+    assert warm["l3"].isin(listings[0]["l3"].dropna().unique()).any()
+
+
+def test_failed_warm_up_still_activates_the_version(reload, monkeypatch):
+    model, load = reload
+
+    def broken(X):
+        raise ValueError("fallo en el precalentamiento")
+
+    monkeypatch.setattr(model, "predict", broken)
+    version = load()
+    assert version is not None and version.model is model
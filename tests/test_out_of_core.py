@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+from app.processing.out_of_core import TRAIN_WHERE, build_preprocessor, build_preprocessors_by
+from app.processing.trainer import NUMERIC_FEATURES, CATEGORICAL_FEATURES
+from app.utils.db import connection, get_pool
+
+'''
+PREPROCESAMIENTO EN STREAMING POR GRUPOS: una sola pasada sobre datos_clean ajusta los bloques de
+cada segmento igual que un build_preprocessor filtrado por ese segmento.
+'''
+
+SEGMENT_BY = ["operation_type"]
+CATEGORICAL = [c for c in CATEGORICAL_FEATURES if c not in SEGMENT_BY]
+
+
+@pytest.fixture
+def con(listings, tmp_path):
+    X, y = listings
+    path = str(tmp_path / "clean.duckdb")
+    frame = X.assign(id=np.arange(len(X)), price=y)
+    with connection(path) as con:
+        con.execute("CREATE TABLE datos_clean AS SELECT * FROM frame")
+        yield con
+    get_pool(path).close()
+
+
+def test_grouped_preprocessors_match_one_pass_per_group(con):
+    grouped = build_preprocessors_by(con, NUMERIC_FEATURES, CATEGORICAL, SEGMENT_BY)
+    assert set(grouped) == {("Venta",), ("Alquiler",)}
+    for (operation,), (preproc, n_train) in grouped.items():
+        where = f"{TRAIN_WHERE} AND operation_type = '{operation}'"
+        expected, expected_rows = build_preprocessor(con, NUMERIC_FEATURES, CATEGORICAL, where)
+        assert n_train == expected_rows
+        X = con.execute(f"SELECT * FROM datos_clean WHERE {where}").df()
+        assert np.allclose(preproc.transform(X), expected.transform(X), equal_nan=True)
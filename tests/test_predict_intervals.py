@@ -0,0 +1,63 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from app.routers import predict
+from app.utils.metrics import MetricsMiddleware, PREDICTION_FAILURES, PREDICT_STAGE_LATENCY
+from app.utils.model_loader import ModelVersion, _compile_encoder, _build_interval
+
+SAMPLE = {"surface_total": 80, "property_type": "Departamento", "operation_type": "Venta", "l3": "Palermo"}
+
+
+@pytest.fixture
+def serve(monkeypatch):
+    """Cliente de /v1/predict sirviendo el Pipeline dado (sin intervalos de respaldo)."""
+    def client_for(model):
+        encoder = _compile_encoder(model)
+        version = ModelVersion(1, model, encoder, "test", 0.0, interval=_build_interval(model, encoder, "test", fallback=False))
+        monkeypatch.setattr(predict, "get_active_version", lambda: version)
+        app = FastAPI()
+        app.add_middleware(MetricsMiddleware)
+        app.include_router(predict.router)
+        return TestClient(app)
+    return client_for
+
+
+def failures(route: str) -> float:
+    return PREDICTION_FAILURES.labels(predict.router.prefix + route).value()
+
+
+@pytest.mark.parametrize("route, body", [("/", SAMPLE), ("/batch", [SAMPLE, SAMPLE])])
+def test_interval_without_random_forest_is_a_conflict(serve, build_model, route, body):
+    client = serve(build_model("gb"))
+    before = failures(route)
+    response = client.post(f"/v1/predict{route}", params={"interval": "true"}, json=body)
+    assert response.status_code == 409
+    assert "no da intervalos" in response.json()["detail"]
+    # no es una falla del modelo
+    assert failures(route) == before
+    # sin interval=true el mismo modelo responde
+    assert client.post(f"/v1/predict{route}", json=body).status_code == 200
+
+
+def serialized(route: str) -> int:
+    cumulative, _ = PREDICT_STAGE_LATENCY.labels(predict.router.prefix + route, "serialization").snapshot()
+    return cumulative[-1]
+
+
+@pytest.mark.parametrize("route, body", [("/", SAMPLE), ("/batch", [SAMPLE, SAMPLE])])
+def test_error_responses_record_the_serialization_stage(serve, build_model, monkeypatch, route, body):
+    client = serve(build_model("gb"))
+    before = serialized(route)
+    # 409 (sin intervalos) y 503 (sin modelo) también cierran la etapa del endpoint
+    assert client.post(f"/v1/predict{route}", params={"interval": "true"}, json=body).status_code == 409
+    monkeypatch.setattr(predict, "get_active_version", lambda: None)
+    assert client.post(f"/v1/predict{route}", json=body).status_code == 503
+    assert serialized(route) == before + 2
+
+
+def test_interval_with_random_forest(serve, build_model):
+    client = serve(build_model("rf"))
+    response = client.post("/v1/predict/", params={"interval": "true"}, json=SAMPLE)
+    assert response.status_code == 200
+    band = response.json()["interval"]
+    assert band["lower"] <= response.json()["predicted_price"] <= band["upper"]
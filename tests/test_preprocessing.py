@@ -0,0 +1,38 @@
+import pytest
+from app.processing import preprocessing
+from app.processing.preprocessing import shared_features
+from app.processing.trainer import NUMERIC_FEATURES, CATEGORICAL_FEATURES
+
+'''
+CACHÉ DEL PREPROCESAMIENTO COMPARTIDO: la clave cubre los datos y la configuración de los bloques,
+así que una entrada armada con otro layout u otros encoders nunca se reutiliza.
+'''
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(preprocessing, "PREPROC_CACHE_ENABLED", True)
+    monkeypatch.setattr(preprocessing, "PREPROC_CACHE_DIR", str(tmp_path))
+
+
+def shared(listings, layout="compact"):
+    X, _ = listings
+    return shared_features(X.iloc[:500], X.iloc[500:], NUMERIC_FEATURES, CATEGORICAL_FEATURES, layout=layout)
+
+
+def test_cache_key_follows_the_block_configuration(cache, listings, monkeypatch):
+    first = shared(listings)
+    assert not first.cached and shared(listings).cached
+    assert not shared(listings, layout="dense").cached
+
+    # mismo kind y layout con otros parámetros del one-hot: otra clave
+    build = preprocessing.build_shared_blocks
+
+    def build_limited(kind="onehot", layout="dense"):
+        num, cat = build(kind, layout)
+        cat.set_params(ohe__max_categories=3)
+        return num, cat
+
+    monkeypatch.setattr(preprocessing, "build_shared_blocks", build_limited)
+    changed = shared(listings)
+    assert not changed.cached and changed.key != first.key
@@ -0,0 +1,45 @@
+import json
+import pytest
+from app.processing import trainer
+from app.utils import model_loader
+
+
+@pytest.fixture
+def artifacts(tmp_path, monkeypatch):
+    """Manifiesto e índice de segmentos en un directorio temporal."""
+    manifest_path, index_path = tmp_path / "manifest.json", tmp_path / "index.json"
+    for module in (trainer, model_loader):
+        monkeypatch.setattr(module, "MANIFEST_PATH", str(manifest_path))
+    monkeypatch.setattr(model_loader, "SEGMENTS_INDEX_PATH", str(index_path))
+    monkeypatch.setattr(model_loader, "SEGMENT_MODELS_ENABLED", True)
+
+    def write(promoted_id, index_id):
+        manifest_path.write_text(json.dumps({"promoted": {"name": "RandomForest", "promotion_id": promoted_id}}))
+        index_path.write_text(json.dumps({
+            "segment_by": ["operation_type"], "promotion_id": index_id,
+            "segments": [{"key": {"operation_type": "Venta"}, "path": "venta.joblib", "flat_path": None}],
+        }))
+    return write
+
+
+def test_segments_route_while_their_promotion_is_active(artifacts):
+    artifacts("20260101_000000_000000", "20260101_000000_000000")
+    segments = model_loader._read_segments()
+    assert segments is not None and segments.segment_by == ["operation_type"]
+
+
+def test_new_promotion_retires_the_segment_index(artifacts):
+    # entrenamiento por segmento sobre la promoción A, después POST /v1/train/ promueve B
+    artifacts("20260102_000000_000000", "20260101_000000_000000")
+    assert model_loader._read_segments() is None
+
+
+def test_promote_model_returns_a_new_id(tmp_path, artifacts):
+    source = tmp_path / "model.joblib"
+    source.write_bytes(b"modelo")
+    first = trainer.promote_model(str(source), dest_path=str(tmp_path / "best.joblib"))
+    second = trainer.promote_model(str(source), dest_path=str(tmp_path / "best.joblib"))
+    assert first != second
+    artifacts(second, first)
+    assert trainer.current_promotion_id() == second
+    assert model_loader._read_segments() is None
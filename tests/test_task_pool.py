@@ -0,0 +1,85 @@
+import time
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from app.routers import predict, training
+from app.utils import jobs, task_pool
+from app.utils.model_loader import ModelVersion, _compile_encoder
+
+SAMPLE = {"surface_total": 80, "property_type": "Departamento", "operation_type": "Venta", "l3": "Palermo"}
+BUSY_SECONDS = 4.0
+# cuánto pueden empeorar p50 / p95 de /v1/predict/ con el entrenamiento corriendo, respecto de sin él
+MAX_P50_RATIO = 3.0
+MAX_P95_RATIO = 5.0
+
+
+def predict_latencies(api, seconds: float) -> np.ndarray:
+    """Latencias de /v1/predict/ pedidas una detrás de otra durante seconds."""
+    latencies = []
+    window_end = time.perf_counter() + seconds
+    while time.perf_counter() < window_end:
+        start = time.perf_counter()
+        response = api.post("/v1/predict/", json=SAMPLE)
+        latencies.append(time.perf_counter() - start)
+        assert response.status_code == 200
+    return np.array(latencies)
+
+
+def busy_training(job=None, search=None, model_b=None):
+    """Entrenamiento de mentira para el pool: ocupa la CPU del proceso hijo como un fit largo."""
+    with job.stage("fit_rf"):
+        deadline = time.perf_counter() + BUSY_SECONDS
+        while time.perf_counter() < deadline:
+            np.linalg.svd(np.random.default_rng(0).normal(size=(120, 120)))
+    return {"status": "ok", "message": "listo"}
+
+
+@pytest.fixture
+def api(monkeypatch, tmp_path, build_model):
+    model = build_model("rf")
+    version = ModelVersion(1, model, _compile_encoder(model), "test", 0.0)
+    monkeypatch.setattr(predict, "get_active_version", lambda: version)
+    monkeypatch.setattr(training, "run_training_pipeline", busy_training)
+    monkeypatch.setattr(training, "reload_after_training", lambda result: None)
+    monkeypatch.setattr(jobs, "METRICS_DB_PATH", str(tmp_path / "experimento.duckdb"))
+    app = FastAPI()
+    app.include_router(predict.router)
+    app.include_router(training.router)
+    yield TestClient(app)
+    task_pool.shutdown_pool()
+    jobs.shutdown_jobs()
+
+
+def test_predict_keeps_answering_while_training_runs_in_the_pool(api):
+    # línea base: mismas predicciones sin entrenamiento
+    baseline = predict_latencies(api, BUSY_SECONDS / 2)
+
+    first = api.post("/v1/train/", params={"mode": "memory"})
+    assert first.status_code == 202
+
+    # segundo disparo con el entrenamiento en curso
+    second = api.post("/v1/train/", params={"mode": "memory"})
+    assert second.status_code == 409
+    assert "train" in second.json()["detail"]
+
+    job_id = first.json()["job_id"]
+    deadline = time.time() + 60
+    while jobs.get_job(job_id)["status"] != "running" and time.time() < deadline:
+        time.sleep(0.05)
+    assert jobs.get_job(job_id)["status"] == "running"
+
+    # mientras el hijo ocupa la CPU, las predicciones se siguen respondiendo en el proceso de la API
+    during = predict_latencies(api, BUSY_SECONDS / 2)
+    assert "train" in task_pool.running_tasks()
+    assert len(during) >= 10
+    base_p50, base_p95 = np.percentile(baseline, [50, 95])
+    p50, p95 = np.percentile(during, [50, 95])
+    assert p50 <= MAX_P50_RATIO * base_p50, (p50, base_p50)
+    assert p95 <= MAX_P95_RATIO * base_p95, (p95, base_p95)
+
+    deadline = time.time() + 60
+    while jobs.get_job(job_id)["status"] == "running" and time.time() < deadline:
+        time.sleep(0.1)
+    assert jobs.get_job(job_id)["status"] == "succeeded"
+    assert task_pool.running_tasks() == []